@@ -0,0 +1,255 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Time and memory-profile every stage of the   #
+# pipeline on synthetic data (see synthetic_data), and    #
+# store the results in a json file so that regressions    #
+# can be found by comparing against an earlier run.       #
+#                                                         #
+# python benchmark.py [--days 14] [--pumps 1]             #
+#        [--output benchmark.json] [--compare old.json]   #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import tracemalloc
+import subprocess
+import warnings
+warnings.filterwarnings('ignore')
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+import synthetic_data
+
+
+def measure(run, setup=None, repeat=3):
+    """
+    Runs run(*setup()) once under tracemalloc and then repeat times timed. setup is
+    not timed, use it to copy inputs that run changes in place.
+
+    Returns the result of the last run, the best and mean time in seconds and the
+    peak memory allocated by run in megabytes.
+    """
+    setup = setup if setup is not None else tuple
+
+    # Memory is measured separately, as tracing slows down the run. This also
+    # warms up caches (e.g. preprocessing.get_area_table()), so all timed runs are alike
+    args = setup()
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = []
+    for i in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        result = run(*args)
+        seconds += [time.perf_counter() - start]
+
+    return result, min(seconds), float(np.mean(seconds)), peak / 2**20
+
+
+class benchmark:
+    """
+    Runs the stages of the pipeline one after the other, on the data generated by
+    synthetic_data.generate(...), and collects their timings.
+
+    ~~~~~ INPUT  ~~~~~
+    paths:    Dictionary as returned by synthetic_data.generate(...)
+    repeat:   Number of timed runs per stage
+    skip:     Names of stages not to run. Stages whose output is used by later stages
+              are still run once, untimed.
+    solver:   Solver used to train the flow model, see flow_model.StochasticGradientDescent()
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    results = benchmark(synthetic_data.generate("C:/mypath/synthetic")).run()
+    """
+    def __init__(self, paths, repeat=3, skip=None, solver="cholesky"):
+        self.paths = paths
+        self.repeat = repeat
+        self.skip = set(skip) if skip is not None else set()
+        self.solver = solver
+        self.results = []
+
+    def stage(self, name, run, setup=None, rows=None, output=False):
+        """
+        Times run (see measure()) as stage name. rows is the number of input rows,
+        output whether later stages use the result.
+        """
+        if name in self.skip:
+            return run(*(setup() if setup is not None else ())) if output else None
+
+        result, best, mean, peak = measure(run, setup=setup, repeat=self.repeat)
+        self.results += [{"name": name, "rows": rows, "repeat": self.repeat,
+                          "seconds": best, "mean_seconds": mean, "peak_memory_mb": peak}]
+
+        print("{:<40} {:>10.4f}s {:>10.1f}MB".format(name, best, peak))
+
+        return result
+
+    def run(self):
+        import load_files as lf
+        import preprocessing as pre
+        import data_imputation as impu
+        import measurement_analysis as mea
+        import flow_level_conversion as flc
+        import flow_model as fm
+
+        paths = self.paths
+        stage = self.stage
+
+        # LOADING
+        flow_raw, level_raw = stage("get_measurements",
+                                    lambda: lf.get_measurements(paths["measurements"]["Drunen"]), output=True)
+        if "Bokhoven" in paths["historian"]:
+            # load_all_pumps() only recognises the historian folders of Bokhoven
+            stage("load_all_pumps (historian)",
+                  lambda: lf.load_all_pumps(paths["historian"]["Bokhoven"][1]))
+        rain_raw = stage("get_rain", lambda: lf.get_rain(paths["rain_data"]), output=True)
+        rain_prediction = stage("get_rain_prediction",
+                                lambda: lf.get_rain_prediction(paths["rain_prediction"], reduce_grid=True),
+                                output=True)
+        area_data = stage("sdf", lambda: lf.sdf(paths["shape_files"]).area_data, output=True)
+
+        # PREPROCESSING
+        flow_clean = stage("clean_mes_data (flow)", pre.clean_mes_data,
+                           setup=lambda: (flow_raw.copy(),), rows=len(flow_raw), output=True)
+        level_clean = stage("clean_mes_data (level)", pre.clean_mes_data,
+                            setup=lambda: (level_raw.copy(),), rows=len(level_raw), output=True)
+
+        flow_merged, level_merged = pre.merge_flow_level(flow_clean, level_clean)
+        stage("fill_level", pre.fill_level, setup=lambda: (level_merged.copy(),), rows=len(level_merged))
+        flow_filled = pre.fill_flow(flow_merged.copy())
+
+        hourly_flow = stage("flow_by_hour", pre.flow_by_hour, setup=lambda: (flow_filled,), rows=len(flow_filled),
+                            output=True)
+        stage("match_by_timestamp", lambda: pre.match_by_timestamp(rain_prediction, hourly_flow, multiple=True,
+                                                                   steps=12),
+              rows=len(hourly_flow))
+        stage("summarize_rain_data", pre.summarize_rain_data,
+              setup=lambda: (rain_raw.copy(), area_data, "DRU"), rows=len(rain_raw))
+
+        # IMPUTATION
+        stage("data_imputation.fill_flow", impu.fill_flow, setup=lambda: (flow_clean, level_clean),
+              rows=len(flow_merged))
+
+        # DWAAS TABLE
+        analysis = stage("measurement_analysis",
+                         lambda f, l, r: mea.measurement_analysis(f, l, r, area_data=area_data, village_code="DRU"),
+                         setup=lambda: (flow_raw.copy(), level_raw.copy(), rain_raw.copy()), rows=len(flow_raw),
+                         output=True)
+        if analysis is not None:
+            stage("compare_flow", analysis.compare_flow, rows=len(flow_raw))
+
+        # FLOW LEVEL COEFFICIENT
+        stage("add_groups", lambda coefficient: coefficient.add_groups(),
+              setup=lambda: (flc.generate_coefficient(flow_raw.copy(), level_raw.copy()),), rows=len(flow_merged))
+
+        # FLOW MODEL
+        model = stage("flow_model", lambda f, l: fm.flow_model(f, l, rain_prediction),
+                      setup=lambda: (flow_raw.copy(), level_raw.copy()), rows=len(flow_raw), output=True)
+        if model is not None:
+            stage("flow_model training ({})".format(self.solver),
+                  lambda: model.StochasticGradientDescent(solver=self.solver), rows=len(model.y))
+
+        return self.results
+
+
+def git_commit():
+    """
+    Commit of the code that is benchmarked, None if it is not known.
+    """
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance=1.25, min_seconds=0.05, min_memory_mb=1):
+    """
+    Prints the time and peak memory of every stage relative to baseline (the results
+    of an earlier run). Returns the names of the stages that became more than
+    tolerance times slower or larger. Stages faster than min_seconds or smaller than
+    min_memory_mb are too noisy to count as a regression.
+    """
+    if results["scale"] != baseline["scale"]:
+        print("(!) Baseline was run at a different scale: {}".format(baseline["scale"]))
+
+    baseline = {i["name"]: i for i in baseline["results"]}
+
+    regressions = []
+    print("{:<40} {:>10} {:>10}".format("stage", "time", "memory"))
+    for i in results["results"]:
+        if i["name"] not in baseline:
+            continue
+        old = baseline[i["name"]]
+
+        time_ratio = i["seconds"] / max(old["seconds"], 1e-9)
+        memory_ratio = i["peak_memory_mb"] / max(old["peak_memory_mb"], 1e-9)
+        regressed = (time_ratio > tolerance and i["seconds"] >= min_seconds) or\
+                    (memory_ratio > tolerance and i["peak_memory_mb"] >= min_memory_mb)
+        if regressed:
+            regressions += [i["name"]]
+
+        print("{:<40} {:>9.2f}x {:>9.2f}x{}".format(i["name"], time_ratio, memory_ratio,
+                                                    "  REGRESSION" if regressed else ""))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="folder with data from synthetic_data.generate(), or where to "
+                                       "generate it. By default a temporary folder is used")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--pumps", type=int, default=1)
+    parser.add_argument("--sampling", type=int, default=60, help="seconds between measurements")
+    parser.add_argument("--areas", type=int, default=6, help="sub-catchments per pump")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--solver", default="cholesky")
+    parser.add_argument("--skip", nargs="*", default=[], help="names of stages not to time")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="json file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    scale = {"days": args.days, "pumps": args.pumps, "sampling": args.sampling, "areas": args.areas,
+             "seed": args.seed}
+
+    path = args.data if args.data is not None else tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        paths = synthetic_data.generate(path, **scale)
+        print("Generated data in {:.1f}s".format(time.perf_counter() - start))
+
+        results = benchmark(paths, repeat=args.repeat, skip=args.skip, solver=args.solver).run()
+    finally:
+        if args.data is None:
+            shutil.rmtree(path, ignore_errors=True)
+
+    results = {"created": datetime.datetime.now().isoformat(),
+               "commit": git_commit(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "versions": {"numpy": np.__version__, "pandas": pd.__version__},
+               "scale": scale,
+               "results": results}
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), tolerance=args.tolerance)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,119 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Cross validate models in parallel, sharing   #
+# the data set read-only between worker processes.        #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+
+def kfold_splits(n, folds=10):
+    """
+    Splits range(n) in folds consecutive test sets, training on all other indices.
+    Same as sklearn.model_selection.KFold(folds) without shuffling: the first n % folds
+    test sets have one index more than the others.
+    """
+    sizes = np.full(folds, n // folds)
+    sizes[:n % folds] += 1
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+
+    return [(np.concatenate((np.arange(0, i), np.arange(j, n))), np.arange(i, j))
+            for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+def forward_chaining_splits(n, folds=10):
+    """
+    Time series aware splits. range(n) is cut in folds+1 consecutive blocks, fold k
+    trains on blocks 0, ..., k and tests on block k+1. Data needs to be sorted by time.
+    """
+    bounds = np.linspace(0, n, folds + 2).astype(int)
+
+    return [(np.arange(0, i), np.arange(i, j)) for i, j in zip(bounds[1:-1], bounds[2:])]
+
+
+SPLITS = {"kfold": kfold_splits,
+          "forward": forward_chaining_splits}
+
+
+# Data set of a worker process, opened once by _init_worker
+_shared = {}
+
+
+def _init_worker(X_path, X_shape, X_dtype, y_path, y_shape, y_dtype):
+    _shared["X"] = np.memmap(X_path, mode="r", shape=X_shape, dtype=X_dtype)
+    _shared["y"] = np.memmap(y_path, mode="r", shape=y_shape, dtype=y_dtype)
+
+
+def _run_fold(args):
+    fit_fold, train, test = args
+    X, y = _shared["X"], _shared["y"]
+
+    return _score_fold(fit_fold, X, y, train, test)
+
+
+def _score_fold(fit_fold, X, y, train, test):
+    # Contiguous index ranges are sliced, so no copy of X is made
+    def select(a, indices):
+        if len(indices) > 0 and indices[-1] - indices[0] == len(indices) - 1:
+            return a[indices[0]:(indices[-1] + 1)]
+        return a[indices]
+
+    return fit_fold(select(X, train), select(y, train), select(X, test), select(y, test))
+
+
+def cross_validate(X, y, fit_fold, folds=10, split="kfold", n_jobs=None):
+    """
+    Cross validates a model on X, y.
+
+    ~~~~~ INPUT  ~~~~~
+    fit_fold:  Function (X_train, y_train, X_test, y_test) -> score that trains a model
+               and scores it on the test set. Has to be picklable (a module level
+               function, possibly wrapped in functools.partial) if n_jobs != 1.
+    folds:     Number of folds
+    split:     'kfold' or 'forward' (forward chaining, for time series)
+    n_jobs:    Number of worker processes, None uses all cores, 1 runs in this process.
+
+    ~~~~~ OUTPUT ~~~~~
+    List of the scores of all folds.
+
+    Workers read X and y from a memory-mapped copy on disk, so the data set is
+    written once instead of being pickled for every fold.
+    """
+    splits = SPLITS[split](len(y), folds)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, len(splits))
+
+    if n_jobs == 1:
+        return [_score_fold(fit_fold, X, y, train, test) for train, test in splits]
+
+    X = np.ascontiguousarray(X)
+    y = np.ascontiguousarray(y)
+
+    directory = tempfile.mkdtemp(prefix="cv_")
+    try:
+        # Write data set to memory-mapped files, to be shared with all workers
+        init_args = ()
+        for name, a in [("X", X), ("y", y)]:
+            path = os.path.join(directory, name + ".dat")
+            shared = np.memmap(path, mode="w+", shape=a.shape, dtype=a.dtype)
+            shared[:] = a
+            shared.flush()
+            del shared
+            init_args += (path, a.shape, a.dtype.str)
+
+        pool = multiprocessing.Pool(n_jobs, initializer=_init_worker, initargs=init_args)
+        try:
+            scores = pool.map(_run_fold, [(fit_fold, train, test) for train, test in splits], chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return scores
@@ -3,8 +3,8 @@
 # on the level and slope of level at this time.           #
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
 
-import load_files as lf
 import preprocessing
+import instrumentation
 import numpy as np
 import pandas as pd
 
@@ -30,6 +30,7 @@ def check_monotonicity(x, epsilon = 3):
         return 0      # Extremum
 
 
+@instrumentation.instrument
 def calc_monotonicity(data, horizon = 5, epsilon = 3):
     """
     Calculates the monotonicity within a sliding window.
@@ -97,6 +98,7 @@ def fill_flow_apply(row, flow_data, level_data, on_level, epsilon = 0.01):
             return np.mean(flow_values)
 
 
+@instrumentation.instrument
 def fill_flow(flow_data, level_data, epsilon=0.01, beta=4, horizon=5):
     """
     Function that applies fill_flow_apply (which operates on non-imputed data frames) to the missing values.
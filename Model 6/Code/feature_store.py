@@ -0,0 +1,147 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Cache constructed data sets on disk, keyed   #
+# by the content of the input data and the parameters,    #
+# so they only have to be built once.                     #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(*inputs, **params):
+    """
+    Returns a hex digest identifying the content of inputs (data frames, series,
+    numpy arrays, tuples/lists of these or plain values) and params.
+    """
+    digest = hashlib.sha1()
+
+    def update(obj):
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            columns = list(obj.columns) if isinstance(obj, pd.DataFrame) else [obj.name]
+            digest.update(repr((type(obj).__name__, obj.shape, columns)).encode())
+            digest.update(pd.util.hash_pandas_object(obj, index=False).values.tobytes())
+        elif isinstance(obj, np.ndarray):
+            digest.update(repr((obj.shape, obj.dtype.str)).encode())
+            digest.update(np.ascontiguousarray(obj).tobytes())
+        elif isinstance(obj, (tuple, list)):
+            digest.update(repr((type(obj).__name__, len(obj))).encode())
+            for i in obj:
+                update(i)
+        else:
+            digest.update(repr(obj).encode())
+
+    for i in inputs:
+        update(i)
+    for i in sorted(params):
+        update((i, params[i]))
+
+    return digest.hexdigest()
+
+
+class feature_store:
+    """
+    Size-bounded, least recently used cache of numpy arrays on disk.
+    Every entry is a folder named by its key holding one .npy file per array
+    and the meta data as json. Arrays can be reloaded memory-mapped.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    store = feature_store("C:/mypath/feature_cache", max_size=10 * 2**30)
+    key = fingerprint(flow_data, level_data, padding=5)
+    entry = store.get(key)
+    if entry is None:
+        store.put(key, {"X": X, "y": y}, meta={"columns": columns})
+    """
+    def __init__(self, path, max_size=10 * 2**30):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self.path = path
+        self.max_size = max_size
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._entry_path(key), "meta.json"))
+
+    def get(self, key, mmap=True):
+        """
+        Returns a tuple (arrays, meta) of the entry key, or None if it is not cached.
+        Arrays are opened read-only memory-mapped if mmap is True.
+        """
+        if key not in self:
+            return None
+
+        entry_path = self._entry_path(key)
+        meta = json.load(open(os.path.join(entry_path, "meta.json")))
+        arrays = {i: np.load(os.path.join(entry_path, i + ".npy"), mmap_mode="r" if mmap else None)
+                  for i in meta["arrays"]}
+
+        # Mark as recently used
+        os.utime(entry_path, None)
+
+        return arrays, meta["meta"]
+
+    def put(self, key, arrays, meta=None):
+        """
+        Stores a dictionary of numpy arrays (and json serializable meta data) under key,
+        then evicts least recently used entries while the cache exceeds max_size.
+        """
+        entry_path = self._entry_path(key)
+        temp_path = entry_path + ".tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+
+        for i, j in arrays.items():
+            np.save(os.path.join(temp_path, i + ".npy"), np.asarray(j))
+        json.dump({"arrays": list(arrays), "meta": meta}, open(os.path.join(temp_path, "meta.json"), "w"))
+
+        # Written completely before becoming visible
+        shutil.rmtree(entry_path, ignore_errors=True)
+        os.rename(temp_path, entry_path)
+
+        self.evict(keep=key)
+
+    def size(self):
+        """
+        Total size of all entries in bytes.
+        """
+        return sum(i[2] for i in self._entries())
+
+    def _entries(self):
+        """
+        List of (last used time, key, size in bytes) of all entries.
+        """
+        entries = []
+        for i in os.listdir(self.path):
+            entry_path = self._entry_path(i)
+            if i.endswith(".tmp") or not os.path.isdir(entry_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_path, j)) for j in os.listdir(entry_path))
+            entries.append((os.path.getmtime(entry_path), i, size))
+
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries (except keep) until the cache fits max_size.
+        """
+        entries = sorted(self._entries())
+        total = sum(i[2] for i in entries)
+
+        for _, key, size in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, key, _ in self._entries():
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
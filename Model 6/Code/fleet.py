@@ -0,0 +1,317 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Run the analysis (cleaning, DWAAS table,     #
+# imputation and flow model) for every pumping station    #
+# found in the data at the same time, on worker           #
+# processes. Rain data and rain prediction grids are      #
+# loaded once and shared with all workers.                #
+#                                                         #
+# python fleet.py --data D:/DC3 [--output report]         #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import concurrent.futures
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+import load_files
+import preprocessing
+import utility
+import schema
+import pipeline
+
+
+JOBS = ["dwaas", "impute", "model"]
+
+
+# Folders (anywhere under path/sewer_data) with measurements of several stations, as read by
+# load_files.load_all_pumps(): level of the small pumps, flow of the small pumps and flow of the WWTP
+SHARED_FOLDERS = ["data_pump_level", "data_pump_flow", "data_wwtp_flow"]
+
+
+def _shared_folders(sewer_path):
+    # Folders with csv files below a folder named in SHARED_FOLDERS, per name
+    found = {i: [] for i in SHARED_FOLDERS}
+    for folder, _, files in sorted(os.walk(sewer_path)):
+        kinds = [i for i in SHARED_FOLDERS if i in folder]
+        if kinds and any(".csv" in i for i in files):
+            found[kinds[0]].append(folder)
+
+    return found
+
+
+def discover_stations(path):
+    """
+    Finds the measurement folders of all stations in path/sewer_data.
+
+    Pumps with a known RG code (load_files.pump_to_id_dict) in sewer_data/data_pump: folders
+    'RG<code>' hold measurements in the old format, folders 'RG<code>_Q0' and 'RG<code>_L0'
+    flow and level in the historian format. The old format is used if a pump has both.
+
+    Small pumps and the WWTP, from the folders in SHARED_FOLDERS ('shared' format): every small
+    pump of load_files.load_all_pumps() gets its level from data_pump_level and its flow from
+    data_pump_flow, every folder of data_wwtp_flow is a WWTP ('WWTP', or 'WWTP <code>' if there
+    are several), which has flow measurements only. Maaspoort and De Rompert have the same RG
+    code (501) in load_files.pump_to_id_dict, so their measurements can not be told apart;
+    they are left out until they have codes of their own.
+
+    Returns a dictionary of station name to a dictionary with 'rg_id', 'format' and 'folders'
+    (for the shared format also the 'flow' and 'level' folders).
+    """
+    sewer_path = os.path.join(path, "sewer_data")
+    data_path = os.path.join(sewer_path, "data_pump")
+
+    names, codes = {}, {}
+    for name, rg_id in load_files.pump_to_id_dict.items():
+        names.setdefault(rg_id, name)
+        codes[rg_id] = codes.get(rg_id, 0) + 1
+
+    stations = {}
+    folders = sorted(utility.listfold(data_path)) if os.path.exists(data_path) else []
+    for folder in folders:
+        match = re.match(r"^RG(\d+)$", folder, flags=re.IGNORECASE)
+        if match and int(match.group(1)) in names:
+            rg_id = int(match.group(1))
+            stations[names[rg_id]] = {"rg_id": rg_id, "format": "old",
+                                      "folders": [os.path.join(data_path, folder)]}
+
+    lowered = {i.lower(): i for i in folders}
+    for rg_id, name in names.items():
+        flow, level = "rg{}_q0".format(rg_id), "rg{}_l0".format(rg_id)
+        if name not in stations and flow in lowered and level in lowered:
+            stations[name] = {"rg_id": rg_id, "format": "historian",
+                              "folders": [os.path.join(data_path, lowered[flow]),
+                                          os.path.join(data_path, lowered[level])]}
+
+    # SMALL PUMPS AND WWTP
+    shared = _shared_folders(sewer_path) if os.path.exists(sewer_path) else {i: [] for i in SHARED_FOLDERS}
+    if shared["data_pump_level"] or shared["data_pump_flow"]:
+        for name in load_files.SMALL_PUMPS:
+            rg_id = load_files.pump_to_id_dict[name]
+            if codes[rg_id] == 1 and name not in stations:
+                stations[name] = {"rg_id": rg_id, "format": "shared",
+                                  "flow": shared["data_pump_flow"], "level": shared["data_pump_level"],
+                                  "folders": shared["data_pump_flow"] + shared["data_pump_level"]}
+
+    for folder in shared["data_wwtp_flow"]:
+        rg_id = load_files.wwtp_id(folder)
+        name = "WWTP" if len(shared["data_wwtp_flow"]) == 1 else "WWTP {}".format(rg_id)
+        stations[name] = {"rg_id": rg_id, "format": "shared", "flow": [folder], "level": [], "folders": [folder]}
+
+    return stations
+
+
+def load_station(station):
+    """
+    Flow and level measurements of a station found by discover_stations().
+    """
+    if station["format"] == "old":
+        return load_files.get_measurements(station["folders"][0])
+
+    if station["format"] == "shared":
+        # Folders hold several stations, only the rows of this one are kept
+        data = []
+        for kind in ("flow", "level"):
+            frames = [load_files.load_all_pumps(i) for i in station[kind]]
+            frames = [i.loc[i["RG_ID"] == station["rg_id"]] for i in frames]
+            frame = pd.concat(frames, ignore_index=True) if frames else \
+                    pd.DataFrame({i: pd.Series(dtype=j) for i, j in schema.MEASUREMENT_SCHEMA.items()})
+            if not pd.api.types.is_datetime64_any_dtype(frame["TimeStamp"]):
+                frame["TimeStamp"] = pd.to_datetime(frame["TimeStamp"], format="%d-%m-%Y %H:%M:%S")
+            if "DataQuality" not in frame.columns:
+                # The level file of the small pumps has no quality column
+                frame["DataQuality"] = 1
+            data.append(schema.compact(frame[list(schema.MEASUREMENT_SCHEMA)].copy()))
+
+        return tuple(data)
+
+    flow_data, level_data = [load_files.load_all_pumps(i, convert_time=False) for i in station["folders"]]
+    for i in (flow_data, level_data):
+        i["TimeStamp"] = pd.to_datetime(i["TimeStamp"])
+
+    return flow_data, level_data
+
+
+def station_size(station):
+    return sum(os.path.getsize(os.path.join(i, j)) for i in station["folders"] for j in os.listdir(i))
+
+
+# Shared data of a worker process, opened once by _init_worker
+_shared = {}
+
+
+def _init_worker(rain_data, area_data, prediction_dates=None, grid_path=None, grid_shape=None, grid_dtype=None):
+    _shared["rain_data"] = rain_data
+    _shared["area_data"] = area_data
+    if grid_path is not None:
+        _shared["rain_prediction"] = (prediction_dates,
+                                      np.memmap(grid_path, mode="r", shape=grid_shape, dtype=grid_dtype))
+
+
+def run_station(name, station, jobs=JOBS, village_code=None, dry_threshold=0, solver="cholesky", output=None):
+    """
+    Runs jobs for one station on the data shared by _init_worker(). A failing job
+    does not stop the other jobs, its error is returned instead. If the data of the
+    station cannot be loaded no jobs run and the error is returned under 'load'.
+
+    Returns a dictionary with the results, the seconds and the errors per job. If output is
+    given the trained forecaster is saved there (see flow_model.flow_forecaster.save())
+    and its path is returned instead.
+    """
+    village_code = village_code if village_code is not None else name[:3].upper()
+    results, seconds, errors = {}, {}, {}
+
+    start = time.perf_counter()
+    try:
+        measurements = pipeline.clean(load_station(station))
+    except Exception as error:
+        errors["load"] = "{}: {}".format(type(error).__name__, error)
+        jobs, measurements = [], ([], [])
+    seconds["load"] = time.perf_counter() - start
+
+    for job in jobs:
+        start = time.perf_counter()
+        try:
+            if job == "dwaas":
+                rain_summary = pipeline.summarize_rain(_shared["rain_data"], _shared["area_data"], village_code,
+                                                       dry_threshold)
+                results[job] = pipeline.dwaas(measurements, rain_summary, _shared["area_data"], village_code,
+                                              dry_threshold)
+            elif job == "impute":
+                results[job] = pipeline.impute(measurements)
+            elif job == "model":
+                if name not in preprocessing.rg_spots:
+                    raise KeyError("No location of '{}' in preprocessing.rg_spots".format(name))
+
+                forecaster = pipeline.model(measurements, _shared["rain_prediction"], name, solver)
+                if output is not None:
+                    forecaster.save(os.path.join(output, "forecaster_" + name))
+                    forecaster = os.path.join(output, "forecaster_" + name + ".p")
+                results[job] = forecaster
+            else:
+                raise ValueError("Unknown job '{}'".format(job))
+        except Exception as error:
+            errors[job] = "{}: {}".format(type(error).__name__, error)
+        seconds[job] = time.perf_counter() - start
+
+    return {"name": name, "village_code": village_code, "rows": len(measurements[0]) + len(measurements[1]),
+            "results": results, "seconds": seconds, "errors": errors}
+
+
+def _run_station(args):
+    return run_station(*args[:2], **args[2])
+
+
+def run_fleet(path, stations=None, jobs=JOBS, n_jobs=None, dry_threshold=0, solver="cholesky", output=None):
+    """
+    Runs jobs for all stations in path (see discover_stations()) on n_jobs worker processes.
+    Rain data, shape files and rain prediction grids are loaded once; the grids are shared
+    with the workers through a memory-mapped file. The largest stations start first, so the
+    run takes about as long as the slowest station.
+
+    ~~~~~ INPUT  ~~~~~
+    path:      Folder with the data, in the layout of the data share (see main.py)
+    stations:  Names of the stations to run, None runs all stations found
+    jobs:      Jobs per station, from 'dwaas', 'impute' and 'model'
+    n_jobs:    Number of worker processes, None uses all cores
+
+    ~~~~~ OUTPUT ~~~~~
+    Dictionary with
+    'summary':  Data frame with per station the rows, seconds per job and errors
+    'dwaas':    DWAAS tables of all stations, with a column 'station'
+    'impute':   Imputed flow per station
+    'model':    Forecaster (or its path, if output is given) per station
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    report = run_fleet("D:/DC3", jobs=["dwaas"])
+    report["dwaas"]
+    """
+    found = discover_stations(path)
+    stations = {i: found[i] for i in (stations if stations is not None else found)}
+    if output is not None and not os.path.exists(output):
+        os.makedirs(output)
+
+    # SHARED DATA
+    params = pipeline.pipeline_params(path)
+    rain_data = pipeline.load_rain(params["rain_data"])
+    area_data = pipeline.load_areas(params["shape_files"])
+
+    directory = tempfile.mkdtemp(prefix="fleet_")
+    try:
+        init_args = (rain_data, area_data)
+        if "model" in jobs:
+            # Write grids to a memory-mapped file, to be shared with all workers
+            prediction_dates, grid = pipeline.load_rain_prediction(params["rain_prediction"])
+            grid_path = os.path.join(directory, "grid.dat")
+            shared = np.memmap(grid_path, mode="w+", shape=grid.shape, dtype=grid.dtype)
+            shared[:] = grid
+            shared.flush()
+            init_args += (prediction_dates, grid_path, grid.shape, grid.dtype.str)
+            del shared, grid
+
+        # Largest stations first
+        order = sorted(stations, key=lambda i: station_size(stations[i]), reverse=True)
+        tasks = [(i, stations[i], {"jobs": jobs, "dry_threshold": dry_threshold, "solver": solver, "output": output})
+                 for i in order]
+
+        n_jobs = min(n_jobs if n_jobs is not None else os.cpu_count() or 1, max(len(tasks), 1))
+        with concurrent.futures.ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=init_args) as pool:
+            outcomes = list(pool.map(_run_station, tasks))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return fleet_report(sorted(outcomes, key=lambda i: i["name"]))
+
+
+def fleet_report(outcomes):
+    """
+    Combines the outcomes of run_station() into one report, see run_fleet().
+    """
+    summary = pd.DataFrame([dict([("station", i["name"]), ("village_code", i["village_code"]), ("rows", i["rows"])] +
+                                 [("seconds_" + j, k) for j, k in i["seconds"].items()] +
+                                 [("errors", "; ".join("{}: {}".format(j, k) for j, k in i["errors"].items()))])
+                            for i in outcomes])
+
+    dwaas = [i["results"]["dwaas"].assign(station=i["name"]) for i in outcomes if "dwaas" in i["results"]]
+    dwaas = pd.concat(dwaas, ignore_index=True) if dwaas else None
+
+    return {"summary": summary,
+            "dwaas": dwaas,
+            "impute": {i["name"]: i["results"]["impute"] for i in outcomes if "impute" in i["results"]},
+            "model": {i["name"]: i["results"]["model"] for i in outcomes if "model" in i["results"]}}
+
+
+if __name__ == "__main__":
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", required=True, help="folder with the data, in the layout of the data share")
+    parser.add_argument("--stations", nargs="*", help="names of the stations to run, by default all found")
+    parser.add_argument("--jobs", nargs="*", default=JOBS, choices=JOBS)
+    parser.add_argument("--workers", type=int, help="number of worker processes")
+    parser.add_argument("--dry-threshold", type=float, default=0)
+    parser.add_argument("--solver", default="cholesky", help="solver of the flow model, see flow_model")
+    parser.add_argument("--output", help="folder to write the report and forecasters to")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = run_fleet(args.data, stations=args.stations, jobs=args.jobs, n_jobs=args.workers,
+                       dry_threshold=args.dry_threshold, solver=args.solver, output=args.output)
+
+    print(report["summary"].to_string(index=False))
+    print("Fleet took {:.1f}s".format(time.perf_counter() - start))
+
+    if args.output is not None:
+        report["summary"].to_csv(os.path.join(args.output, "summary.csv"), index=False)
+        if report["dwaas"] is not None:
+            report["dwaas"].to_csv(os.path.join(args.output, "dwaas.csv"), index=False)
+        for name, imputed in report["impute"].items():
+            imputed.to_csv(os.path.join(args.output, "imputed_flow_" + name + ".csv"), header=["Value"])
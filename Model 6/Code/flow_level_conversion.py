@@ -7,9 +7,24 @@
 
 import pandas as pd
 import numpy as np
-from scipy.signal import find_peaks
 import preprocessing
 import utility
+import instrumentation
+
+
+def fit_coefficient(flow_groups):
+    """
+    Fits 'Flow ~ I + AdjDelta' on the flow peaks in flow_groups (see generate_coefficient.add_groups()),
+    skipping peaks without a finite flow or level change. Returns the intercept and the coefficient.
+    """
+    import linear_model
+
+    flow_groups = flow_groups.loc[np.isfinite(flow_groups["Flow"]) & np.isfinite(flow_groups["AdjDelta"])]
+
+    X = np.column_stack((np.ones(len(flow_groups)), flow_groups["AdjDelta"]))
+    model = linear_model.linear_regression(solver="lstsq").fit(X, flow_groups["Flow"])
+
+    return model.coef[0], model.coef[1]
 
 
 class generate_coefficient:
@@ -24,6 +39,7 @@ class generate_coefficient:
     rather than heuristic thresholds.
     A better adjustment by rain could be beneficial.
     """
+    @instrumentation.instrument
     def __init__(self, flow_data, level_data):
         # Omit minor data defficiencies
         flow_data = preprocessing.clean_mes_data(flow_data)
@@ -43,8 +59,8 @@ class generate_coefficient:
         flow_data["Flow/s"] = flow_data["Flow/s"] / 3600
 
         # Create 'TimeSpan' aka time since last measurement
-        flow_data["TimeSpan"] = flow_data["TimeStamp"].diff(1).apply(lambda i: i.seconds)
-        level_data["TimeSpan"] = level_data["TimeStamp"].diff(1).apply(lambda i: i.seconds)
+        flow_data = preprocessing.add_time_features(flow_data, ["TimeSpan"])
+        level_data = preprocessing.add_time_features(level_data, ["TimeSpan"])
 
         # Calculate Flow
         flow_data["Flow"] = flow_data["Flow/s"] * flow_data["TimeSpan"]
@@ -54,6 +70,7 @@ class generate_coefficient:
         self.level_data = level_data
 
 
+    @instrumentation.instrument
     def to_dry_data(self, rain_data, area_data, min_dry_series=1, village_code=None, dry_threshold=1):
         """
         Readjusts data stored in class to only consider dry days.
@@ -70,14 +87,14 @@ class generate_coefficient:
         dry_days = dry_days.loc[dry_days["DrySeries"] >= min_dry_series, "Date"].reset_index(drop=True)
 
         # Select all dry days
-        self.flow_data = self.flow_data.loc[self.flow_data["TimeStamp"]\
-                                       .apply(lambda i: i.date() in dry_days.to_list()),:]\
-                                       .reset_index(drop=True)
-        self.level_data = self.level_data.loc[self.level_data["TimeStamp"]\
-                                         .apply(lambda i: i.date() in dry_days.to_list()),:]\
-                                         .reset_index(drop=True)
+        flow_dates = preprocessing.time_features(self.flow_data["TimeStamp"], ["Date"])["Date"]
+        level_dates = preprocessing.time_features(self.level_data["TimeStamp"], ["Date"])["Date"]
+
+        self.flow_data = self.flow_data.loc[flow_dates.isin(dry_days), :].reset_index(drop=True)
+        self.level_data = self.level_data.loc[level_dates.isin(dry_days), :].reset_index(drop=True)
 
 
+    @instrumentation.instrument
     def add_groups(self):
         """
         Will add flow peak (self.flow_groups) and level drop data (self.level_groups),
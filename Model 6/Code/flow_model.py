@@ -3,25 +3,20 @@
 # through a pump 24 hours in advance.                     #
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
 
-from keras.models import Sequential
-from keras.layers import Dense
-from keras import optimizers
-from sklearn.model_selection import KFold
+import functools
+import pickle
 
 import pandas as pd
 import numpy as np
-import geopandas as gpd
-import statsmodels.api as sm
-
-import tensorflow as tf
-import keras
 
 import preprocessing
-import utility
-
-import holidays
+import linear_model
+import cross_validation
+import feature_store
+import rain_features
+import instrumentation
 
-def add_predictor_columns(data):
+def add_predictor_columns(data, columns=None):
     """
     Will return predictive variables given a data-set with the 'TimeHour' column.
     'TimeHour' can be created by applying the .replace() method on the 'TimeStamp'
@@ -32,25 +27,364 @@ def add_predictor_columns(data):
     Month of the year    month_XX       Dummy, binary
     Holiday              is_holiday     Binary
 
-    Holiday is based on all holidays in the Netherlands in 2018, 2019.
+    Holiday is based on all holidays in the Netherlands in the years of 'TimeHour'.
+    If columns is given, the output will have exactly these columns (missing dummies
+    are 0), e.g. to match the columns a model was trained on.
     """
+    import holidays
+
+    time_features = preprocessing.time_features(data["TimeHour"], ["Date", "Hour", "Month"])
+
     # Fetch holidays of given period
-    NL_holidays = [i[0] for i in holidays.Netherlands(years = [2018, 2019]).items()]
+    years = sorted(set(time_features["Date"].dt.year))
+    NL_holidays = [i[0] for i in holidays.Netherlands(years = years).items()]
 
     # Create dummies for hour of day and month of year
-    hour_dummies = pd.get_dummies(data["TimeHour"].apply(lambda i: i.hour), prefix="hour")
-    month_dummies = pd.get_dummies(data["TimeHour"].apply(lambda i: i.month), prefix="month")
+    hour_dummies = pd.get_dummies(time_features["Hour"], prefix="hour")
+    month_dummies = pd.get_dummies(time_features["Month"], prefix="month")
 
     # Check each date whether in holidays
-    is_holiday = data["TimeHour"].apply(lambda i: i.date() in NL_holidays).astype(int)
+    is_holiday = time_features["Date"].isin(pd.to_datetime(NL_holidays)).astype(np.int8).rename("is_holiday")
 
     # Concatenate and add constant/intercept
     X = pd.concat([hour_dummies, month_dummies, is_holiday], axis=1)
     X["Constant"] = 1
 
+    if columns is not None:
+        X = X.reindex(columns=columns, fill_value=0)
+
     return X
 
 
+def build_model(input_dim, solver="keras", lr=0.03, alpha=0.0, outputs=1):
+    """
+    Returns an untrained linear model with input_dim inputs and outputs outputs.
+    Exact solvers fit all outputs jointly with a single decomposition of X.
+
+    solver:  'keras' builds a single-node neural network trained by Adam,
+             'lstsq', 'cholesky' or 'qr' an exact linear_model.linear_regression.
+    lr:      Learning rate of the keras model
+    alpha:   Ridge regularisation of the exact solvers
+    """
+    if solver == "keras":
+        # Keras (and thus tensorflow) is only needed for this model
+        from keras.models import Sequential
+        from keras.layers import Dense
+        from keras import optimizers
+
+        model = Sequential()
+        model.add(Dense(outputs, input_dim=input_dim))
+        model.compile(optimizer = optimizers.Adam(lr=lr), loss='mean_squared_error')
+
+        return model
+
+    return linear_model.linear_regression(solver=solver, alpha=alpha)
+
+
+def fit_and_score(X_train, y_train, X_test, y_test, solver="keras", lr=0.03, alpha=0.0,
+                  epochs=400, batch_size=1024):
+    """
+    Trains a model as built by build_model() on the training set and returns
+    its mean squared error on the test set. Used for cross validation.
+    """
+    model = build_model(X_train.shape[1], solver=solver, lr=lr, alpha=alpha,
+                        outputs=y_train.shape[1] if y_train.ndim > 1 else 1)
+
+    if solver == "keras":
+        model.fit(X_train, y_train,
+                  validation_split=0,
+                  epochs=epochs,
+                  batch_size=batch_size,
+                  shuffle=False,
+                  verbose=0)
+    else:
+        model.fit(X_train, y_train)
+
+    return model.evaluate(X_test, y_test, verbose=0)
+
+
+def measured_hourly_flow(flow_data, level_data, imputation="simple"):
+    """
+    Cleans, merges and imputes the measurements and aggregates the flow by hour,
+    see preprocessing.flow_by_hour(). flow_data and level_data are not changed.
+    """
+    # Omit minor data defficiencies, on copies as cleaning sorts and converts in place
+    flow_data = preprocessing.clean_mes_data(flow_data.copy(), convert_timestamp=False)
+    level_data = preprocessing.clean_mes_data(level_data.copy(), convert_timestamp=False)
+
+    # Merges flow and level on timestamps, as normal flow data is biased
+    # given no measurements are made when there is no flow.
+    flow_data, level_data = preprocessing.merge_flow_level(flow_data, level_data)
+
+    # Can perform simple imputation or LM-imputation
+    if imputation == "simple":
+        flow_data = preprocessing.fill_flow(flow_data)
+    elif imputation == "complex":
+        import data_imputation
+        flow_data = data_imputation.fill_flow(flow_data, level_data)
+    else:
+        pass
+
+    # Groups flow by hour
+    return preprocessing.flow_by_hour(flow_data)
+
+
+@instrumentation.instrument
+def build_data_set(flow_data, level_data, rain_prediction, padding=5, multiple=True, steps=12,
+                   imputation="simple", station="Drunen", horizons=1, columns=None, hourly_flow=None,
+                   drop_incomplete=True):
+    """
+    Cleans, merges, imputes and aggregates the measurements by hour and matches them
+    with the rain prediction, see flow_model. columns are passed to add_predictor_columns().
+
+    hourly_flow is the result of measured_hourly_flow(), computed from flow_data and
+    level_data if None. With horizons > 1, hours of which not all horizons have flow
+    data are left out, unless drop_incomplete is False (their y is then NaN where unknown).
+
+    Returns the rain grid around the pump, the matched grid layer indices, the matched
+    hourly flow, the other predictors and the dependent variable.
+    """
+    # Selects a grid around a specific pump.
+    # Size will be (1+2*padding)x(1+2*padding).
+    rain_grid = preprocessing.grid_area(rain_prediction[1], station, padding=padding,
+                                        reduced=rain_prediction[1].shape[1] < 300)
+
+    if hourly_flow is None:
+        hourly_flow = measured_hourly_flow(flow_data, level_data, imputation=imputation)
+
+    # Selects grid layers and hourly flow data where the other is available
+    # for the same hour
+    rp_indices, flow_data_by_hour = preprocessing.match_indices(rain_prediction[0], hourly_flow,
+                                                                multiple=multiple, steps=steps)
+
+    # Flow of the next hours as dependent variables
+    if horizons > 1:
+        y = preprocessing.horizon_targets(hourly_flow, flow_data_by_hour["TimeHour"], horizons=horizons)
+
+        if drop_incomplete:
+            complete = ~np.isnan(y).any(axis=1)
+
+            y = y[complete]
+            rp_indices = rp_indices[complete]
+            flow_data_by_hour = flow_data_by_hour.loc[complete].reset_index(drop=True)
+    else:
+        y = flow_data_by_hour["Flow"].values
+
+    # Other variables
+    predictors = add_predictor_columns(flow_data_by_hour, columns=columns)
+
+    return rain_grid, rp_indices, flow_data_by_hour, predictors, y
+
+
+def reduced_grid_features(rain_grid, rp_indices, multiple=False, steps=3, reduction=None, dtype=None):
+    """
+    preprocessing.grid_features(), compressed by reduction (a fitted
+    rain_features.spatial_reduction) if it is not None.
+    """
+    grid = preprocessing.grid_features(rain_grid, rp_indices, multiple=multiple, steps=steps, dtype=dtype)
+    if reduction is not None:
+        grid = reduction.transform(grid)
+
+    return grid
+
+
+class flow_forecaster:
+    """
+    A trained flow model together with the configuration of its features, able to
+    forecast hourly flow from the latest rain prediction without the history the
+    model was trained on. Created by flow_model.forecaster() or load_forecaster().
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    model.StochasticGradientDescent(solver="cholesky")
+    model.save("C:/mypath/flow_model_drunen")
+    ...
+    forecaster = load_forecaster("C:/mypath/flow_model_drunen")
+    hourly_flow = forecaster.forecast(lf.get_rain_prediction("C:/mypath/latest"))
+    """
+    def __init__(self, model, solver, station, padding, steps, multiple, columns, horizons=1,
+                 imputation="simple", reduction=None, pending=None):
+        self.model = model
+        self.solver = solver
+        self.station = station
+        self.padding = padding
+        self.steps = steps
+        self.multiple = multiple
+        self.columns = columns
+        self.horizons = horizons
+        self.imputation = imputation
+        self.reduction = reduction
+        self.pending = pending
+
+    def features(self, latest_prediction, horizon=24):
+        """
+        Builds the feature rows of the first horizon hours of the most recent
+        prediction run in latest_prediction (a tuple as read by
+        load_files.get_rain_prediction()). With multiple, the steps-1 grid layers
+        before the first of these hours need to be in latest_prediction as well.
+
+        Returns the hours and the feature matrix.
+        """
+        dates, grid = latest_prediction
+        dates = dates.reset_index(drop=True)
+
+        # Select grid around the pump, works on full and reduced grids
+        rain_grid = preprocessing.grid_area(grid, self.station, padding=self.padding,
+                                            reduced=grid.shape[1] < 300)
+
+        # Grid layers of the latest prediction run
+        latest = dates.loc[dates["pred"] == dates["pred"].max()].sort_values("start").iloc[:horizon]
+        rp_indices = latest.index.values
+
+        if self.multiple and rp_indices.min() - (self.steps - 1) < 0:
+            raise ValueError("latest_prediction needs {} grid layers before the forecast hours"
+                             .format(self.steps - 1))
+
+        hours = latest[["start"]].rename(columns={"start": "TimeHour"}).reset_index(drop=True)
+
+        grid = reduced_grid_features(rain_grid, rp_indices, multiple=self.multiple, steps=self.steps,
+                                     reduction=self.reduction, dtype=np.float32)
+        predictors = add_predictor_columns(hours, columns=self.columns).values.astype(np.float32)
+
+        return hours, np.concatenate((grid, predictors), axis=1)
+
+    @instrumentation.instrument
+    def forecast(self, latest_prediction, horizon=24):
+        """
+        Forecasts the hourly flow for the next horizon hours, see features().
+        Returns a data frame with the columns 'TimeHour' and 'Flow'.
+
+        A multi-horizon model predicts all (at most self.horizons) hours from the
+        feature row of the first hour only.
+        """
+        if self.horizons > 1:
+            hours, X = self.features(latest_prediction, horizon=1)
+            flow = np.asarray(self.model.predict(X)).reshape(-1)[:horizon]
+
+            return pd.DataFrame({"TimeHour": hours["TimeHour"].iloc[0] + pd.to_timedelta(np.arange(len(flow)), unit="h"),
+                                 "Flow": flow})
+
+        hours, X = self.features(latest_prediction, horizon=horizon)
+        hours["Flow"] = np.asarray(self.model.predict(X)).reshape(len(hours), -1)[:, 0]
+
+        return hours
+
+    @instrumentation.instrument
+    def update(self, flow_data, level_data, rain_prediction, epochs=10, batch_size=1024):
+        """
+        Updates the model with newly available measurements only (e.g. of the last day),
+        instead of retraining it on the complete history. rain_prediction has to contain
+        the grid layers of these hours, and with multiple the steps-1 layers before them.
+
+        Exact solvers add the new data to their sufficient statistics (X'X, X'y) and
+        solve again, the result equals fitting on all data at once. The keras model
+        continues training for epochs epochs on the new data.
+
+        With horizons > 1 a row needs the flow of the horizons-1 hours after it. Rows whose
+        hours run past the end of the new data are held back (features and the flow of
+        their hours, in self.pending) and used by the update that brings their last hours.
+
+        Returns the number of new rows used.
+        """
+        hourly_flow = measured_hourly_flow(flow_data, level_data, imputation=self.imputation)
+        rain_grid, rp_indices, hours, predictors, y = \
+            build_data_set(flow_data, level_data, rain_prediction, padding=self.padding, multiple=self.multiple,
+                           steps=self.steps, imputation=self.imputation, station=self.station,
+                           horizons=self.horizons, columns=self.columns, hourly_flow=hourly_flow,
+                           drop_incomplete=False)
+
+        if len(y) > 0:
+            grid = reduced_grid_features(rain_grid, rp_indices, multiple=self.multiple, steps=self.steps,
+                                         reduction=self.reduction)
+            X = np.concatenate((grid, predictors.values), axis=1)
+        else:
+            X = np.zeros((0, 0))
+
+        if self.horizons > 1:
+            X, y = self._complete_rows(X, hours["TimeHour"].values.astype("<M8[ns]"), hourly_flow)
+
+        if len(y) == 0:
+            return 0
+
+        if self.solver == "keras":
+            self.model.fit(X, y, epochs=epochs, batch_size=batch_size, shuffle=False, verbose=0)
+        else:
+            self.model.partial_fit(X, y)
+
+        return len(y)
+
+    def _complete_rows(self, X, hours, hourly_flow):
+        """
+        Adds the rows held back by the previous update to the new rows X of hours, sets the
+        targets of all of them from the flow known now, and holds back the rows that can still
+        be completed by later data. Returns the complete rows X, y.
+        """
+        flow = hourly_flow[["TimeHour", "Flow"]]
+        if self.pending is not None:
+            pending_hours, pending_X, pending_flow = self.pending
+
+            flow = pd.concat([pending_flow, flow], ignore_index=True).drop_duplicates("TimeHour", keep="last")
+            new = ~np.isin(hours, pending_hours)
+            X = np.concatenate((pending_X, X[new]), axis=0) if len(X) > 0 else pending_X
+            hours = np.concatenate((pending_hours, hours[new]))
+
+        y = preprocessing.horizon_targets(flow, hours, horizons=self.horizons)
+        complete = ~np.isnan(y).any(axis=1)
+
+        # Incomplete rows whose last hour is after the latest flow known can still be completed
+        last_hour = flow["TimeHour"].max() if len(flow) > 0 else None
+        waiting = ~complete
+        if last_hour is not None:
+            waiting &= hours + np.timedelta64(self.horizons - 1, "h") > np.datetime64(last_hour, "ns")
+
+        if waiting.any():
+            first_hour = hours[waiting].min()
+            self.pending = (hours[waiting], X[waiting], flow.loc[flow["TimeHour"] >= first_hour].reset_index(drop=True))
+        else:
+            self.pending = None
+
+        return X[complete], y[complete]
+
+    def save(self, path):
+        """
+        Saves the model and its feature configuration to path + '.p'.
+        """
+        if self.solver == "keras":
+            # Keras models are stored by their weights and rebuilt at loading
+            model = {"weights": self.model.get_weights(), "input_dim": self.model.input_shape[1],
+                     "outputs": self.model.output_shape[1]}
+        else:
+            model = self.model
+
+        config = dict(self.__dict__, model=model)
+        pickle.dump(config, open(path + ".p", "wb"))
+
+
+def load_forecaster(path):
+    """
+    Loads a flow_forecaster saved by flow_forecaster.save() or flow_model.save().
+    """
+    config = pickle.load(open(path + ".p", "rb"))
+
+    if config["solver"] == "keras":
+        model = build_model(config["model"]["input_dim"], solver="keras", outputs=config["model"]["outputs"])
+        model.set_weights(config["model"]["weights"])
+        config["model"] = model
+
+    return flow_forecaster(**config)
+
+
+def forecast_all(forecasters, latest_prediction, horizon=24):
+    """
+    Forecasts the hourly flow of multiple pumps.
+    forecasters is a dictionary of pump name to flow_forecaster.
+
+    Returns a data frame with the columns 'Pump', 'TimeHour' and 'Flow'.
+    """
+    forecasts = [i.forecast(latest_prediction, horizon=horizon).assign(Pump=j) for j, i in forecasters.items()]
+
+    return pd.concat(forecasts, ignore_index=True)[["Pump", "TimeHour", "Flow"]]
+
+
 class flow_model:
     """
     Can be used to predict hourly flow based on rain prediction and time.
@@ -59,94 +393,258 @@ class flow_model:
     by load_files.get_rain_prediction().
     """
 
+    @instrumentation.instrument
     def __init__(self, flow_data, level_data, rain_prediction,
-                 padding=5, multiple=True, steps=12, imputation="simple"):
+                 padding=5, multiple=True, steps=12, imputation="simple", streaming=False, station="Drunen",
+                 horizons=1, cache=None, reduction=None):
         """
         Creates data set for model based on flow_data, level_data, rain prediction.
-        """
-        # Selects a grid around a specific pump.
-        # Size will be (1+2*padding)x(1+2*padding).
-        rain_grid = preprocessing.grid_area(rain_prediction[1], "Drunen", padding=padding, reduced=True)
 
-        # Omit minor data defficiencies
-        flow_data = preprocessing.clean_mes_data(flow_data, convert_timestamp=False)
-        level_data = preprocessing.clean_mes_data(level_data, convert_timestamp=False)
+        station is the pump (key of preprocessing.rg_spots) around which the rain grid is taken.
 
-        # Merges flow and level on timestamps, as normal flow data is biased
-        # given no measurements are made when there is no flow.
-        flow_data, level_data = preprocessing.merge_flow_level(flow_data, level_data)
+        If horizons > 1, y has a column for each of the hours 0, ..., horizons-1 ahead
+        and the model predicts all of them jointly from the same feature row. Hours of
+        which not all horizons have flow data are left out.
 
-        # Can perform simple imputation or LM-imputation
-        if imputation == "simple":
-            flow_data = preprocessing.fill_flow(flow_data)
-        elif imputation == "complex":
-            flow_data = data_imputation.fill_flow(flow_data, level_data)
-        else:
-            pass
-
-        # Groups flow by hour
-        flow_data_by_hour = preprocessing.flow_by_hour(flow_data)
+        If streaming is True the rain features are not materialised. X is then None
+        and batches() builds float32 feature rows on the fly, so memory does not grow
+        with the length of the history times the number of rain features.
 
-        # Selects parts of grid and hourly flow data where the other is available
-        # for the same hour
-        grid, flow_data_by_hour = preprocessing.match_by_timestamp((rain_prediction[0], rain_grid),
-                                                      flow_data_by_hour,
-                                                      multiple=multiple, steps=steps)
+        cache can be a feature_store.feature_store. The data set is then stored on disk,
+        keyed by the content of the input data and the parameters, and reloaded
+        memory-mapped when a flow_model is created from the same inputs again.
 
-        # Concatenate grid data and other variables
-        X = add_predictor_columns(flow_data_by_hour).values
-        X = np.concatenate((grid, X), axis=1)
+        reduction compresses the rain grid of every time step to a few features, see
+        rain_features: 'rings', 'distance', 'pca' or a rain_features.spatial_reduction.
+        It is fitted here and stored with the model, so forecasts use the same transform.
+        """
+        reduction = rain_features.get_reduction(reduction)
 
-        # Select dependent variable
-        y = flow_data_by_hour["Flow"].values
+        # Selects a grid around a specific pump.
+        # Size will be (1+2*padding)x(1+2*padding).
+        rain_grid = preprocessing.grid_area(rain_prediction[1], station, padding=padding,
+                                            reduced=rain_prediction[1].shape[1] < 300)
+
+        cached = None
+        if cache is not None:
+            # Only the grid around the pump is part of the key
+            key = feature_store.fingerprint(flow_data, level_data, rain_prediction[0], rain_grid,
+                                            padding=padding, multiple=multiple, steps=steps,
+                                            imputation=imputation, station=station, horizons=horizons,
+                                            reduction=repr(reduction))
+            cached = cache.get(key)
+
+        if cached is None or (not streaming and "X" not in cached[0]):
+            rain_grid, rp_indices, flow_data_by_hour, predictors, y = \
+                build_data_set(flow_data, level_data, rain_prediction, padding=padding, multiple=multiple,
+                               steps=steps, imputation=imputation, station=station, horizons=horizons)
+
+            # Other variables, small enough to keep in memory
+            columns = list(predictors.columns)
+            predictors = predictors.values.astype(np.float32)
+            hourly_flow = flow_data_by_hour[["TimeHour", "Flow"]]
+
+            # Fit compression on all grid layers used
+            if reduction is not None:
+                layers = (rp_indices[:, None] - np.arange(steps)).ravel() if multiple else rp_indices
+                reduction.fit(rain_grid, layers)
+
+            # Concatenate grid data and other variables
+            if streaming:
+                X = None
+            else:
+                grid = reduced_grid_features(rain_grid, rp_indices, multiple=multiple, steps=steps,
+                                             reduction=reduction)
+                X = np.concatenate((grid, predictors), axis=1)
+
+            if cache is not None:
+                arrays = {"y": y, "rp_indices": rp_indices, "predictors": predictors,
+                          "TimeHour": hourly_flow["TimeHour"].values.astype("<M8[ns]").view(np.int64),
+                          "Flow": hourly_flow["Flow"].values}
+                if X is not None:
+                    arrays["X"] = X
+                if reduction is not None:
+                    arrays["reduction_weights"] = reduction.weights
+                    if reduction.offset is not None:
+                        arrays["reduction_offset"] = reduction.offset
+                    if getattr(reduction, "explained_variance", None) is not None:
+                        arrays["reduction_explained_variance"] = reduction.explained_variance
+                cache.put(key, arrays, meta={"columns": columns})
+        else:
+            arrays, meta = cached
+            X = None if streaming else arrays["X"]
+            y = arrays["y"]
+            rp_indices = np.asarray(arrays["rp_indices"])
+            predictors = arrays["predictors"]
+            columns = meta["columns"]
+            hourly_flow = pd.DataFrame({"TimeHour": np.asarray(arrays["TimeHour"]).view("<M8[ns]"),
+                                        "Flow": arrays["Flow"]})
+
+            if reduction is not None:
+                reduction.shape = rain_grid.shape[1:]
+                reduction.weights = np.asarray(arrays["reduction_weights"])
+                if "reduction_offset" in arrays:
+                    reduction.offset = np.asarray(arrays["reduction_offset"])
+                if "reduction_explained_variance" in arrays:
+                    reduction.explained_variance = np.asarray(arrays["reduction_explained_variance"])
 
         # Add variables to class
         self.X = X
         self.y = y
         self.padding = padding
         self.steps = steps
+        self.multiple = multiple
+        self.streaming = streaming
+        self.station = station
+        self.columns = columns
+        self.horizons = horizons
+        self.imputation = imputation
+        self.reduction = reduction
+
+        self.rain_grid = rain_grid
+        self.rp_indices = rp_indices
+        self.predictors = predictors
+        self.hourly_flow = hourly_flow
+        self._forecaster = None
+
+    def forecaster(self):
+        """
+        Returns the flow_forecaster of the trained model, which holds no training data. It is
+        created once per trained model, so rows that update() holds back until their flow is
+        known are completed by the next update().
+        """
+        if self._forecaster is None or self._forecaster.model is not self.model:
+            self._forecaster = flow_forecaster(self.model, self.solver, self.station, self.padding,
+                                               self.steps, self.multiple, self.columns, self.horizons,
+                                               self.imputation, self.reduction)
+
+        return self._forecaster
+
+    def save(self, path):
+        """
+        Saves the trained model and its feature configuration, see load_forecaster().
+        """
+        self.forecaster().save(path)
+
+    @instrumentation.instrument
+    def forecast(self, latest_prediction, horizon=24):
+        """
+        Forecasts the hourly flow for the next horizon hours, see flow_forecaster.
+        """
+        return self.forecaster().forecast(latest_prediction, horizon=horizon)
+
+    @instrumentation.instrument
+    def update(self, flow_data, level_data, rain_prediction, epochs=10, batch_size=1024):
+        """
+        Updates the trained model with new measurements only, see flow_forecaster.update().
+        X and y are not extended.
+        """
+        return self.forecaster().update(flow_data, level_data, rain_prediction,
+                                        epochs=epochs, batch_size=batch_size)
+
+    def batches(self, batch_size=1024, rows=None, loop=False, dtype=np.float32):
+        """
+        Generator of (X, y) mini-batches, with X built from the rain grid on the fly.
+
+        rows:   Integer indices of the rows to generate, all rows if None
+        loop:   Repeat forever, as keras' fit_generator() requires
+        """
+        if rows is None:
+            rows = np.arange(len(self.y))
+
+        while True:
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:(i + batch_size)]
+                grid = reduced_grid_features(self.rain_grid, self.rp_indices[batch], multiple=self.multiple,
+                                             steps=self.steps, reduction=self.reduction, dtype=dtype)
+
+                yield np.concatenate((grid, self.predictors[batch].astype(dtype)), axis=1), self.y[batch]
+
+            if not loop:
+                return
+
+    def n_features(self):
+        """
+        Number of columns of X.
+        """
+        if self.reduction is not None:
+            cells = self.reduction.n_outputs()
+        else:
+            cells = self.rain_grid.shape[1] * self.rain_grid.shape[2]
+        return cells * (self.steps if self.multiple else 1) + self.predictors.shape[1]
 
-    def StochasticGradientDescent(self, lr=0.03, epochs=400, batch_size=1024, validation_split=0.1, cv=False):
+    @instrumentation.instrument
+    def _fit_streaming(self, model, solver, epochs, batch_size, validation_split):
+        """
+        Trains model on mini-batches generated by batches().
+        """
+        if solver != "keras":
+            # Exact solvers accumulate the normal equations batch by batch
+            model.fit_batches(self.batches(batch_size))
+            return
+
+        n_train = int(len(self.y) * (1 - validation_split))
+        train_rows = np.arange(n_train)
+        validation_rows = np.arange(n_train, len(self.y))
+
+        validation = {}
+        if len(validation_rows) > 0:
+            validation = {"validation_data": self.batches(batch_size, rows=validation_rows, loop=True),
+                          "validation_steps": int(np.ceil(len(validation_rows) / batch_size))}
+
+        model.fit_generator(self.batches(batch_size, rows=train_rows, loop=True),
+                            steps_per_epoch=int(np.ceil(n_train / batch_size)),
+                            epochs=epochs,
+                            shuffle=False,
+                            **validation)
+
+    @instrumentation.instrument
+    def StochasticGradientDescent(self, lr=0.03, epochs=400, batch_size=1024, validation_split=0.1, cv=False,
+                                  solver="keras", alpha=0.0, folds=10, split="kfold", n_jobs=None):
         """
         Builds a gradient descent model.
-        Based on whether cv is True will return a cross validation score.
-        If cv is True model will not be based on the whole data set.
+        Based on whether cv is True will return a cross validation score (mean RMSE).
+        If cv is True no model is stored, as every fold trains its own model.
+
+        solver:  'keras' (default) trains the single-node network by gradient descent.
+                 'lstsq', 'cholesky' or 'qr' solve the same linear model exactly,
+                 with ridge regularisation alpha. lr, epochs, batch_size and
+                 validation_split are ignored for these.
+        With streaming, exact solvers always solve the normal equations (Cholesky).
+
+        folds:   Number of cross validation folds
+        split:   'kfold' or 'forward' (forward chaining, trains on the past only)
+        n_jobs:  Number of processes the folds run on, None uses all cores
         """
         if cv:
-            cvscores = []
-            for train, test in KFold(10).split(self.X):
-                # Build single-node neural network
-                model = Sequential()
-                model.add(Dense(1, input_dim=self.X.shape[1]))
+            if self.streaming:
+                raise ValueError("Cross validation needs the full X, create the flow_model with streaming=False")
 
-                model.compile(optimizer = optimizers.Adam(lr=lr), loss='mean_squared_error')
-                model.fit(self.X, self.y,
-                          validation_split=0,
-                          epochs=epochs,
-                          batch_size=batch_size,
-                          shuffle=False)
+            fit_fold = functools.partial(fit_and_score, solver=solver, lr=lr, alpha=alpha,
+                                         epochs=epochs, batch_size=batch_size)
 
-                # Add cv score
-                scores = model.evaluate(X[test], y[test], verbose=0)
-                cvscores.append(scores[1])
+            cvscores = cross_validation.cross_validate(self.X, self.y, fit_fold,
+                                                       folds=folds, split=split, n_jobs=n_jobs)
 
             self.cvscores = cvscores
 
-            self.model = model
-
             return np.mean([np.sqrt(i) for i in cvscores])
         else:
             # Build single-node neural network
-            model = Sequential()
-            model.add(Dense(1, input_dim=self.X.shape[1]))
+            model = build_model(self.n_features(), solver=solver, lr=lr, alpha=alpha, outputs=self.horizons)
 
-            model.compile(optimizer = optimizers.Adam(lr=lr), loss='mean_squared_error')
-            model.fit(self.X, self.y,
-                      validation_split=validation_split,
-                      epochs=epochs,
-                      batch_size=batch_size,
-                      shuffle=False)
+            if self.streaming:
+                self._fit_streaming(model, solver, epochs, batch_size, validation_split)
+            elif solver == "keras":
+                model.fit(self.X, self.y,
+                          validation_split=validation_split,
+                          epochs=epochs,
+                          batch_size=batch_size,
+                          shuffle=False)
+            else:
+                model.fit(self.X, self.y)
 
             self.model = model
+            self.solver = solver
 
             return
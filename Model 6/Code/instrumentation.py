@@ -0,0 +1,229 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Opt-in recording of wall time, CPU time,     #
+# peak memory and row counts of the main stages of the    #
+# pipeline, to find out where the time of a run goes.     #
+# Functions decorated with @instrument only check a flag  #
+# while recording is disabled.                            #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import json
+import time
+import datetime
+import functools
+import threading
+import tracemalloc
+import pandas as pd
+import numpy as np
+
+
+class _state:
+    enabled = os.environ.get("DC3_INSTRUMENT", "") == "1"
+    traced = False
+    started = time.perf_counter()
+    records = []
+    lock = threading.Lock()
+    local = threading.local()
+
+
+def enable(reset=True, memory=False):
+    """
+    Starts recording every call of an instrumented function. Recording can also
+    be switched on for a whole run by setting the environment variable DC3_INSTRUMENT=1.
+
+    With memory, allocations are traced (tracemalloc) to record the peak memory of every
+    call (python 3.9 or newer). This slows down the run, so it is off by default.
+    """
+    if reset:
+        clear()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state.traced = True
+    _state.enabled = True
+
+
+def disable():
+    _state.enabled = False
+    if _state.traced:
+        tracemalloc.stop()
+        _state.traced = False
+
+
+def enabled():
+    return _state.enabled
+
+
+def clear():
+    with _state.lock:
+        _state.records = []
+        _state.started = time.perf_counter()
+
+
+def _statm_rss():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _psutil_rss():
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+_rss_readers = []
+
+
+def current_rss():
+    """
+    Resident memory of the process now, in megabytes, None if it can not be measured
+    (psutil is needed outside Linux).
+    """
+    if not _rss_readers:
+        for reader in (_statm_rss, _psutil_rss):
+            try:
+                reader()
+                _rss_readers.append(reader)
+                break
+            except (ImportError, OSError, ValueError, AttributeError):
+                continue
+        else:
+            _rss_readers.append(None)
+
+    return _rss_readers[0]() / 2**20 if _rss_readers[0] is not None else None
+
+
+def data_size(objects):
+    """
+    Number of rows and memory in megabytes of the data frames, series and arrays in
+    objects (tuples and lists are searched one level deep). Memory of object columns
+    (e.g. strings) only counts the pointers, to keep this cheap.
+    """
+    rows, memory, found = 0, 0, False
+    for i in objects:
+        for j in (i if isinstance(i, (tuple, list)) else (i,)):
+            if isinstance(j, pd.DataFrame):
+                rows, memory = rows + len(j), memory + j.memory_usage(index=True, deep=False).sum()
+            elif isinstance(j, pd.Series):
+                rows, memory = rows + len(j), memory + j.memory_usage(index=True, deep=False)
+            elif isinstance(j, np.ndarray):
+                rows, memory = rows + (len(j) if j.ndim > 0 else 1), memory + j.nbytes
+            else:
+                continue
+            found = True
+
+    if not found:
+        return None, None
+
+    return int(rows), float(memory) / 2**20
+
+
+def instrument(function):
+    """
+    Decorator recording every call of function while recording is enabled (see enable()).
+    Calls within an instrumented function are recorded with their depth and parent.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    @instrumentation.instrument
+    def clean_mes_data(df, ...):
+    """
+    name = function.__module__ + "." + function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _state.enabled:
+            return function(*args, **kwargs)
+
+        stack = getattr(_state.local, "stack", None)
+        if stack is None:
+            stack = _state.local.stack = []
+
+        rows_in, memory_in = data_size(list(args) + list(kwargs.values()))
+
+        # Peak of traced memory per call: the peak so far goes to the caller before it is reset
+        traced = tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak")
+        if traced:
+            traced_now, traced_peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["_peak"] = max(stack[-1]["_peak"], traced_peak)
+            tracemalloc.reset_peak()
+
+        record = {"name": name,
+                  "thread": threading.current_thread().name,
+                  "depth": len(stack),
+                  "parent": stack[-1]["name"] if stack else None,
+                  "rows_in": rows_in,
+                  "memory_in_mb": memory_in}
+
+        if traced:
+            record["_base"] = record["_peak"] = traced_now
+
+        stack.append(record)
+        rss_start = current_rss()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            output = function(*args, **kwargs)
+            record["error"] = None
+        except Exception as error:
+            output = None
+            record["error"] = type(error).__name__
+            raise
+        finally:
+            record["start"] = start - _state.started
+            record["wall_seconds"] = time.perf_counter() - start
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            rss_end = current_rss()
+            record["rss_delta_mb"] = rss_end - rss_start if rss_start is not None else None
+            record["peak_mb"] = None
+            if traced:
+                peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+                record["peak_mb"] = (peak - record.pop("_base")) / 2**20
+            record["rows_out"], record["memory_out_mb"] = data_size([output])
+            stack.pop()
+
+            with _state.lock:
+                _state.records.append(record)
+
+        return output
+
+    return wrapper
+
+
+def trace():
+    """
+    Recorded calls as a data frame, in order of their start. CPU time is that of the
+    whole process, so it includes other threads running at the same time.
+    rss_delta_mb is the change of resident memory over the call, peak_mb the highest
+    memory allocated during the call above that at its start (only with enable(memory=True)).
+    """
+    with _state.lock:
+        records = list(_state.records)
+
+    columns = ["name", "thread", "depth", "parent", "start", "wall_seconds", "cpu_seconds", "rss_delta_mb", "peak_mb",
+               "rows_in", "rows_out", "memory_in_mb", "memory_out_mb", "error"]
+
+    return pd.DataFrame(records, columns=columns).sort_values("start", kind="mergesort").reset_index(drop=True)
+
+
+def summary():
+    """
+    Number of calls, total wall and CPU time, largest change of resident memory and
+    highest peak memory (if traced) per function, slowest first.
+    """
+    return trace().groupby("name").agg({"start": "count", "wall_seconds": "sum", "cpu_seconds": "sum",
+                                        "rss_delta_mb": "max", "peak_mb": "max"})\
+                  .rename(columns={"start": "calls"})\
+                  .sort_values("wall_seconds", ascending=False)
+
+
+def export(path):
+    """
+    Writes the recorded calls to path, as json (list of records) or, if path ends
+    with '.csv', as a table.
+    """
+    data = trace()
+
+    if path.endswith(".csv"):
+        data.to_csv(path, index=False)
+    else:
+        with open(path, "w") as file:
+            json.dump({"created": datetime.datetime.now().isoformat(),
+                       "records": json.loads(data.to_json(orient="records"))}, file, indent=2)
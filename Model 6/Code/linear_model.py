@@ -0,0 +1,137 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Solve linear regression models exactly,      #
+# as a fast alternative to training a single-node neural  #
+# network by gradient descent.                            #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import numpy as np
+from scipy import linalg
+
+
+SOLVERS = ["lstsq", "cholesky", "qr"]
+
+
+class linear_regression:
+    """
+    Linear regression y ~ X with optional ridge regularisation, solved in closed form.
+    Has the fit/predict/evaluate methods of a keras model, so it can be used in its place.
+    X is expected to contain a constant column if an intercept is wanted.
+
+    ~~~~~ SOLVERS ~~~~~
+    lstsq       SVD based least squares, handles rank deficient X (e.g. dummies plus constant)
+    cholesky    Cholesky decomposition of the normal equations X'X + alpha*I
+    qr          QR decomposition of X (stacked with sqrt(alpha)*I)
+
+    Cholesky and QR fall back on least squares when the system is (near) singular.
+    Note that alpha also penalises the constant column.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    model = linear_regression(solver="cholesky", alpha=1.0)
+    model.fit(X_train, y_train)
+    mse = model.evaluate(X_test, y_test)
+    """
+    def __init__(self, solver="cholesky", alpha=0.0):
+        if solver not in SOLVERS:
+            raise ValueError("Unknown solver '{}', choose from {}".format(solver, SOLVERS))
+
+        self.solver = solver
+        self.alpha = alpha
+        self.coef = None
+
+        # Sufficient statistics of all data fitted on, used by partial_fit()
+        self.XtX = None
+        self.Xty = None
+        self.n = 0
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        self.XtX, self.Xty, self.n = X.T @ X, X.T @ y, len(X)
+
+        if self.solver == "cholesky":
+            self.coef = self._solve_normal(self.XtX, self.Xty)
+        else:
+            if self.alpha > 0:
+                X = np.concatenate((X, np.sqrt(self.alpha) * np.eye(X.shape[1])), axis=0)
+                y = np.concatenate((y, np.zeros((X.shape[1],) + y.shape[1:])), axis=0)
+
+            if self.solver == "qr":
+                self.coef = self._solve_qr(X, y)
+            else:
+                self.coef = np.linalg.lstsq(X, y, rcond=None)[0]
+
+        return self
+
+    def fit_batches(self, batches):
+        """
+        Fits on an iterable of (X, y) batches by accumulating the normal equations,
+        so the full X never has to be in memory. Always solves by Cholesky.
+        """
+        self.XtX, self.Xty, self.n = None, None, 0
+
+        for X, y in batches:
+            self._accumulate(X, y)
+
+        self.coef = self._solve_normal(self.XtX, self.Xty)
+
+        return self
+
+    def partial_fit(self, X, y):
+        """
+        Updates the fitted model with new observations X, y, as if it was fitted on
+        all data at once. Costs time proportional to the number of new rows.
+        Always solves by Cholesky.
+        """
+        self._accumulate(X, y)
+        self.coef = self._solve_normal(self.XtX, self.Xty)
+
+        return self
+
+    def _accumulate(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        if self.XtX is None:
+            self.XtX, self.Xty = X.T @ X, X.T @ y
+        else:
+            self.XtX += X.T @ X
+            self.Xty += X.T @ y
+        self.n += len(X)
+
+    def _solve_normal(self, XtX, Xty):
+        """
+        Solves (X'X + alpha*I) b = X'y by Cholesky decomposition.
+        """
+        A = XtX + self.alpha * np.eye(XtX.shape[0])
+        try:
+            factor = linalg.cho_factor(A)
+            diagonal = np.abs(np.diag(factor[0]))
+            if diagonal.min() > np.sqrt(np.finfo(np.float64).eps) * diagonal.max():
+                return linalg.cho_solve(factor, Xty)
+        except linalg.LinAlgError:
+            pass
+
+        # Singular system, return minimum norm solution
+        return np.linalg.lstsq(A, Xty, rcond=None)[0]
+
+    def _solve_qr(self, X, y):
+        """
+        Solves X b = y by (economic) QR decomposition.
+        """
+        Q, R = np.linalg.qr(X)
+        diagonal = np.abs(np.diag(R))
+        if diagonal.min() > np.sqrt(np.finfo(np.float64).eps) * diagonal.max():
+            return linalg.solve_triangular(R, Q.T @ y)
+
+        # Rank deficient X, return minimum norm solution
+        return np.linalg.lstsq(X, y, rcond=None)[0]
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64) @ self.coef
+
+    def evaluate(self, X, y, verbose=0):
+        """
+        Returns the mean squared error, as keras does with loss='mean_squared_error'.
+        """
+        return float(np.mean((self.predict(X) - np.asarray(y)) ** 2))
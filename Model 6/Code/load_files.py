@@ -5,22 +5,60 @@
 import pandas as pd
 import numpy as np
 import datetime
-import geopandas as gpd
 import os
 import pickle
 import utility
+import schema
+import instrumentation
 
 
 # Codes of pumps
 pump_to_id_dict = {"Drunen": 8150,
                    "Haarsteeg": 8170,
+                   "Bokhoven": 8180,
                    "Oude Engelenseweg": 401,
                    "Helftheuvelweg": 301,
                    "Engelerschans": 201,
                    "De Rompert": 501,
                    "Maaspoort": 501}
 
+# Small pumps, of which the level is in one file (sewer_data/data_pump_level)
+SMALL_PUMPS = ["Oude Engelenseweg", "Helftheuvelweg", "Engelerschans", "De Rompert", "Maaspoort"]
 
+
+def wwtp_id(path):
+    """
+    Code of the WWTP of a folder of WWTP flow measurements, 0 if it is not known.
+    """
+    if "1882" in path:
+        return 1882
+    elif "1876" in path:
+        return 1876
+    else:
+        return 0
+
+
+def convert_measurements(data, convert_time=True):
+    """
+    Converts measurements in the old format, as read from one file (or part of a file),
+    to the compact schema and splits them in flow and level.
+    ~~~ EXAMPLE CALL ~~~
+    flow_data, level_data = convert_measurements(pd.read_csv(file, sep=";", dtype={"Value": str}))
+    ~~~~~~~~~~~~~~~~~~~~
+    """
+    data["RG_ID"] = data["Tagname"].str.slice(9,13).astype(np.int16)
+    data["Value"] = data["Value"].str.replace(",", ".").astype(np.float32)
+    data["DataQuality"] = (data["DataQuality"] == "Good").astype(np.int8)
+    if convert_time == True:
+        data["TimeStamp"] = pd.to_datetime(data["TimeStamp"], format="%d-%m-%Y %H:%M:%S")
+    
+    flow_data = data.loc[data["Tagname"].str.contains("Debietmeting"), list(schema.MEASUREMENT_SCHEMA)]
+    level_data = data.loc[data["Tagname"].str.contains("Niveaumeting"), list(schema.MEASUREMENT_SCHEMA)]
+    
+    return flow_data, level_data
+
+
+@instrumentation.instrument
 def get_measurements(path, convert_time=True):
     """
     Will read all measurement data from given path and store them in separate dataframes.
@@ -30,26 +68,22 @@ def get_measurements(path, convert_time=True):
     """
     files = os.listdir(path)
     
-    data = [pd.read_csv(path + "/" + i, sep = ";") for i in files]
-    data =  pd.concat(data, sort = False, ignore_index = True)
+    # Files are converted to the compact schema one at a time, so the text columns of
+    # only one file are in memory at once
+    flow_data, level_data = [], []
+    for i in files:
+        flow, level = convert_measurements(pd.read_csv(path + "/" + i, sep = ";", dtype = {"Value": str}),
+                                           convert_time=convert_time)
+        flow_data.append(flow)
+        level_data.append(level)
     
-    data["RG_ID"] = data["Tagname"].str.slice(9,13).astype(int)
-    data["Value"] = data["Value"].str.replace(",", ".").astype(float)
-    data["DataQuality"] = (data["DataQuality"] == "Good").astype(int)
-    if convert_time == True:
-        data["TimeStamp"] = pd.to_datetime(data["TimeStamp"], format="%d-%m-%Y %H:%M:%S")
-        
-    data = data[["Tagname", "RG_ID", "TimeStamp", "Value", "DataQuality"]]
-    
-    flow_data = data[data["Tagname"].str.contains("Debietmeting")].reset_index(drop = True)
-    level_data = data[data["Tagname"].str.contains("Niveaumeting")].reset_index(drop = True)
-    
-    flow_data.drop("Tagname", axis=1, inplace=True)
-    level_data.drop("Tagname", axis=1, inplace=True)
+    flow_data = pd.concat(flow_data, sort = False, ignore_index = True)
+    level_data = pd.concat(level_data, sort = False, ignore_index = True)
     
     return flow_data, level_data
 
 
+@instrumentation.instrument
 def load_all_pumps(path, convert_time=True):
     """
     Will read all measurement data from given path and store them in separate dataframes.
@@ -70,10 +104,10 @@ def load_all_pumps(path, convert_time=True):
         data = [pd.read_csv(path + "/" + i, sep = ",") for i in files if ".csv" in i]
         data =  pd.concat(data, sort = False, ignore_index = True)
         
-        data["RG_ID"] = data["historianTagnummer"].str.slice(9,13).astype(int)
-        data["Value"] = data["hstWaarde"]
+        data["RG_ID"] = data["historianTagnummer"].str.slice(9,13).astype(np.int16)
+        data["Value"] = data["hstWaarde"].astype(np.float32)
         
-        data["DataQuality"] = (data["historianKwaliteit"] == 100).astype(int)
+        data["DataQuality"] = (data["historianKwaliteit"] == 100).astype(np.int8)
         
         if convert_time == True:
             data["datumBeginMeting"] = pd.to_datetime(data["datumBeginMeting"]).dt.strftime("%d-%m-%Y %H:%M:%S")
@@ -99,22 +133,16 @@ def load_all_pumps(path, convert_time=True):
         if convert_time == True:
             data["TimeStamp"] = pd.to_datetime(data["TimeStamp"], format="%d-%m-%Y %H:%M:%S")
 
-        for i in ["Oude Engelenseweg", "Helftheuvelweg", "Engelerschans", "De Rompert", "Maaspoort"]:
-            data.loc[:, i] = data.loc[:, i].str.replace(",", ".").astype(float)
+        for i in SMALL_PUMPS:
+            data[i] = data[i].str.replace(",", ".").astype(float)
         
         data_len = len(data)
-        data = pd.concat([data[["TimeStamp", "Oude Engelenseweg"]].rename(columns={"Oude Engelenseweg": "Value"}),
-                           data[["TimeStamp", "Helftheuvelweg"]].rename(columns={"Helftheuvelweg": "Value"}),
-                           data[["TimeStamp", "Engelerschans"]].rename(columns={"Engelerschans": "Value"}),
-                           data[["TimeStamp", "De Rompert"]].rename(columns={"De Rompert": "Value"}),
-                           data[["TimeStamp", "Maaspoort"]].rename(columns={"Maaspoort": "Value"})],
+        data = pd.concat([data[["TimeStamp", i]].rename(columns={i: "Value"}) for i in SMALL_PUMPS],
                           axis=0, ignore_index=True)
 
-        data["RG_ID"] = list(map(lambda i: pump_to_id_dict[i],
-                                 np.repeat(["Oude Engelenseweg", "Helftheuvelweg",
-                                            "Engelerschans", "De Rompert", "Maaspoort"], data_len)))
+        data["RG_ID"] = list(map(lambda i: pump_to_id_dict[i], np.repeat(SMALL_PUMPS, data_len)))
         
-        return data
+        return schema.compact(data)
     
 
     # NEW TYPE FLOW OF WWTP AND SMALL PUMPS
@@ -123,24 +151,20 @@ def load_all_pumps(path, convert_time=True):
         data =  pd.concat(data, sort = False, ignore_index = True)
 
         if "data_pump_flow" in path:
-            data["RG_ID"] = data["historianTagnummer"].str.slice(26,29).astype(int)
+            data["RG_ID"] = data["historianTagnummer"].str.slice(26,29).astype(np.int16)
         else:
-            if "1882" in path:
-                data["RG_ID"] = 1882
-            elif "1876" in path:
-                data["RG_ID"] = 1876
-            else:
-                data["RG_ID"] = 0
+            data["RG_ID"] = wwtp_id(path)
             
         data["Value"] = data["hstWaarde"]
-        data["DataQuality"] = (data["historianKwaliteit"] == 100).astype(int)
+        data["DataQuality"] = (data["historianKwaliteit"] == 100).astype(np.int8)
 
         data["TimeStamp"] = pd.to_datetime(data["datumBeginMeting"]).dt.strftime('%d-%m-%Y %H:%M:%S')
         data = data[["RG_ID", "TimeStamp", "Value", "DataQuality"]]
         
-        return data
+        return schema.compact(data)
 
 
+@instrumentation.instrument
 def get_rain_prediction(path, from_date=None, to_date=None, reduce_grid=False):
     """
     Will read rain prediction data + dates from file names from given path and store those
@@ -176,6 +200,7 @@ def get_rain_prediction(path, from_date=None, to_date=None, reduce_grid=False):
     return date_data, data
 
 
+@instrumentation.instrument
 def get_rain(path, convert_time=True):
     """
     Will read all rain data from given path and store them in a single dataframe.
@@ -222,7 +247,10 @@ class sdf:
     data.area_data
     ~~~~~~~~~~~~~~~~~~~~
     """
+    @instrumentation.instrument
     def __init__(self, path):
+        import geopandas as gpd
+
         # Sewage area data
         area_data = gpd.read_file(path + "/" + "Rioleringsdeelgebied.shp")
         area_data["area"] = area_data.area
@@ -1,74 +1,103 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Runs the DWAAS table, the flow imputation or the flow   #
+# model through pipeline. Every job only imports the      #
+# modules it needs, so e.g. a DWAAS report does not wait  #
+# for tensorflow.                                         #
+#                                                         #
+# python main.py dwaas|impute|model [--check-imports]     #
+#                [--trace trace.json]                     #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
 
-import pandas as pd
-import geopandas as gpd
-import numpy as np
-import statsmodels.api as sm
-
-import matplotlib.pyplot as plt
-import seaborn as sns
 import os
+import sys
+import argparse
+import warnings
+warnings.filterwarnings('ignore')
 
 # To import the self made functions you need to fill in the path were you
 # saved the functions instead of the word 'Code'
-import sys
 #sys.path.append('C:\\Users\\s158607\\Documents\\2019-2020\\Data challenge 3\\JBG060-Data-Challenge-3-master\\code')
 sys.path.append('C:\\Users\\s158607\\PycharmProjects\\DataChallenge3\\Model 6\\code')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-import utility
-import load_files as lf
-import flow_level_conversion as flc
-import preprocessing as pre
-import measurement_analysis as mea
-import flow_model as model
-import data_imputation as impu
-import pred_to_rain as ptr
 
-import warnings
-warnings.filterwarnings('ignore')
+PATH = 'C:\\Users\\s158607\\PycharmProjects\\DataChallenge3\\Model 6\\code\\' # CHANGE (!)
+# Data is expected in PATH as on the data share (sewer_data/data_pump/RG8150,
+# sewer_data/rain_timeseries, sewer_data/rain_grid_prediction, sewer_model/aa-en-maas_sewer_shp),
+# see pipeline.pipeline_params()
 
 
+# Modules imported by every job, and the maximum time in seconds importing them may take
+JOB_MODULES = {"dwaas": ["pipeline", "load_files", "preprocessing", "measurement_analysis"],
+               "impute": ["pipeline", "load_files", "preprocessing", "data_imputation"],
+               "model": ["pipeline", "load_files", "preprocessing", "flow_model"]}
+IMPORT_BUDGET = 1.0
+
+
+def run(job):
+    # Runs the stages of the pipeline needed for the job. Results are cached in
+    # PATH + "cache", so e.g. the model reuses the measurements cleaned for the DWAAS table.
+    import pipeline
+
+    runner = pipeline.pipeline(pipeline.STAGES, pipeline.pipeline_params(PATH, "Drunen", village_code="DRU"),
+                               cache_dir=PATH + "cache")
+
+    return runner.run(job)
 
-PATH = 'C:\\Users\\s158607\\PycharmProjects\\DataChallenge3\\Model 6\\code\\' # CHANGE (!)
-PATH_MEASUREMENTS = PATH + "sewer_data\\data_pump\\RG8150"
-PATH_RAIN_DATA = PATH + "sewer_data\\rain_timeseries"
-PATH_SHAPE_FILES = PATH + "sewer_model\\aa-en-maas_sewer_shp"
-PATH_RAIN_PREDICTION = PATH + "sewer_data\\rain_grid_prediction"
 
+def dwaas():
+    # creating the dwaas haas table
+    return run("dwaas")
 
 
-# LOADING NECESSARY DATA
-# Measurements
-flow_data, level_data = lf.get_measurements(PATH_MEASUREMENTS)
-flow_data = pre.fill_flow(pre.clean_mes_data(flow_data))
-level_data = pre.fill_level(pre.clean_mes_data(level_data))
+def impute():
+    # creating the imputated flow
+    return run("impute")
 
-# # Actual rain
-rain_data = lf.get_rain(PATH_RAIN_DATA)
 
-# Rain predicton
-pred_days, rain_prediction = lf.get_rain_prediction(PATH_RAIN_PREDICTION, reduce_grid = True)
+def model():
+    # creating the prediction of the hourly flow, returns the trained forecaster
+    return run("model")
 
-# Shape file data frames
-area_data = lf.sdf(PATH_SHAPE_FILES).area_data
 
+def check_imports(job):
+    """
+    Prints the import time of the modules of job and whether it is within IMPORT_BUDGET.
+    """
+    import utility
 
+    seconds = utility.import_time(JOB_MODULES[job], cwd=os.path.dirname(os.path.abspath(__file__)))
+    print("{}: importing {} took {:.3f}s (budget {:.1f}s, {})"
+          .format(job, ", ".join(JOB_MODULES[job]), seconds, IMPORT_BUDGET,
+                  "OK" if seconds <= IMPORT_BUDGET else "EXCEEDED"))
 
-# creating the dwaas haas table
-area_data.crs = {'init': 'epsg:28992'}
-measure = mea.measurement_analysis(flow_data, level_data, rain_data, area_data = area_data, village_code = 'DRU')
-dwaas_table = measure.compare_flow()
-dwaas_table
+    return seconds <= IMPORT_BUDGET
 
 
+JOBS = {"dwaas": dwaas,
+        "impute": impute,
+        "model": model}
 
-# creating the imputated flow
-imputed_flow = impu.fill_flow(flow_data, level_data)
-imputed_flow
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("job", choices=list(JOBS))
+    parser.add_argument("--check-imports", action="store_true",
+                        help="only measure the import time of the job against the budget")
+    parser.add_argument("--trace", help="record time and memory of every stage and write them to this "
+                                        "json (or .csv) file, see instrumentation")
+    args = parser.parse_args()
 
+    if args.check_imports:
+        sys.exit(0 if check_imports(args.job) else 1)
 
-# creating the prediction of the hourly flow
-flow_model = model.flow_model(flow_data, level_data, (pred_days, rain_prediction))
-cross_validation_score = flow_model.StochasticGradientDescent()
-cross_validation_score
+    if args.trace is not None:
+        import instrumentation
+        instrumentation.enable()
 
+    try:
+        print(JOBS[args.job]())
+    finally:
+        if args.trace is not None:
+            instrumentation.export(args.trace)
+            print(instrumentation.summary())
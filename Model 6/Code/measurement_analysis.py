@@ -4,15 +4,135 @@
 # flow to multiple grouped measurements.                  #
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
 
-import load_files as lf
 import pandas as pd
-import geopandas as gpd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import datetime
-import utility
 import preprocessing
+import rain_store
+import instrumentation
+
+
+DWAAS_MEASURES = ["Theoretical DWF (Q80)",
+                  "Summer",
+                  "Winter",
+                  "Workday",
+                  "Weekend",
+                  "Average"]
+
+
+def daily_rollup(flow_data, by=None):
+    """
+    Sums the 'Flow' column of flow_data per date (and per column(s) in by).
+    flow_data needs the columns 'Date' and 'Flow', as added by measurement_analysis.
+
+    Returns a data frame with the columns by + ['Date', 'Flow', 'Month', 'Weekend'].
+    """
+    keys = ([] if by is None else list(np.atleast_1d(by))) + ["Date"]
+
+    daily = flow_data.groupby(keys)["Flow"].sum().reset_index(drop=False)
+    daily = preprocessing.add_time_features(daily, ["Month", "Weekend"], column="Date")
+
+    return daily
+
+
+def dwaas_measures(daily, by=None):
+    """
+    Derives all DWAAS measures from a daily rollup as created by daily_rollup(),
+    in a single grouped pass.
+
+    Returns a data frame with the columns by + ['Name', 'Value', 'Rel. Value'].
+    """
+    keys = [] if by is None else list(np.atleast_1d(by))
+    if by is None:
+        daily = daily.assign(_group=0)
+        keys = ["_group"]
+
+    # Daily flow masked to the days each measure considers
+    masked = pd.DataFrame({"Summer": daily["Flow"].where(daily["Month"] <= 3),
+                           "Winter": daily["Flow"].where((daily["Month"] >= 6) & (daily["Month"] <= 9)),
+                           "Workday": daily["Flow"].where(daily["Weekend"] == 0),
+                           "Weekend": daily["Flow"].where(daily["Weekend"] == 1),
+                           "Average": daily["Flow"]})
+    for i in keys:
+        masked[i] = daily[i]
+
+    grouped = masked.groupby(keys)
+    measures = grouped[["Summer", "Winter", "Workday", "Weekend", "Average"]].mean()
+    measures.insert(0, "Q80", daily.groupby(keys)["Flow"].quantile(0.2))
+    measures.columns = DWAAS_MEASURES
+
+    # Computes relation to theoretical DWF
+    relative_measures = measures.div(measures[DWAAS_MEASURES[0]], axis=0)
+
+    # Long format, one row per group and measure
+    table = measures.reset_index(drop=False).melt(id_vars=keys, var_name="Name", value_name="Value")
+    table["Rel. Value"] = relative_measures.reset_index(drop=False)\
+                                           .melt(id_vars=keys, value_name="Rel. Value")["Rel. Value"]
+    table = table.sort_values(keys, kind="mergesort").reset_index(drop=True)
+
+    if by is None:
+        table.drop("_group", axis=1, inplace=True)
+
+    return table
+
+
+def village_rain_summary(rain_data, area_data, village_codes, dry_threshold=0):
+    """
+    Same as preprocessing.summarize_rain_data(), but for multiple villages at once.
+    Daily sums of all villages are computed once, by the rain store of rain_data.
+
+    Returns a data frame with the columns 'village_code', 'Date', 'Total' and 'DrySeries'.
+    """
+    store = rain_store.get_rain_store(rain_data, area_data)
+
+    summaries = []
+    for i in village_codes:
+        summary = store.summary(i, dry_threshold)
+        summary.insert(0, "village_code", i)
+        summaries.append(summary)
+
+    return pd.concat(summaries, ignore_index=True)
+
+
+@instrumentation.instrument
+def dwaas_tables(flow_data, rain_data, area_data, pump_villages, dry_threshold=0):
+    """
+    Creates the DWAAS table of measurement_analysis.compare_flow() for multiple pumps
+    at once.
+
+    ~~~~~ INPUT  ~~~~~
+    flow_data:     Flow measurements of all pumps, with 'RG_ID' column
+    rain_data:     File as gathered by load_files.get_rain(...)
+    area_data:     File as gathered by load_files.sdf(...).area_data
+    pump_villages: Dictionary of RG_ID to village code (e.g. {8150: 'DRU'})
+    dry_threshold: As in measurement_analysis
+
+    ~~~~~ OUTPUT ~~~~~
+    A data frame with the columns 'village_code', 'RG_ID', 'Name', 'Value', 'Rel. Value'.
+    """
+    flow_data = flow_data.loc[flow_data["RG_ID"].isin(list(pump_villages))]
+
+    # CLEAN DATA (per pump, as timestamps are only unique within a pump)
+    # Duplicates are removed before selecting on quality, as in preprocessing.clean_mes_data()
+    flow_data = preprocessing.clean_mes_data(flow_data.copy(), sort_timestamp=False, remove_duplicates=False,
+                                             select_quality=False)
+    flow_data = flow_data.sort_values(["RG_ID", "TimeStamp"], kind="mergesort")
+    flow_data = flow_data.loc[~flow_data.duplicated(["RG_ID", "TimeStamp"])]
+    flow_data = flow_data.loc[flow_data["DataQuality"] == 1].reset_index(drop=True)
+
+    flow_data = preprocessing.add_time_features(flow_data, ["Date", "TimeSpan"], first_span=5)
+    flow_data.loc[flow_data["RG_ID"] != flow_data["RG_ID"].shift(1), "TimeSpan"] = 5
+    flow_data["Flow"] = flow_data["Value"] * flow_data["TimeSpan"] / 3600
+
+    # Single daily rollup of all pumps
+    daily = daily_rollup(flow_data, by="RG_ID")
+    daily["village_code"] = daily["RG_ID"].map(pump_villages)
+
+    # Select only dry days, per village
+    rain_summary = village_rain_summary(rain_data, area_data, sorted(set(pump_villages.values())), dry_threshold)
+    dry_days = rain_summary.loc[rain_summary["DrySeries"] >= dry_threshold, ["village_code", "Date"]]
+    daily = daily.merge(dry_days, on=["village_code", "Date"], how="inner")
+
+    return dwaas_measures(daily, by=["village_code", "RG_ID"])
 
 
 class measurement_analysis:
@@ -20,6 +140,7 @@ class measurement_analysis:
     Versatile class useful for adding important columns,
     plotting basic properties of the data fast, and creating the DWAAS table.
     """
+    @instrumentation.instrument
     def __init__(self, flow_data, level_data, rain_data,
                  min_dry_series=1, area_data=None, village_code=None, dry_threshold=0, max_interval=None):
         # CLEAN DATA
@@ -31,34 +152,28 @@ class measurement_analysis:
             rain_data = preprocessing.summarize_rain_data(rain_data, area_data, village_code, dry_threshold)
 
         # Adding basic variables to the data
-        flow_data["Date"] = flow_data["TimeStamp"].apply(lambda i: i.date())
-        flow_data["Hour"] = flow_data["TimeStamp"].apply(lambda i: i.hour)
-        flow_data["Month"] = flow_data["Date"].apply(lambda i: i.month)
-        flow_data["Weekend"] = flow_data["Date"].apply(lambda i: int(i.weekday() >= 5))
-        flow_data["TimeSpan"] = flow_data["TimeStamp"].diff(1).apply(lambda i: i.seconds).fillna(5)
-        flow_data["Freq"] = 1 / flow_data["TimeSpan"]
+        flow_data = preprocessing.add_time_features(flow_data, first_span=5)
+        flow_data["Freq"] = (1 / flow_data["TimeSpan"]).astype(np.float32)
         flow_data["Flow"] = flow_data["Value"] * flow_data["TimeSpan"] / 3600
 
         # Binary variable indicating whether flow peaked at a maximum or minimum
-        flow_data["max"] = ((flow_data["Value"].diff(1) > 0) & (flow_data["Value"].diff(-1) > 0)).astype(int)
-        flow_data["min"] = ((flow_data["Value"].diff(1) < 0) & (flow_data["Value"].diff(-1) < 0)).astype(int)
+        flow_data["max"] = ((flow_data["Value"].diff(1) > 0) & (flow_data["Value"].diff(-1) > 0)).astype(np.int8)
+        flow_data["min"] = ((flow_data["Value"].diff(1) < 0) & (flow_data["Value"].diff(-1) < 0)).astype(np.int8)
 
         # Adding basic variables to the data
-        level_data["Date"] = level_data["TimeStamp"].apply(lambda i: i.date())
-        level_data["Hour"] = level_data["TimeStamp"].apply(lambda i: i.hour)
-        level_data["Month"] = level_data["Date"].apply(lambda i: i.month)
-        level_data["Weekend"] = level_data["Date"].apply(lambda i: int(i.weekday() >= 5))
-        level_data["TimeSpan"] = level_data["TimeStamp"].diff(1).apply(lambda i: i.seconds)
+        level_data = preprocessing.add_time_features(level_data)
         level_data["Freq"] = 1 / level_data["TimeSpan"]
         level_data["Delta"] = level_data["Value"].diff(1)
 
         # Binary variable indicating whether level peaked at a maximum or minimum
-        level_data["max"] = ((level_data["Value"].diff(1) > 0) & (level_data["Value"].diff(-1) > 0)).astype(int)
-        level_data["min"] = ((level_data["Value"].diff(1) < 0) & (level_data["Value"].diff(-1) < 0)).astype(int)
+        level_data["max"] = ((level_data["Value"].diff(1) > 0) & (level_data["Value"].diff(-1) > 0)).astype(np.int8)
+        level_data["min"] = ((level_data["Value"].diff(1) < 0) & (level_data["Value"].diff(-1) < 0)).astype(np.int8)
 
-        # Calculate area in square-kilometres
-        self.area = area_data.loc[area_data["village_ID"] == village_code, "geometry"]\
-                             .to_crs({"init": "epsg:3395"}).map(lambda p: p.area / 10**6).sum()
+        # Look up area in square-kilometres
+        if area_data is not None:
+            self.area = preprocessing.get_area_table(area_data).area(village_code)
+        else:
+            self.area = None
 
         # STORE DATA
         self.min_dry_series = min_dry_series
@@ -71,6 +186,7 @@ class measurement_analysis:
         self.level_data = level_data
         self.rain_data = rain_data
 
+    @instrumentation.instrument
     def compare_flow(self):
         # CREATES THE DWAAS TABLE COMPARING THEORETICAL DWF AGAINST ACTUAL VALUES
         # Selects dates that are classified dry by function definition
@@ -78,38 +194,12 @@ class measurement_analysis:
         rainy_dates = self.rain_data.loc[self.rain_data["DrySeries"] == 0, "Date"]
 
         # Create binary column whether day is classified as dry
-        self.flow_data["Dry"] = self.flow_data["TimeStamp"].apply(lambda i: i.date() in dry_dates.to_list()).astype(int)
+        self.flow_data["Dry"] = self.flow_data["Date"].isin(dry_dates).astype(np.int8)
 
         # Select only flow from dry days
         dry_flow = self.flow_data.loc[self.flow_data["Dry"] == 1]
 
-        # Measure Names
-        measure_names = ["Theoretical DWF (Q80)",
-                         "Summer",
-                         "Winter",
-                         "Workday",
-                         "Weekend",
-                         "Average"]
-
-        # Aggregates data for DWF measures
-        measures = [dry_flow.groupby("Date")["Flow"].sum().quantile(0.2),
-                    dry_flow.loc[dry_flow["Month"] <= 3].groupby("Date")["Flow"].sum().mean(),
-                    dry_flow.loc[(dry_flow["Month"] >= 6) & (dry_flow["Month"] <= 9)].groupby("Date")["Flow"].sum().mean(),
-                    dry_flow.loc[dry_flow["Weekend"] == 0].groupby("Date")["Flow"].sum().mean(),
-                    dry_flow.loc[dry_flow["Weekend"] == 1].groupby("Date")["Flow"].sum().mean(),
-                    dry_flow.groupby("Date")["Flow"].sum().mean()
-                   ]
-
-        # Computes relation to theoretical DWF
-        relative_measures = [1,
-                             measures[1] / measures[0],
-                             measures[2] / measures[0],
-                             measures[3] / measures[0],
-                             measures[4] / measures[0],
-                             measures[5] / measures[0]
-                            ]
-
-        # Sums up data in single data frame
-        DWAAS_table1 = pd.DataFrame({"Name": measure_names, "Value": measures, "Rel. Value": relative_measures})
+        # Aggregates data for DWF measures from a single daily rollup
+        DWAAS_table1 = dwaas_measures(daily_rollup(dry_flow))
 
         return DWAAS_table1
@@ -0,0 +1,173 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: The network of pumping stations: which       #
+# station pumps into which, down to the treatment plant   #
+# (WWTP). Built once from sdf.RG_data, after which hourly #
+# flows, forecasts or DWAAS measures of all stations can  #
+# be added up along the network with matrix products.     #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import numpy as np
+import pandas as pd
+
+
+def _key(i):
+    # RG codes can be read from the shape files as text or as numbers
+    try:
+        return int(i)
+    except (TypeError, ValueError):
+        return str(i)
+
+
+class network:
+    """
+    Graph of the pumping stations in RG_data (load_files.sdf(...).RG_data). A station pumps
+    into the station whose unit_ID is its to_unit_ID; if there is none (e.g. to_unit_ID 0)
+    it pumps into its treatment plant (RWZI_ID).
+
+    ~~~~~ ATTRIBUTES ~~~~~
+    stations:  RG codes of the stations, the order of the rows and columns of the matrices
+    order:     RG codes in topological order, every station after all stations upstream of it
+    upstream:  Matrix (stations x stations), 1 where the column station is the row station
+               or upstream of it
+    wwtp:      Matrix (WWTPs x stations), 1 where the station ends up at the WWTP
+    direct:    Matrix (WWTPs x stations), 1 where the station pumps into the WWTP itself
+    wwtps:     RWZI_IDs of the WWTPs, the order of the rows of wwtp and direct
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    net = network(load_files.sdf("C:/mypath/aa-en-maas_sewer_shp").RG_data)
+    net.wwtp_inflow(flow_model.forecast_all(forecasters, latest_prediction), hours=24).sum()
+    """
+    def __init__(self, RG_data):
+        self.stations = [_key(i) for i in RG_data["RG_ID"]]
+        if len(set(self.stations)) != len(self.stations):
+            raise ValueError("RG_data has stations with the same RG_ID")
+
+        n = len(self.stations)
+        self.position = {j: i for i, j in enumerate(self.stations)}
+        units = {_key(j): i for i, j in enumerate(RG_data["unit_ID"])}
+
+        # Station each station pumps into, -1 for a WWTP
+        self.downstream = np.array([units.get(_key(i), -1) if pd.notna(i) else -1 for i in RG_data["to_unit_ID"]])
+        self.downstream[self.downstream == np.arange(n)] = -1
+
+        # Topological order (Kahn), upstream stations first
+        inflows = np.bincount(self.downstream[self.downstream >= 0], minlength=n)
+        queue = list(np.where(inflows == 0)[0])
+        order = []
+        while queue:
+            i = queue.pop(0)
+            order.append(i)
+            j = self.downstream[i]
+            if j >= 0:
+                inflows[j] -= 1
+                if inflows[j] == 0:
+                    queue.append(j)
+        if len(order) < n:
+            ordered = set(order)
+            cycle = [self.stations[i] for i in range(n) if i not in ordered]
+            raise ValueError("Stations pump into each other in a cycle: {}".format(cycle))
+        self.order = [self.stations[i] for i in order]
+
+        # Upstream sets, built downwards in topological order
+        upstream = np.eye(n)
+        for i in order:
+            j = self.downstream[i]
+            if j >= 0:
+                upstream[j] += upstream[i]
+        self.upstream = np.minimum(upstream, 1)
+
+        # WWTP each station ends up at: that of the last station on its way down
+        last = np.arange(n)
+        for i in order[::-1]:
+            if self.downstream[i] >= 0:
+                last[i] = last[self.downstream[i]]
+        rwzi = np.array([_key(i) for i in RG_data["RWZI_ID"]], dtype=object)
+
+        self.wwtps = sorted(set(rwzi[last]), key=str)
+        rows = {j: i for i, j in enumerate(self.wwtps)}
+        self.wwtp = np.zeros((len(self.wwtps), n))
+        self.wwtp[[rows[i] for i in rwzi[last]], np.arange(n)] = 1
+        self.direct = self.wwtp * (self.downstream < 0)[None, :]
+
+    def upstream_of(self, rg_id):
+        """
+        RG codes of all stations upstream of rg_id.
+        """
+        i = self.position[_key(rg_id)]
+        return [j for j, k in zip(self.stations, self.upstream[i]) if k and j != self.stations[i]]
+
+    def path(self, rg_id):
+        """
+        RG codes of rg_id and the stations its water passes on the way to the WWTP.
+        """
+        i = self.position[_key(rg_id)]
+        path = [self.stations[i]]
+        while self.downstream[i] >= 0:
+            i = self.downstream[i]
+            path.append(self.stations[i])
+
+        return path
+
+    def wide(self, data, value="Flow", station=None, time="TimeHour"):
+        """
+        Table of value with a row per time (or per value of another column, e.g. 'Name' of a DWAAS
+        table) and a column per station in the order of self.stations, from data in long format
+        (e.g. flow_model.forecast_all() or measurement_analysis.dwaas_tables()). station is the
+        column with the RG code, or 'Pump' with the pump name (see load_files.pump_to_id_dict);
+        by default whichever of 'RG_ID' and 'Pump' is in data. Stations without data are 0.
+        """
+        import load_files
+
+        station = station if station is not None else ("RG_ID" if "RG_ID" in data.columns else "Pump")
+        codes = data[station].map(load_files.pump_to_id_dict) if station == "Pump" else data[station]
+
+        table = data.assign(_station=codes.map(_key)).pivot_table(index=time, columns="_station", values=value,
+                                                                  aggfunc="sum")
+        unknown = set(table.columns) - set(self.stations)
+        if unknown:
+            raise KeyError("Stations not in the network: {}".format(sorted(unknown, key=str)))
+
+        table = table.reindex(columns=self.stations).fillna(0)
+        table.columns.name = None
+
+        return table
+
+    def _values(self, data, value, time):
+        if isinstance(data, pd.DataFrame) and list(data.columns) != self.stations:
+            data = self.wide(data, value=value, time=time)
+        if isinstance(data, pd.DataFrame):
+            return data.index, data.values
+
+        return None, np.asarray(data, dtype=np.float64)
+
+    def accumulate(self, data, value="Flow", time="TimeHour"):
+        """
+        Adds up the values of every station and all stations upstream of it (e.g. the local inflow
+        of every catchment to the total inflow through each station).
+
+        data is a wide table with a column per station (see wide()), a long table that wide() can
+        read, or an array of times x stations. Returns the same shape, as a wide table if possible.
+        """
+        index, values = self._values(data, value, time)
+        output = values @ self.upstream.T
+
+        return pd.DataFrame(output, index=index, columns=self.stations) if index is not None else output
+
+    def wwtp_inflow(self, data, value="Flow", time="TimeHour", hours=None, local=True):
+        """
+        Inflow at every WWTP, with data as in accumulate(). If local, the values are the
+        own inflow of every station and those of all stations are added up; otherwise they are
+        the pumped flows (which include the stations upstream) and only the stations pumping into
+        the WWTP itself are added up. hours keeps the first hours rows.
+
+        ~~~~~ EXAMPLE CALL ~~~~~
+        # Total expected inflow at every WWTP in the next 24 hours
+        net.wwtp_inflow(flow_model.forecast_all(forecasters, latest_prediction), hours=24).sum()
+        """
+        index, values = self._values(data, value, time)
+        if hours is not None:
+            index, values = (index[:hours] if index is not None else None), values[:hours]
+
+        output = values @ (self.wwtp if local else self.direct).T
+
+        return pd.DataFrame(output, index=index, columns=self.wwtps) if index is not None else output
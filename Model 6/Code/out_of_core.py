@@ -0,0 +1,530 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Run the analysis on more measurement data    #
+# than fits in memory. Measurements are split by month    #
+# on disk and processed one station-month at a time; the  #
+# state that crosses a month boundary (last measurement,  #
+# open pump cycles and level drops, dry series) is        #
+# carried to the next month, and partial results are      #
+# combined at the end.                                    #
+#                                                         #
+# python out_of_core.py --data D:/DC3 [--output report]   #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+import load_files
+import preprocessing
+import measurement_analysis
+import flow_level_conversion
+import schema
+
+from preprocessing import NS_PER_SECOND, NS_PER_HOUR, NS_PER_DAY
+
+
+# Reference time of preprocessing.fill_level(), in nanoseconds since 1970
+NS_2017 = pd.Timestamp(2017, 1, 1).value
+
+
+def read_chunks(station, chunksize=10**6):
+    """
+    Yields ('flow' or 'level', data) for the measurements of a station found by
+    fleet.discover_stations(), in chunks of at most chunksize rows in the compact schema.
+    """
+    if station["format"] == "old":
+        folder = station["folders"][0]
+        for name in sorted(os.listdir(folder)):
+            for chunk in pd.read_csv(os.path.join(folder, name), sep=";", dtype={"Value": str}, chunksize=chunksize):
+                flow_data, level_data = load_files.convert_measurements(chunk)
+                yield "flow", flow_data
+                yield "level", level_data
+        return
+
+    if station["format"] == "shared":
+        # Folders of several small pumps or the WWTP are read whole, see fleet.load_station()
+        import fleet
+
+        for kind, data in zip(["flow", "level"], fleet.load_station(station)):
+            for i in range(0, len(data), chunksize):
+                yield kind, data.iloc[i:(i + chunksize)].reset_index(drop=True)
+        return
+
+    for kind, folder in zip(["flow", "level"], station["folders"]):
+        for name in sorted(i for i in os.listdir(folder) if ".csv" in i):
+            for chunk in pd.read_csv(os.path.join(folder, name), sep=",", chunksize=chunksize):
+                yield kind, pd.DataFrame({"RG_ID": chunk["historianTagnummer"].str.slice(9,13).astype(np.int16),
+                                          "TimeStamp": pd.to_datetime(chunk["datumBeginMeting"]),
+                                          "Value": chunk["hstWaarde"].astype(np.float32),
+                                          "DataQuality": (chunk["historianKwaliteit"] == 100).astype(np.int8)})
+
+
+def partition(station, directory, chunksize=10**6):
+    """
+    Splits the measurements of station by month, into directory/<kind>/<YYYY-MM>/<n>.p.
+    Only one chunk is in memory at a time. Earlier contents of directory are removed.
+
+    Returns the months found, in order.
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    months, count = set(), 0
+    for kind, data in read_chunks(station, chunksize):
+        data = data.loc[data["TimeStamp"].notna()]
+        keys = data["TimeStamp"].values.astype("<M8[M]")
+
+        for month in np.unique(keys):
+            folder = os.path.join(directory, kind, str(month))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+            data.loc[keys == month].reset_index(drop=True).to_pickle(os.path.join(folder, "{}.p".format(count)))
+            months.add(str(month))
+            count += 1
+
+    return sorted(months)
+
+
+def load_month(directory, kind, month):
+    """
+    Cleaned measurements of one month written by partition(), see preprocessing.clean_mes_data().
+    """
+    folder = os.path.join(directory, kind, month)
+    if not os.path.exists(folder):
+        return pd.DataFrame({i: pd.Series(dtype=j) for i, j in schema.MEASUREMENT_SCHEMA.items()})
+
+    parts = sorted(os.listdir(folder), key=lambda i: int(i.split(".")[0]))
+    data = pd.concat([pd.read_pickle(os.path.join(folder, i)) for i in parts], ignore_index=True)
+
+    return preprocessing.clean_mes_data(data)
+
+
+def daily_rain(path, area_data, village_codes, chunksize=10**6):
+    """
+    Rain per day and village (average over the areas of the village, summed per day),
+    as measurement_analysis.village_rain_summary(), from the rain files in path read in chunks.
+
+    Returns a data frame indexed by date with a column per village code.
+    """
+    areas = preprocessing.get_area_table(area_data)
+
+    parts = []
+    for name in sorted(os.listdir(path)):
+        for chunk in pd.read_csv(os.path.join(path, name), skiprows=2, chunksize=chunksize):
+            village_rain = pd.DataFrame({i: chunk.loc[:, areas.area_names(i, chunk.columns)].mean(axis=1)
+                                         for i in village_codes}, index=chunk.index)
+            start = pd.to_datetime(chunk["Begin"], format="%d-%m-%Y %H:%M:%S")
+            village_rain["Date"] = preprocessing.time_features(start, ["Date"])["Date"]
+            parts.append(village_rain.groupby("Date").sum())
+
+    return pd.concat(parts).groupby(level=0).sum().sort_index()
+
+
+def dry_series(totals, threshold, counter=None):
+    """
+    Number of days since the last day with at least threshold rain, as utility.reset_cumsum(),
+    continuing from counter (the value of the day before totals, None at the start).
+
+    Returns the dry series of totals and the counter for the next days.
+    """
+    output = np.empty(len(totals), dtype=np.int64)
+    for i, total in enumerate(totals):
+        counter = 0 if counter is None or total >= threshold else counter + 1
+        output[i] = counter
+
+    return output, counter
+
+
+def level_drops(level, prominence=0.5):
+    """
+    First and last index of the level drops in level, as in preprocessing.level_group():
+    from a maximum to the first minimum after it. Maxima without a later minimum are left out.
+    """
+    from scipy.signal import find_peaks
+
+    maxima = find_peaks(level, prominence=prominence)[0]
+    minima = find_peaks(-level, prominence=prominence)[0]
+
+    after = np.searchsorted(minima, maxima, side="right")
+    found = after < len(minima)
+
+    return maxima[found], minima[after[found]]
+
+
+def _aggregate(ids, data, functions):
+    # Partial aggregates per group, with flat column names
+    grouped = data.groupby(ids)
+    return pd.DataFrame({name: getattr(grouped[column], function)() for name, (column, function) in functions.items()})
+
+
+class station_state:
+    """
+    Carries the state of one station from one month to the next and keeps its
+    partial results. Months have to be added in order with add_month(), and
+    finish() has to be called after the last one.
+
+    ~~~~~ CARRIED STATE ~~~~~
+    Time of the last flow measurement:  TimeSpan of the first measurement of a month
+    Last merged row and rows after the last valid level:  Flow and level filling
+        (preprocessing.fill_flow() and fill_level()) of rows at the end of a month
+        wait for the first valid level of a later month
+    Number of pump cycles and last flow:  Numbering of pump cycles (preprocessing.flow_group())
+        that run over the end of a month
+    Rows since the end of the last level drop:  Level drops (preprocessing.level_group()) are only
+        final once a later drop is found, the last one is searched again with the next month
+    """
+    FLOW_FUNCTIONS = {"first": ("TimeStamp", "min"), "last": ("TimeStamp", "max"), "Flow": ("Flow", "sum")}
+    LEVEL_FUNCTIONS = {"first": ("TimeStamp", "min"), "last": ("TimeStamp", "max"),
+                       "min": ("Level", "min"), "max": ("Level", "max")}
+
+    def __init__(self, rg_id, first_span=5, prominence=0.5, max_tail=10**6):
+        self.rg_id = rg_id
+        self.first_span = first_span
+        self.prominence = prominence
+        self.max_tail = max_tail
+
+        self.last_time = None
+        self.context = None
+        self.deferred = None
+        self.flow_count = 0
+        self.last_flow = np.nan
+        self.level_count = 0
+        self.level_tail = None
+
+        self.hourly, self.daily = [], []
+        self.flow_parts, self.level_parts = [], []
+
+    def add_month(self, flow_data, level_data, dwaas_dates, coefficient_dates):
+        """
+        Adds the cleaned measurements of the next month. dwaas_dates are the dry dates of the
+        month for the DWAAS table, coefficient_dates all dry dates so far for the coefficient.
+        """
+        self._add_flow(flow_data, dwaas_dates)
+        self._add_merged(flow_data, level_data, coefficient_dates, final=False)
+
+    def finish(self, coefficient_dates):
+        empty = pd.DataFrame({"TimeStamp": pd.Series(dtype="<M8[ns]"), "Value": pd.Series(dtype=np.float32)})
+        self._add_merged(empty, empty, coefficient_dates, final=True)
+
+    def _add_flow(self, flow_data, dwaas_dates):
+        # Hourly flow (preprocessing.flow_by_hour()) and daily flow (measurement_analysis.dwaas_tables())
+        if len(flow_data) == 0:
+            return
+
+        ns = flow_data["TimeStamp"].values.astype("<M8[ns]").view(np.int64)
+        span = np.empty(len(ns), dtype=np.int32)
+        span[1:] = (np.diff(ns) // NS_PER_SECOND) % 86400
+        span[0] = self.first_span if self.last_time is None else ((ns[0] - self.last_time) // NS_PER_SECOND) % 86400
+        self.last_time = ns[-1]
+
+        value = flow_data["Value"].values
+        hourly = pd.DataFrame({"TimeHour": ((ns // NS_PER_HOUR) * NS_PER_HOUR).view("<M8[ns]"),
+                               "Flow": value / 3600 * span,
+                               "DataQuality": flow_data["DataQuality"].values,
+                               "TimeSpan": span})
+        self.hourly.append(hourly.groupby("TimeHour").aggregate({"Flow": np.sum, "DataQuality": np.mean,
+                                                                 "TimeSpan": np.sum}).reset_index(drop=False))
+
+        daily = pd.DataFrame({"RG_ID": flow_data["RG_ID"].values,
+                              "Date": ((ns // NS_PER_DAY) * NS_PER_DAY).view("<M8[ns]"),
+                              "Flow": value * span / 3600})
+        daily = daily.loc[daily["Date"].isin(dwaas_dates)]
+        self.daily.append(daily.groupby(["RG_ID", "Date"])["Flow"].sum().reset_index(drop=False))
+
+    def _add_merged(self, flow_data, level_data, coefficient_dates, final):
+        # Merged and filled flow and level, as flow_level_conversion.generate_coefficient()
+        flow_data, level_data = preprocessing.merge_flow_level(flow_data[["TimeStamp", "Value"]],
+                                                               level_data[["TimeStamp", "Value"]])
+        rows = pd.DataFrame({"TimeStamp": flow_data["TimeStamp"].values.astype("<M8[ns]"),
+                             "Flow/s": flow_data["Value"].values.astype(np.float32),
+                             "Level": level_data["Value"].values.astype(np.float32),
+                             "emitted": False})
+        rows = pd.concat([i for i in (self.context, self.deferred, rows) if i is not None], ignore_index=True)
+        if len(rows) == 0:
+            return
+
+        flow, level = rows["Flow/s"].values.copy(), rows["Level"].values.copy()
+        ns = rows["TimeStamp"].values.view(np.int64)
+
+        # preprocessing.fill_flow(): single missing values get the previous value, others 0
+        missing = np.isnan(flow)
+        single = missing & np.r_[False, ~missing[:-1]] & np.r_[~missing[1:], False]
+        flow[single] = flow[np.where(single)[0] - 1]
+
+        # preprocessing.fill_level(): linear interpolation between the nearest valid levels
+        valid = np.where(~np.isnan(level))[0]
+        if len(valid) > 0:
+            inside = np.where(np.isnan(level) & (np.arange(len(level)) > valid[0]) &
+                              (np.arange(len(level)) < valid[-1]))[0]
+            posterior = valid[np.searchsorted(valid, inside)]
+            prior = valid[np.searchsorted(valid, inside) - 1]
+            seconds = (ns - NS_2017) / NS_PER_SECOND
+            level[inside] = (level[prior] * (seconds[posterior] - seconds[inside]) +
+                             level[posterior] * (seconds[inside] - seconds[prior])) /\
+                            (seconds[posterior] - seconds[prior])
+
+        # Rows after the last valid level (and a missing last flow) wait for the next month
+        end = len(rows)
+        if not final:
+            end = valid[-1] + 1 if len(valid) > 0 else 0
+            if missing[-1]:
+                end = min(end, len(rows) - 1)
+            end = max(end, len(rows) - self.max_tail)
+        flow[:end] = np.where(np.isnan(flow[:end]), 0, flow[:end])
+
+        self.deferred = rows.iloc[end:].reset_index(drop=True) if end < len(rows) else None
+        if end == 0:
+            return
+        self.context = rows.iloc[[end - 1]].assign(**{"Flow/s": flow[end - 1], "Level": level[end - 1],
+                                                      "emitted": True}).reset_index(drop=True)
+
+        # Flow per measurement, as generate_coefficient()
+        span = np.empty(end, dtype=np.float32)
+        span[1:] = (np.diff(ns[:end]) // NS_PER_SECOND) % 86400
+        span[0] = np.nan
+        flow_rate = flow[:end] / 3600
+
+        merged = pd.DataFrame({"TimeStamp": rows["TimeStamp"].values[:end],
+                               "Flow/s": flow_rate,
+                               "Flow": flow_rate * span,
+                               "Level": level[:end]})
+        merged = merged.loc[~rows["emitted"].values[:end]]
+
+        # generate_coefficient.to_dry_data()
+        dates = ((merged["TimeStamp"].values.view(np.int64) // NS_PER_DAY) * NS_PER_DAY).view("<M8[ns]")
+        merged = merged.loc[pd.Series(dates).isin(coefficient_dates).values].reset_index(drop=True)
+
+        self._add_flow_groups(merged)
+        self._add_level_groups(merged, final)
+
+    def _add_flow_groups(self, merged):
+        # Pump cycles, as preprocessing.flow_group(), numbered on from the previous month
+        if len(merged) == 0:
+            return
+
+        flow = merged["Flow/s"].values
+        starts = (flow != 0) & (np.r_[self.last_flow, flow[:-1]] == 0)
+        count = self.flow_count + np.cumsum(starts)
+        ids = np.where(flow != 0, count, 0)
+        self.flow_count, self.last_flow = count[-1], flow[-1]
+
+        self.flow_parts.append(_aggregate(ids, merged, self.FLOW_FUNCTIONS))
+
+    def _add_level_groups(self, merged, final):
+        # Level drops, as preprocessing.level_group(). The last drop found may still
+        # end at a lower level in the next month, so it is searched again with it
+        rows = merged[["TimeStamp", "Level"]].assign(emitted=False)
+        if self.level_tail is not None:
+            rows = pd.concat([self.level_tail, rows], ignore_index=True)
+        if len(rows) == 0:
+            return
+
+        starts, ends = level_drops(rows["Level"].values, self.prominence)
+        if not final and len(ends) > 0:
+            starts, ends = starts[ends < ends[-1]], ends[ends < ends[-1]]
+
+        ids = np.zeros(len(rows), dtype=np.int64)
+        for i, j, k in zip(starts, ends, range(len(starts))):
+            ids[i:(j+1)] = self.level_count + k + 1
+        self.level_count += len(starts)
+
+        # Rows from the end of the last final drop on are searched again
+        end = len(rows) if final else (ends[-1] + 1 if len(ends) > 0 else 0)
+        end = max(end, len(rows) - self.max_tail)
+        if end < len(rows):
+            self.level_tail = rows.iloc[max(end - 1, 0):].reset_index(drop=True)
+            if end > 0:
+                self.level_tail.loc[0, "emitted"] = True
+        else:
+            self.level_tail = None
+
+        new = ~rows["emitted"].values[:end]
+        if new.any():
+            self.level_parts.append(_aggregate(ids[:end][new], rows.iloc[:end].loc[new], self.LEVEL_FUNCTIONS))
+
+    def hourly_flow(self):
+        """
+        Flow per hour, as preprocessing.flow_by_hour() of the cleaned flow measurements.
+        """
+        return pd.concat(self.hourly, ignore_index=True) if self.hourly else None
+
+    def daily_flow(self):
+        """
+        Flow of the station per dry day, as used by measurement_analysis.dwaas_tables().
+        """
+        return pd.concat(self.daily, ignore_index=True) if self.daily else None
+
+    def group_tables(self):
+        """
+        Flow peaks and level drops of the dry days, as generate_coefficient.add_groups()
+        (self.flow_groups and self.level_groups).
+        """
+        if not self.flow_parts or not self.level_parts:
+            return None, None
+
+        flow = pd.concat(self.flow_parts).groupby(level=0).agg({"first": "min", "last": "max", "Flow": "sum"})
+        level = pd.concat(self.level_parts).groupby(level=0).agg({"first": "min", "last": "max",
+                                                                  "min": "min", "max": "max"})
+
+        level_groups = pd.DataFrame({"TimeStamp": level["first"], "group": level.index})
+        level_groups["Delta"] = level["min"] - level["max"]
+        level_groups["TimeSpan"] = (level["last"] - level["first"]).dt.total_seconds()
+        level_groups["PriorIncrease"] = level["max"] - level["min"].shift(1)
+        level_groups["PriorIncreaseTime"] = (level["first"] - level["last"].shift(1)).dt.total_seconds()
+        level_groups["max_level"] = level["max"]
+
+        flow_groups = pd.DataFrame({"TimeStamp": flow["first"], "group": flow.index})
+        flow_groups["Flow"] = flow["Flow"]
+        flow_groups["TimeSpan"] = (flow["last"] - flow["first"]).dt.total_seconds()
+
+        # Level drop starting closest in time to the flow peak (the first one if two are as close)
+        order = np.argsort(level_groups["TimeStamp"].values, kind="mergesort")
+        level_times = level_groups["TimeStamp"].values[order].view(np.int64)
+        flow_times = flow_groups["TimeStamp"].values.view(np.int64)
+        after = np.clip(np.searchsorted(level_times, flow_times), 0, len(order) - 1)
+        before = np.clip(after - 1, 0, len(order) - 1)
+        distance_after, distance_before = np.abs(level_times[after] - flow_times), np.abs(level_times[before] - flow_times)
+        labels = level_groups.index.values
+        closest = np.where((distance_before < distance_after) |
+                           ((distance_before == distance_after) & (labels[order[before]] < labels[order[after]])),
+                           order[before], order[after])
+        flow_groups["level_group"] = labels[closest]
+
+        for i in ["Delta", "PriorIncrease", "PriorIncreaseTime", "max_level"]:
+            flow_groups[i] = level_groups[i].values[closest]
+
+        flow_groups["AdjDelta"] = flow_groups["Delta"] - flow_groups["PriorIncrease"] / flow_groups["PriorIncreaseTime"]\
+                                  * flow_groups["TimeSpan"]
+
+        return flow_groups, level_groups
+
+
+def run(path, stations=None, work_dir=None, dry_threshold=0, coefficient_threshold=1, min_dry_series=1,
+        chunksize=10**6):
+    """
+    Runs the analysis of all stations in path (see fleet.discover_stations()) month by month,
+    so that only the measurements of one station in one month are in memory at a time.
+
+    ~~~~~ INPUT  ~~~~~
+    path:                   Folder with the data, in the layout of the data share (see main.py)
+    stations:               Names of the stations to run, None runs all stations found
+    work_dir:               Folder to write the measurements split by month to. By default
+                            a temporary folder, which is removed afterwards
+    dry_threshold:          As in measurement_analysis.dwaas_tables()
+    coefficient_threshold,
+    min_dry_series:         dry_threshold and min_dry_series of generate_coefficient.to_dry_data()
+    chunksize:              Rows read from a file at a time
+
+    ~~~~~ OUTPUT ~~~~~
+    Dictionary with
+    'hourly':       Hourly flow per station, as preprocessing.flow_by_hour()
+    'dwaas':        DWAAS table of all stations, as measurement_analysis.dwaas_tables()
+    'flow_groups':  Flow peaks per station, as generate_coefficient.add_groups()
+    'level_groups': Level drops per station, as generate_coefficient.add_groups()
+    'coefficient':  Data frame with the intercept and coefficient of 'Flow ~ I + AdjDelta' per station
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    report = run("D:/DC3", work_dir="E:/partitions")
+    report["dwaas"]
+    """
+    import fleet
+    import pipeline
+
+    found = fleet.discover_stations(path)
+    stations = list(stations) if stations is not None else sorted(found)
+    villages = {i: i[:3].upper() for i in stations}
+
+    params = pipeline.pipeline_params(path)
+    area_data = pipeline.load_areas(params["shape_files"])
+    rain = daily_rain(params["rain_data"], area_data, sorted(set(villages.values())), chunksize)
+    rain_months = rain.index.values.astype("<M8[M]").astype(str)
+
+    directory = work_dir if work_dir is not None else tempfile.mkdtemp(prefix="out_of_core_")
+    try:
+        months = {i: partition(found[i], os.path.join(directory, i), chunksize) for i in stations}
+        states = {i: station_state(found[i]["rg_id"]) for i in stations}
+
+        # Dry series per village, carried from month to month
+        counters = {}
+        coefficient_dates = {i: [] for i in set(villages.values())}
+
+        for month in sorted(set(rain_months).union(*months.values())):
+            days = rain.loc[rain_months == month]
+            dwaas_dates = {}
+            for i in coefficient_dates:
+                series, counters[i, "dwaas"] = dry_series(days[i].values, dry_threshold, counters.get((i, "dwaas")))
+                dwaas_dates[i] = days.index[series >= dry_threshold].values
+
+                series, counters[i, "coefficient"] = dry_series(days[i].values, coefficient_threshold,
+                                                                counters.get((i, "coefficient")))
+                coefficient_dates[i] += list(days.index[series >= min_dry_series].values)
+
+            for i in stations:
+                if month in months[i]:
+                    station = os.path.join(directory, i)
+                    states[i].add_month(load_month(station, "flow", month), load_month(station, "level", month),
+                                        dwaas_dates[villages[i]], np.array(coefficient_dates[villages[i]], "<M8[ns]"))
+
+        for i in stations:
+            states[i].finish(np.array(coefficient_dates[villages[i]], "<M8[ns]"))
+    finally:
+        if work_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    # COMBINE PARTIAL RESULTS
+    daily = [states[i].daily_flow().assign(village_code=villages[i]) for i in stations
+             if states[i].daily_flow() is not None]
+    dwaas = None
+    if daily:
+        daily = measurement_analysis.daily_rollup(pd.concat(daily, ignore_index=True), by=["village_code", "RG_ID"])
+        dwaas = measurement_analysis.dwaas_measures(daily, by=["village_code", "RG_ID"])
+
+    groups = {i: states[i].group_tables() for i in stations}
+    coefficient = pd.DataFrame([(i,) + flow_level_conversion.fit_coefficient(groups[i][0]) for i in stations
+                                if groups[i][0] is not None], columns=["station", "intercept", "coefficient"])
+
+    return {"hourly": {i: states[i].hourly_flow() for i in stations},
+            "dwaas": dwaas,
+            "flow_groups": {i: groups[i][0] for i in stations},
+            "level_groups": {i: groups[i][1] for i in stations},
+            "coefficient": coefficient}
+
+
+if __name__ == "__main__":
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", required=True, help="folder with the data, in the layout of the data share")
+    parser.add_argument("--stations", nargs="*", help="names of the stations to run, by default all found")
+    parser.add_argument("--work", help="folder for the measurements split by month, by default a temporary folder")
+    parser.add_argument("--dry-threshold", type=float, default=0)
+    parser.add_argument("--chunksize", type=int, default=10**6, help="rows read from a file at a time")
+    parser.add_argument("--output", help="folder to write the results to")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = run(args.data, stations=args.stations, work_dir=args.work, dry_threshold=args.dry_threshold,
+                 chunksize=args.chunksize)
+
+    print(report["dwaas"].to_string(index=False) if report["dwaas"] is not None else "No DWAAS table")
+    print(report["coefficient"].to_string(index=False))
+    print("Took {:.1f}s".format(time.perf_counter() - start))
+
+    if args.output is not None:
+        if not os.path.exists(args.output):
+            os.makedirs(args.output)
+        if report["dwaas"] is not None:
+            report["dwaas"].to_csv(os.path.join(args.output, "dwaas.csv"), index=False)
+        report["coefficient"].to_csv(os.path.join(args.output, "coefficient.csv"), index=False)
+        for name in report["hourly"]:
+            if report["hourly"][name] is not None:
+                report["hourly"][name].to_csv(os.path.join(args.output, "hourly_flow_" + name + ".csv"), index=False)
+            if report["flow_groups"][name] is not None:
+                report["flow_groups"][name].to_csv(os.path.join(args.output, "flow_groups_" + name + ".csv"))
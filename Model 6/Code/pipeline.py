@@ -0,0 +1,355 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Run the analysis as a graph of stages (load, #
+# clean, summarize rain, DWAAS, impute, coefficient,      #
+# model). Results are cached by their inputs and          #
+# parameters, so only stages that are out of date run,    #
+# and independent stages run at the same time.            #
+#                                                         #
+# python pipeline.py dwaas|impute|coefficient|model|all   #
+#        --data D:/DC3 --pump Drunen [--cache cache]      #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import sys
+import pickle
+import argparse
+import concurrent.futures
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import feature_store
+
+
+class stage:
+    """
+    Step of the pipeline.
+
+    ~~~~~ INPUT  ~~~~~
+    name:      Name of the stage
+    function:  Called with the results of the input stages (in order) and the
+               parameters as keyword arguments. Must be defined at module level
+               if the pipeline runs on processes.
+    inputs:    Names of the stages whose results function needs
+    params:    Names of the pipeline parameters function needs
+    source:    Name of the parameter holding the path of a file or folder read by
+               function, passed like params. Names, sizes and modification times of
+               its files are part of the key, so the stage reruns when the data changes.
+    cache:     Whether the result is stored on disk
+    version:   Increase when function changes, to invalidate cached results
+    """
+    def __init__(self, name, function, inputs=(), params=(), source=None, cache=True, version=1):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.params = list(params)
+        self.source = source
+        self.cache = cache
+        self.version = version
+
+
+def source_signature(path):
+    """
+    Names, sizes and modification times of the files in path (a file or a folder).
+    """
+    if os.path.isfile(path):
+        status = os.stat(path)
+        return [(os.path.basename(path), status.st_size, status.st_mtime_ns)]
+
+    signature = []
+    for root, folders, files in os.walk(path):
+        folders.sort()
+        for i in sorted(files):
+            status = os.stat(os.path.join(root, i))
+            signature += [(os.path.relpath(os.path.join(root, i), path), status.st_size, status.st_mtime_ns)]
+
+    return signature
+
+
+def _call(function, args, kwargs):
+    return function(*args, **kwargs)
+
+
+class pipeline:
+    """
+    Runs the stages needed for a target stage. A stage is up to date if a result
+    is cached under its key, which is a fingerprint of its parameters, its source
+    data and the keys of its inputs. Up to date stages are not run, and stages
+    that only up to date stages depend on are not run either.
+
+    ~~~~~ INPUT  ~~~~~
+    stages:     List of stage
+    params:     Dictionary of parameters, see pipeline_params()
+    cache_dir:  Folder the results are stored in, None does not cache
+    n_jobs:     Number of stages that can run at the same time, None uses all cores
+    processes:  Run stages in processes instead of threads. Inputs and results are
+                then copied between processes.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    runner = pipeline(STAGES, pipeline_params("D:/DC3", "Drunen"), cache_dir="D:/DC3/cache")
+    DWAAS_table = runner.run("dwaas")
+    """
+    def __init__(self, stages, params, cache_dir=None, n_jobs=None, processes=False):
+        self.stages = {i.name: i for i in stages}
+        self.params = params
+        self.cache_dir = cache_dir
+        self.n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+        self.processes = processes
+        self._keys = {}
+
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, name):
+        if name not in self._keys:
+            stage = self.stages[name]
+            source = source_signature(self.params[stage.source]) if stage.source is not None else None
+
+            self._keys[name] = feature_store.fingerprint(name, stage.version, [self.key(i) for i in stage.inputs],
+                                                         source, **self.kwargs(name))
+
+        return self._keys[name]
+
+    def kwargs(self, name):
+        """
+        Parameters passed to the function of stage name.
+        """
+        stage = self.stages[name]
+        names = stage.params + ([stage.source] if stage.source is not None else [])
+
+        return {i: self.params[i] for i in names}
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, "{}_{}.p".format(name, self.key(name)))
+
+    def up_to_date(self, name):
+        return self.cache_dir is not None and self.stages[name].cache and os.path.exists(self.path(name))
+
+    def plan(self, target, force=False):
+        """
+        Names of the stages that have to run for target, in an order in which they
+        can run. If force is True all stages target depends on run.
+        """
+        order = []
+
+        def visit(name):
+            if name in order or (not force and self.up_to_date(name)):
+                return
+            for i in self.stages[name].inputs:
+                visit(i)
+            order.append(name)
+
+        visit(target)
+
+        return order
+
+    def run(self, target, force=False):
+        """
+        Runs the stages needed for target and returns its result.
+        """
+        remaining = self.plan(target, force=force)
+        if not remaining:
+            return self._load(target)
+
+        results = {}
+        Executor = concurrent.futures.ProcessPoolExecutor if self.processes else concurrent.futures.ThreadPoolExecutor
+
+        with Executor(max_workers=self.n_jobs) as executor:
+            running = {}
+            while remaining or running:
+                # Start all stages of which the inputs are available
+                busy = set(remaining) | set(running.values())
+                for name in [i for i in remaining if not busy.intersection(self.stages[i].inputs)]:
+                    stage = self.stages[name]
+                    args = [results[i] if i in results else results.setdefault(i, self._load(i))
+                            for i in stage.inputs]
+                    running[executor.submit(_call, stage.function, args, self.kwargs(name))] = name
+                    remaining.remove(name)
+
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    self._save(name, results[name])
+
+        return results[target]
+
+    def _load(self, name):
+        with open(self.path(name), "rb") as file:
+            return pickle.load(file)
+
+    def _save(self, name, result):
+        if self.cache_dir is None or not self.stages[name].cache:
+            return
+
+        # Write to a temporary file first, so an interrupted run leaves no broken result
+        path = self.path(name)
+        try:
+            with open(path + ".tmp", "wb") as file:
+                pickle.dump(result, file)
+        except (pickle.PicklingError, TypeError, AttributeError) as error:
+            # E.g. keras models, the stage then simply reruns next time
+            print("(!) Result of stage '{}' is not cached: {}".format(name, error))
+            os.remove(path + ".tmp")
+            return
+        os.replace(path + ".tmp", path)
+
+
+# ~~~~~ STAGES ~~~~~
+def load_measurements(measurements):
+    import load_files
+    return load_files.get_measurements(measurements)
+
+
+def load_rain(rain_data):
+    import load_files
+    return load_files.get_rain(rain_data)
+
+
+def load_areas(shape_files):
+    import load_files
+
+    area_data = load_files.sdf(shape_files).area_data
+    if area_data.crs is None:
+        area_data.crs = {'init': 'epsg:28992'}
+
+    return area_data
+
+
+def load_rain_prediction(rain_prediction):
+    import load_files
+    return load_files.get_rain_prediction(rain_prediction, reduce_grid=True)
+
+
+def clean(measurements):
+    import preprocessing
+    import schema
+
+    flow_data, level_data = measurements
+    flow_data = preprocessing.fill_flow(preprocessing.clean_mes_data(flow_data.copy()))
+    level_data = preprocessing.fill_level(preprocessing.clean_mes_data(level_data.copy()))
+
+    return schema.validate(flow_data, name="flow_data"), schema.validate(level_data, name="level_data")
+
+
+def summarize_rain(rain_data, area_data, village_code, dry_threshold):
+    import preprocessing
+    return preprocessing.summarize_rain_data(rain_data, area_data, village_code, dry_threshold)
+
+
+def dwaas(measurements, rain_summary, area_data, village_code, dry_threshold):
+    import measurement_analysis
+
+    flow_data, level_data = measurements
+    analysis = measurement_analysis.measurement_analysis(flow_data.copy(), level_data.copy(), rain_summary,
+                                                         area_data=area_data, village_code=village_code,
+                                                         dry_threshold=dry_threshold)
+
+    return analysis.compare_flow()
+
+
+def impute(measurements):
+    import data_imputation
+
+    flow_data, level_data = measurements
+
+    return data_imputation.fill_flow(flow_data, level_data)
+
+
+def coefficient(measurements, rain_data, area_data, village_code):
+    """
+    Fits 'Flow ~ I + AdjDelta' on the flow peaks of dry days, see flow_level_conversion.
+    """
+    import numpy as np
+    import flow_level_conversion
+
+    flow_data, level_data = measurements
+    conversion = flow_level_conversion.generate_coefficient(flow_data.copy(), level_data.copy())
+    conversion.to_dry_data(rain_data, area_data, village_code=village_code)
+    conversion.add_groups()
+
+    flow_groups = conversion.flow_groups
+    intercept, coefficient = flow_level_conversion.fit_coefficient(flow_groups)
+    flow_groups = flow_groups.loc[np.isfinite(flow_groups["Flow"]) & np.isfinite(flow_groups["AdjDelta"])]
+
+    return {"intercept": intercept, "coefficient": coefficient, "flow_groups": flow_groups}
+
+
+def model(measurements, rain_prediction, station, solver):
+    """
+    Trains a flow_model, returns its flow_model.flow_forecaster.
+    """
+    import flow_model
+
+    flow_data, level_data = measurements
+    fm = flow_model.flow_model(flow_data.copy(), level_data.copy(), rain_prediction, station=station)
+    fm.StochasticGradientDescent(solver=solver)
+
+    return fm.forecaster()
+
+
+def report(DWAAS_table, imputed_flow, coefficient, forecaster):
+    return {"dwaas": DWAAS_table, "impute": imputed_flow, "coefficient": coefficient, "model": forecaster}
+
+
+STAGES = [stage("load", load_measurements, source="measurements"),
+          stage("load_rain", load_rain, source="rain_data"),
+          stage("load_areas", load_areas, source="shape_files"),
+          stage("load_rain_prediction", load_rain_prediction, source="rain_prediction"),
+          stage("clean", clean, inputs=["load"]),
+          stage("summarize_rain", summarize_rain, inputs=["load_rain", "load_areas"],
+                params=["village_code", "dry_threshold"]),
+          stage("dwaas", dwaas, inputs=["clean", "summarize_rain", "load_areas"],
+                params=["village_code", "dry_threshold"]),
+          stage("impute", impute, inputs=["clean"]),
+          stage("coefficient", coefficient, inputs=["clean", "load_rain", "load_areas"], params=["village_code"]),
+          stage("model", model, inputs=["clean", "load_rain_prediction"], params=["station", "solver"]),
+          stage("all", report, inputs=["dwaas", "impute", "coefficient", "model"], cache=False)]
+
+
+def pipeline_params(path, pump="Drunen", village_code=None, dry_threshold=0, solver="keras"):
+    """
+    Parameters of the stages for pump, with the data in path in the folder layout
+    of the data share (see main.py). The village code defaults to the first three
+    letters of the pump name (e.g. 'DRU' for Drunen). solver is that of the flow model,
+    see flow_model.StochasticGradientDescent(): 'keras' trains the network as main.py
+    always did, 'cholesky', 'qr' or 'lstsq' fit the same linear model exactly.
+    """
+    import load_files
+
+    return {"measurements": os.path.join(path, "sewer_data", "data_pump",
+                                         "RG{}".format(load_files.pump_to_id_dict[pump])),
+            "rain_data": os.path.join(path, "sewer_data", "rain_timeseries"),
+            "rain_prediction": os.path.join(path, "sewer_data", "rain_grid_prediction"),
+            "shape_files": os.path.join(path, "sewer_model", "aa-en-maas_sewer_shp"),
+            "station": pump,
+            "village_code": village_code if village_code is not None else pump[:3].upper(),
+            "dry_threshold": dry_threshold,
+            "solver": solver}
+
+
+if __name__ == "__main__":
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target", choices=[i.name for i in STAGES])
+    parser.add_argument("--data", required=True, help="folder with the data, in the layout of the data share")
+    parser.add_argument("--pump", default="Drunen")
+    parser.add_argument("--village", help="village code of the pump, e.g. DRU")
+    parser.add_argument("--dry-threshold", type=float, default=0)
+    parser.add_argument("--solver", default="keras", help="solver of the flow model, see flow_model")
+    parser.add_argument("--cache", help="folder to cache results in, by default <data>/cache")
+    parser.add_argument("--jobs", type=int, help="number of stages to run at the same time")
+    parser.add_argument("--processes", action="store_true", help="run stages in processes instead of threads")
+    parser.add_argument("--force", action="store_true", help="also rerun stages that are up to date")
+    parser.add_argument("--plan", action="store_true", help="only print the stages that would run")
+    args = parser.parse_args()
+
+    runner = pipeline(STAGES, pipeline_params(args.data, args.pump, args.village, args.dry_threshold, args.solver),
+                      cache_dir=args.cache if args.cache is not None else os.path.join(args.data, "cache"),
+                      n_jobs=args.jobs, processes=args.processes)
+
+    if args.plan:
+        print("Stages to run: {}".format(", ".join(runner.plan(args.target, force=args.force)) or "none"))
+    else:
+        print(runner.run(args.target, force=args.force))
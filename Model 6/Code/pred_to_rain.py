@@ -1,69 +1,232 @@
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
 # Objective: Find the cell in the rain prediction grid    #
-# corresponding to the centroid of an area.               #
+# corresponding to the centroid of an area, or the        #
+# overlap of an area with all cells.                      #
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
 
+import os
 import pandas as pd
-import geopandas as gpd
 import numpy as np
-import datetime
 import preprocessing
+import utility
+import feature_store
+import rain_store
+
+
+def overlap_matrix(geometry, grid_shape, reduced=False):
+    """
+    Sparse (area x cell) matrix holding the fraction of every area that lies in each
+    cell of the rain prediction grid, so that a row sums to 1. Cells are flattened row
+    by row from a grid of grid_shape (height, width), indexed as in pred_to_rain.exact().
+
+    geometry:  GeoSeries of the areas in EPSG:4326
+    """
+    from scipy import sparse
+    from shapely.geometry import box
+
+    height, width = grid_shape
+    rows, cells, weights = [], [], []
+
+    for k, polygon in enumerate(geometry):
+        # Candidate cells from the bounding box of the area
+        minx, miny, maxx, maxy = polygon.bounds
+        x_first, y_last = preprocessing.cell_index(minx, miny)
+        x_last, y_first = preprocessing.cell_index(maxx, maxy)
+
+        overlaps = []
+        for x in range(x_first, x_last + 1):
+            for y in range(y_first, y_last + 1):
+                top = preprocessing.Y_SPACE[300 - y]
+                left = preprocessing.X_SPACE[x]
+                cell = box(left, top - preprocessing.CELL_HEIGHT, left + preprocessing.CELL_WIDTH, top)
+
+                if reduced:
+                    x_grid, y_grid = x - preprocessing.REDUCED_X_OFFSET, y - preprocessing.REDUCED_Y_OFFSET
+                else:
+                    x_grid, y_grid = x, y
+
+                if 0 <= y_grid < height and 0 <= x_grid < width:
+                    overlaps.append((y_grid * width + x_grid, polygon.intersection(cell).area))
+
+        total = sum(i[1] for i in overlaps)
+        for cell, overlap in overlaps:
+            if overlap > 0:
+                rows.append(k)
+                cells.append(cell)
+                weights.append(overlap / total)
+
+    return sparse.csr_matrix((weights, (rows, cells)), shape=(len(geometry), height * width))
+
+
+# Area to cell tables computed in this session, per area_data object
+_area_cells = utility.object_cache()
+
+
+def area_cells(area_data, reduced=False, cache_dir=None):
+    """
+    Table of the centroid (EPSG:4326) and the prediction grid cell under it of every
+    area in area_data. Kept in memory for as long as area_data exists and is unchanged,
+    and in cache_dir if given, per fingerprint of the names, geometries and CRS of the
+    areas and the grid definition, so it is only computed once.
+
+    Returns a data frame with the columns 'area_name', 'x', 'y', 'x_cell' and 'y_cell'.
+    """
+    signature = utility.frame_signature(area_data) + (reduced,)
+
+    return _area_cells.get(area_data, signature, lambda: _compute_area_cells(area_data, reduced, cache_dir))
+
+
+def _compute_area_cells(area_data, reduced, cache_dir):
+    path = None
+    if cache_dir is not None:
+        key = feature_store.fingerprint(list(area_data["area_name"]), [i.wkb for i in area_data["geometry"]],
+                                        str(area_data.crs), reduced, preprocessing.X_SPACE, preprocessing.Y_SPACE)
+        path = os.path.join(cache_dir, "cells_" + key + ".p")
+
+    if path is not None and os.path.exists(path):
+        return pd.read_pickle(path)
+
+    # Reproject once for both coordinates
+    centroids = area_data["geometry"].to_crs({'init': 'epsg:4326'}).centroid
+
+    cells = pd.DataFrame({"area_name": area_data["area_name"].values,
+                          "x": centroids.x.values,
+                          "y": centroids.y.values})
+    cells["x_cell"], cells["y_cell"] = preprocessing.cell_indices(cells["x"], cells["y"], reduced=reduced)
+
+    if path is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        cells.to_pickle(path)
+
+    return cells
+
+
+def grid_layer_index(rain_start, prediction_start):
+    """
+    Index of the first rain prediction grid layer starting at each hour of rain_start
+    (the sorted start times of the rain data, rain_store.start), built with integer arithmetic.
+
+    Returns a series of layer indices indexed by seconds since the first hour of
+    rain_start, and that first hour.
+    """
+    rain_ns = np.asarray(rain_start).astype("<M8[ns]").view(np.int64)
+    prediction_ns = prediction_start.values.astype("<M8[ns]").view(np.int64)
+
+    # Drop minutes of the rain data timestamps
+    rain_ns = rain_ns - rain_ns % preprocessing.NS_PER_HOUR + rain_ns % (60 * preprocessing.NS_PER_SECOND)
+    base_ns = rain_ns[0]
+
+    # First layer of every start time that occurs in the rain data
+    starts, first_layers = np.unique(prediction_ns, return_index=True)
+    matched = np.isin(starts, rain_ns)
+
+    grid_layers = pd.Series(first_layers[matched], index=(starts[matched] - base_ns) // preprocessing.NS_PER_SECOND)
+
+    return grid_layers, pd.Timestamp(base_ns)
 
 
 class pred_to_rain:
-    def __init__(self, rain_data, rain_prediction, area_data):
+    def __init__(self, rain_data, rain_prediction, area_data, cache_dir=None):
+        """
+        cache_dir:  Folder to store the area to cell table in, see area_cells().
+        """
         reduced = rain_prediction[1].shape[1] < 300
 
-        if rain_data["Start"].dtype != "<M8[ns]":
-            rain_data["Start"] = pd.to_datetime(rain_data["Start"])
+        # Sorted start times and area names, without changing rain_data
+        store = rain_store.get_rain_store(rain_data)
 
-        # Sort rain data by time
-        rain_data.sort_values("Start", inplace=True)
-        rain_data.reset_index(drop=True, inplace=True)
+        # Row/column index in prediction grid, looked up for area_data itself so it is cached
+        cells = area_cells(area_data, reduced=reduced, cache_dir=cache_dir)
 
         # Narrow area data to streets that occur in rain data
-        area_data = area_data.loc[area_data["area_name"].isin(rain_data.columns)].reset_index(drop=True)
+        in_rain = area_data["area_name"].isin(store.area_index).values
+        area_data = area_data.loc[in_rain].reset_index(drop=True)
+        cells = cells.loc[in_rain]
 
         # Add column of row/column index in prediction grid
-        area_data["x"] = area_data["geometry"].to_crs({'init': 'epsg:4326'}).centroid.x
-        area_data["y"] = area_data["geometry"].to_crs({'init': 'epsg:4326'}).centroid.y
-
-        # Get grid indices for x and y coordinates
-        indices = preprocessing.vec_cell_index(area_data["x"], area_data["y"], reduced=reduced)
-        indices = list(zip(indices[0], indices[1]))
-        area_data["loc"] = indices
-
-        #
-        rain_data_times = rain_data["Start"].apply(lambda i: i.replace(minute=0))
-        base_time = rain_data_times[0]
-        rain_data_int_times = rain_data_times.apply(lambda i: int((i - base_time).total_seconds()))
-
-        date_to_index = pd.Series(range(len(rain_prediction[0])),
-                                  index = rain_prediction[0]["start"]\
-                                  .apply(lambda i: int((i - base_time).total_seconds())))
+        area_data["x"] = cells["x"].values
+        area_data["y"] = cells["y"].values
+        area_data["loc"] = list(zip(cells["x_cell"], cells["y_cell"]))
 
         # grid_layers: index of rain prediction grid layer for each 'Start'-TimeStamp
         # in rain_data
-        grid_layers = date_to_index.loc[date_to_index.index.intersection(rain_data_int_times)]
-        grid_layers = grid_layers.loc[~grid_layers.index.duplicated(keep='first')]
+        grid_layers, base_time = grid_layer_index(store.start, rain_prediction[0]["start"])
 
         # ADD DATA TO CLASS
         self.rain_data = rain_data
+        self.rain_store = store
         self.rain_prediction = rain_prediction
         self.area_data = area_data
         self.grid_layers = grid_layers
         self.base_time = base_time
 
     def exact(self):
-        rain_values = self.area_data["loc"].apply(lambda i: pd.Series(rain_prediction[1][self.grid_layers, i[1], i[0]]))
-        rain_values.index = self.area_data["area_name"]
-        rain_values = rain_values.T
-        rain_values["Start"] = pd.Series(self.grid_layers.index)\
-                                         .apply(lambda i: self.base_time + datetime.timedelta(seconds = i))
-        rain_values["End"] = rain_values["Start"].apply(lambda i: i + datetime.timedelta(hours = 1))
-        rain_values = rain_values.loc[:,~rain_values.columns.duplicated()]
+        """
+        Predicted rain of the grid cell under the centroid of every area, for every
+        matched grid layer. Gathered from the grid in a single indexing operation.
+
+        Returns a data frame with a column per area and the columns 'Start' and 'End'.
+        """
+        # First occurrence of every area name only
+        areas = self.area_data.loc[~self.area_data["area_name"].duplicated()]
+        xs = np.array([i[0] for i in areas["loc"]])
+        ys = np.array([i[1] for i in areas["loc"]])
+        layers = self.grid_layers.values
+
+        # (time x area) array of rain values
+        values = self.rain_prediction[1][layers[:, None], ys[None, :], xs[None, :]]
+
+        rain_values = pd.DataFrame(values, columns=areas["area_name"].values)
+        rain_values.columns.name = "area_name"
+        rain_values["Start"] = self.base_time + pd.to_timedelta(self.grid_layers.index.values, unit="s")
+        rain_values["End"] = rain_values["Start"] + pd.Timedelta(hours=1)
 
         return rain_values
 
-    def estimated(self):
-        pass
+    def estimated(self, cache_dir=None):
+        """
+        Predicted rain of every area as the average of all grid cells it overlaps,
+        weighted by overlapping area, for every matched grid layer. Computed as a
+        single sparse matrix product of the overlap_matrix() and the flattened grids.
+
+        cache_dir:  Folder to store the overlap matrix in, keyed by the area geometries
+                    and the grid definition, so it is computed only once.
+
+        Returns a data frame with a column per area and the columns 'Start' and 'End'.
+        """
+        from scipy import sparse
+
+        # First occurrence of every area name only
+        areas = self.area_data.loc[~self.area_data["area_name"].duplicated()]
+        grid = self.rain_prediction[1]
+        grid_shape = grid.shape[1:]
+        reduced = grid_shape[0] < 300
+
+        geometry = areas["geometry"].to_crs({'init': 'epsg:4326'})
+
+        weights = None
+        if cache_dir is not None:
+            key = feature_store.fingerprint([i.wkb for i in geometry], grid_shape, reduced,
+                                            preprocessing.X_SPACE, preprocessing.Y_SPACE)
+            path = os.path.join(cache_dir, "overlap_" + key + ".npz")
+            if os.path.exists(path):
+                weights = sparse.load_npz(path)
+
+        if weights is None:
+            weights = overlap_matrix(geometry, grid_shape, reduced=reduced)
+            if cache_dir is not None:
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+                sparse.save_npz(path, weights)
+
+        # (area x cell) times (cell x time)
+        layers = self.grid_layers.values
+        values = weights.dot(grid[layers].reshape(len(layers), -1).T).T
+
+        rain_values = pd.DataFrame(values, columns=areas["area_name"].values)
+        rain_values.columns.name = "area_name"
+        rain_values["Start"] = self.base_time + pd.to_timedelta(self.grid_layers.index.values, unit="s")
+        rain_values["End"] = rain_values["Start"] + pd.Timedelta(hours=1)
+
+        return rain_values
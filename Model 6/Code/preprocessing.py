@@ -1,8 +1,9 @@
 import pandas as pd
 import numpy as np
 import utility
-from scipy.signal import find_peaks
 import datetime
+import schema
+import instrumentation
 
 rg_spots = \
 {"Drunen":            (51.680344, 5.132245),
@@ -17,14 +18,85 @@ rg_spots = \
  "Rompert":           (51.711202, 5.311724)}
 
 
+# Nanoseconds per unit of time, used for int64 arithmetic on datetime64[ns] values
+NS_PER_SECOND = 10**9
+NS_PER_HOUR = 3600 * NS_PER_SECOND
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+TIME_FEATURES = ("Date", "Hour", "Month", "Weekend", "TimeSpan")
+
+
+def time_features(timestamps, features=TIME_FEATURES, first_span=None):
+    """
+    Vectorized calendar and time features of a datetime series.
+
+    ~~~~~ INPUT  ~~~~~
+    timestamps:  Series of datetime64[ns] values (e.g. df["TimeStamp"])
+    features:    Any of 'Date', 'TimeHour', 'Hour', 'Month', 'Weekend', 'TimeSpan'
+    first_span:  Value of 'TimeSpan' for the first row, NaN if None
+
+    ~~~~~ OUTPUT ~~~~~
+    A data frame with the same index as timestamps and the columns
+    Date :     Date of measurement (datetime64, time set to midnight)
+    TimeHour:  Timestamp floored to the hour
+    Hour :     Hour of the day (int8)
+    Month:     Month of the year (int8)
+    Weekend:   1 if saturday or sunday else 0 (int8)
+    TimeSpan:  Seconds since previous measurement, same as timedelta.seconds
+               (int32 if first_span is given, float32 otherwise)
+    """
+    if timestamps.dtype != "<M8[ns]":
+        timestamps = pd.to_datetime(timestamps)
+
+    ns = timestamps.values.astype("<M8[ns]").view(np.int64)
+    output = pd.DataFrame(index=timestamps.index)
+
+    for i in features:
+        if i == "Date":
+            output[i] = ((ns // NS_PER_DAY) * NS_PER_DAY).view("<M8[ns]")
+        elif i == "TimeHour":
+            output[i] = ((ns // NS_PER_HOUR) * NS_PER_HOUR).view("<M8[ns]")
+        elif i == "Hour":
+            output[i] = ((ns // NS_PER_HOUR) % 24).astype(np.int8)
+        elif i == "Month":
+            output[i] = timestamps.dt.month.values.astype(np.int8)
+        elif i == "Weekend":
+            # 1970-01-01 was a thursday, so weekday = (days since epoch + 3) % 7
+            output[i] = (((ns // NS_PER_DAY) + 3) % 7 >= 5).astype(np.int8)
+        elif i == "TimeSpan":
+            span = np.empty(len(ns), dtype=np.float32 if first_span is None else np.int32)
+            span[1:] = (np.diff(ns) // NS_PER_SECOND) % 86400
+            if len(ns) > 0:
+                span[0] = np.nan if first_span is None else first_span
+            output[i] = span
+        else:
+            raise ValueError("Unknown time feature '{}'".format(i))
+
+    return output
+
+
+def add_time_features(df, features=TIME_FEATURES, first_span=None, column="TimeStamp"):
+    """
+    Adds the columns of time_features() of df[column] to df.
+    """
+    features = time_features(df[column], features=features, first_span=first_span)
+    for i in features.columns:
+        df[i] = features[i]
+
+    return df
+
+
+@instrumentation.instrument
 def clean_mes_data(df, convert_timestamp=True, sort_timestamp=True, remove_duplicates=True, select_quality=True):
     '''
     This function convert the timestamp column to timestamp, sort on the timestamp column,
-    removes duplicates and saves only the data with quality equal to 1
+    removes duplicates and saves only the data with quality equal to 1. Columns are
+    converted to the compact types of schema.MEASUREMENT_SCHEMA.
     '''
     if convert_timestamp:
         if df["TimeStamp"].dtype != "<M8[ns]":
             df["TimeStamp"] = pd.to_datetime(df["TimeStamp"])
+    df = schema.compact(df, schema.MEASUREMENT_SCHEMA)
 
     if sort_timestamp:
         df.sort_values("TimeStamp", inplace=True)
@@ -39,6 +111,7 @@ def clean_mes_data(df, convert_timestamp=True, sort_timestamp=True, remove_dupli
     return df
 
 
+@instrumentation.instrument
 def merge_flow_level(flow_data, level_data):
     # INTERPOLATION OF MISSING MEASUREMENTS
     # Get all timestamps
@@ -53,6 +126,7 @@ def merge_flow_level(flow_data, level_data):
     return flow_data, level_data
 
 
+@instrumentation.instrument
 def fill_flow(flow_data):
     '''
     Fill in missing flow data
@@ -68,10 +142,14 @@ def fill_flow(flow_data):
     return flow_data
 
 
+@instrumentation.instrument
 def fill_level(level_data):
     '''
     Fill missing level data
     '''
+    if not level_data["Value"].isna().any():
+        return level_data
+
     na_indices = level_data.index[level_data["Value"].isna()]
     non_na_indices = level_data.index[~level_data["Value"].isna()]
 
@@ -114,6 +192,8 @@ def flow_group(flow):
 
 
 def level_group(lst):
+    from scipy.signal import find_peaks
+
     output = np.repeat(0, len(lst))
 
     maxima = find_peaks(lst, prominence=0.5)[0]
@@ -127,22 +207,100 @@ def level_group(lst):
     return pd.Series(output, index=lst.index)
 
 
-def cell_index(x, y, reduced=False):
-    x_space = np.linspace(start = -0.0185, stop = -0.0185 + 300*0.037, num = 301)
-    y_space = np.linspace(start = 48.9885, stop = 48.9885 + 300*0.023, num = 301)
+# Cell edges (longitude, latitude in EPSG:4326) of the HARMONIE rain prediction grid
+CELL_WIDTH = 0.037
+CELL_HEIGHT = 0.023
+X_SPACE = np.linspace(start = -0.0185, stop = -0.0185 + 300*CELL_WIDTH, num = 301)
+Y_SPACE = np.linspace(start = 48.9885, stop = 48.9885 + 300*CELL_HEIGHT, num = 301)
+
+# Offsets of cell indices in the grid as reduced by load_files.get_rain_prediction()
+REDUCED_X_OFFSET = 91
+REDUCED_Y_OFFSET = 101
 
-    x_out = np.where(x >= x_space)[0][-1]
-    y_out = 300 - np.where(y <= y_space)[0][0]
+
+def cell_index(x, y, reduced=False):
+    x_out = np.where(x >= X_SPACE)[0][-1]
+    y_out = 300 - np.where(y <= Y_SPACE)[0][0]
 
     if reduced:
-        x_out = x_out - 91
-        y_out = y_out - 101
+        x_out = x_out - REDUCED_X_OFFSET
+        y_out = y_out - REDUCED_Y_OFFSET
 
     return x_out, y_out
 
 vec_cell_index = np.vectorize(cell_index)
 
 
+def cell_indices(x, y, reduced=False):
+    """
+    Same as cell_index(), for arrays of coordinates at once.
+    """
+    x_out = np.searchsorted(X_SPACE, np.asarray(x), side="right") - 1
+    y_out = 300 - np.searchsorted(Y_SPACE, np.asarray(y), side="left")
+
+    if reduced:
+        x_out = x_out - REDUCED_X_OFFSET
+        y_out = y_out - REDUCED_Y_OFFSET
+
+    return x_out, y_out
+
+
+class area_table:
+    """
+    Table of sub-catchment areas keyed by village code and area name, computed once
+    from load_files.sdf(...).area_data. Use get_area_table() to get a cached instance.
+
+    ~~~~~ ATTRIBUTES ~~~~~
+    table:   Data frame indexed by ('village_ID', 'area_name') with the column 'area'
+             (square-kilometres)
+    """
+    def __init__(self, area_data):
+        village_ID = area_data["sewer_system"].str.slice(4, 7)
+
+        # Vectorized area calculation in square-kilometres
+        area = area_data["geometry"].to_crs({"init": "epsg:3395"}).area / 10**6
+
+        table = pd.DataFrame({"village_ID": village_ID.values,
+                              "area_name": area_data["area_name"].values,
+                              "area": area.values}).set_index(["village_ID", "area_name"])
+
+        # Lookup dictionaries per village
+        self.table = table
+        self.village_area = table.groupby(level="village_ID")["area"].sum().to_dict()
+        self.village_area_names = {i: list(j.index.get_level_values("area_name"))
+                                   for i, j in table.groupby(level="village_ID")}
+
+    def area(self, village_code):
+        """
+        Total area of all sub-catchments of a village in square-kilometres.
+        """
+        return self.village_area.get(village_code, 0.0)
+
+    def area_names(self, village_code, columns=None):
+        """
+        Names of the sub-catchments of a village. If columns is given (e.g. rain_data.columns)
+        only the names that occur in columns are returned.
+        """
+        names = self.village_area_names.get(village_code, [])
+        if columns is not None:
+            columns = set(columns)
+            names = [i for i in names if i in columns]
+
+        return names
+
+
+_area_tables = utility.object_cache()
+
+
+def get_area_table(area_data):
+    """
+    Returns the area_table of area_data, computing it only the first time it is
+    requested for this area_data object, or again after area_data has changed.
+    """
+    return _area_tables.get(area_data, utility.frame_signature(area_data), lambda: area_table(area_data))
+
+
+@instrumentation.instrument
 def summarize_rain_data(rain_data, area_data=None, village_code=None, dry_threshold=0):
     """
     Function to reshape rain data to be fit for the DWAAS analysis.
@@ -161,31 +319,12 @@ def summarize_rain_data(rain_data, area_data=None, village_code=None, dry_thresh
     DrySeries: Number of days since last rainfall.
     """
 
-    # Convert to datetime if necessary
-    if rain_data["Start"].dtype != "<M8[ns]":
-            rain_data["Start"] = pd.to_datetime(rain_data["Start"])
-
-    # Sort data by time because of it being possibly unordered
-    rain_data.sort_values("Start", inplace=True)
-    rain_data.reset_index(drop=True, inplace=True)
+    import rain_store
 
-    # Selects only data from certain right village_code
-    if village_code is not None:
-        area_data["village_ID"] = area_data["sewer_system"].str.slice(4,7)
-        area_data = area_data.loc[area_data["village_ID"] == village_code]
-        areas = area_data["area_name"][area_data["area_name"].apply(lambda i: i in rain_data.columns)].to_list()
+    # Daily sums are kept by the rain store of rain_data, which leaves rain_data unchanged
+    store = rain_store.get_rain_store(rain_data, area_data if village_code is not None else None)
 
-        rain_data = rain_data.loc[:, ["Start", "End"] + areas]
-
-    # Create date column and sum up rain measurements over all area
-    rain_data["Date"] = rain_data["Start"].apply(lambda i: i.date())
-    rain_data["Total"] = rain_data.iloc[:, 2:].mean(axis=1)
-
-    # Sum measurements by date and create dry-series column
-    rain_data = rain_data.groupby("Date")["Total"].sum().reset_index(drop=False)
-    rain_data["DrySeries"] = utility.reset_cumsum(rain_data["Total"], dry_threshold)
-
-    return rain_data
+    return store.summary(village_code, dry_threshold)
 
 
 def grid_area(rain_grid, rg: str, padding=1, reduced=False):
@@ -198,14 +337,14 @@ def grid_area(rain_grid, rg: str, padding=1, reduced=False):
     return rain_grid[:, coords[0]:(coords[1]+1), coords[2]:(coords[3]+1)]
 
 
+@instrumentation.instrument
 def flow_by_hour(df, impute_range=False):
     '''
     Calculates the total amount of flow per hour
     '''
     flow_data = df.copy()
 
-    flow_data["TimeSpan"] = flow_data["TimeStamp"].diff(1).apply(lambda i: i.seconds).fillna(5)
-    flow_data["TimeHour"] = flow_data["TimeStamp"].apply(lambda i: i.replace(minute=0, second=0))
+    flow_data = add_time_features(flow_data, ["TimeSpan", "TimeHour"], first_span=5)
     flow_data["Flow"] = flow_data["Value"] / 3600 * flow_data["TimeSpan"]
 
     flow_data = flow_data.groupby("TimeHour").aggregate({"Flow": np.sum, "DataQuality": np.mean, "TimeSpan": np.sum})
@@ -219,38 +358,77 @@ def flow_by_hour(df, impute_range=False):
     return flow_data.reset_index(drop=False).rename(columns={"index": "TimeHour"})
 
 
-def match_by_timestamp(rain_prediction, hourly_flow, multiple=False, steps=3):
+@instrumentation.instrument
+def match_indices(rain_prediction_dates, hourly_flow, multiple=False, steps=3):
     """
-    match the rain_prediction with the hourly_flow, by timestamp
+    Finds the hours in hourly_flow for which a rain prediction is available.
+    rain_prediction_dates is the first element of load_files.get_rain_prediction().
+
+    Returns the integer indices of the matching rain prediction grid layers and
+    the matching part of hourly_flow.
     """
-    # Omitting all negative rain predictions
-    rain_prediction[1][rain_prediction[1] < 0] = 0
-    
     if multiple:
-        bool_1 = np.sum([(hourly_flow["TimeHour"]-pd.Timedelta(hours=i)).isin(rain_prediction[0]["start"].shift(i))
+        bool_1 = np.sum([(hourly_flow["TimeHour"]-pd.Timedelta(hours=i)).isin(rain_prediction_dates["start"].shift(i))
                          for i in range(steps)]
                         , axis=0) > 1
         hourly_flow_indices = hourly_flow["TimeHour"][bool_1]
         
     else:
-        bool_1 = hourly_flow["TimeHour"].isin(rain_prediction[0]["start"])
+        bool_1 = hourly_flow["TimeHour"].isin(rain_prediction_dates["start"])
         hourly_flow_indices = hourly_flow["TimeHour"][bool_1]
     
     # Select common TimeStamps
-    shared_indices = np.intersect1d(rain_prediction[0]["start"].values, hourly_flow_indices.values)
+    shared_indices = np.intersect1d(rain_prediction_dates["start"].values, hourly_flow_indices.values)
     
     # Get integer indices to use for rain_prediction
-    rp_indices = rain_prediction[0]["start"].reset_index(drop=False)\
-                                            .set_index("start")\
-                                            .reindex(shared_indices).values.flatten()
-    
+    rp_indices = rain_prediction_dates["start"].reset_index(drop=False)\
+                                               .set_index("start")\
+                                               .reindex(shared_indices).values.flatten()
+
+    return rp_indices, hourly_flow.set_index("TimeHour").reindex(shared_indices).reset_index(drop=False)
+
+
+def horizon_targets(hourly_flow, hours, horizons=24):
+    """
+    Flow of hourly_flow (as created by flow_by_hour()) in the hours + 0, ..., horizons-1
+    hours after each of the given hours.
+
+    Returns an array of shape (len(hours), horizons), NaN where no flow is known.
+    """
+    flow = hourly_flow.set_index("TimeHour")["Flow"]
+    target_hours = np.asarray(hours, dtype="<M8[ns]")[:, None] + np.arange(horizons) * np.timedelta64(1, "h")
+
+    return flow.reindex(target_hours.ravel()).values.reshape(len(hours), horizons)
+
+
+def grid_features(rain_grid, rp_indices, multiple=False, steps=3, dtype=None):
+    """
+    Flattens the rain grid layers rp_indices (and the steps-1 layers before each of
+    them if multiple) to one row of features per index, with a single gather.
+    Negative rain predictions are set to 0.
+    """
     if multiple:
-        grid = np.stack([rain_prediction[1][rp_indices-i] for i in range(steps)])
-    
-        grid = grid.reshape(grid.shape[0], grid.shape[1], grid.shape[2] * grid.shape[3])
-        grid = np.concatenate(grid, axis=1)
+        # Shape (rows, steps, height, width), ordered by step and then by cell
+        grid = rain_grid[np.asarray(rp_indices)[:, None] - np.arange(steps)]
     else:
-        grid = rain_prediction[1][rp_indices]
-        grid = grid.reshape(grid.shape[0], grid.shape[1] * grid.shape[2])
-    
-    return grid, hourly_flow.set_index("TimeHour").reindex(shared_indices).reset_index(drop=False)
+        grid = rain_grid[rp_indices]
+
+    grid = grid.reshape(grid.shape[0], -1)
+    if dtype is not None:
+        grid = grid.astype(dtype, copy=False)
+
+    return np.maximum(grid, 0, out=grid)
+
+
+@instrumentation.instrument
+def match_by_timestamp(rain_prediction, hourly_flow, multiple=False, steps=3):
+    """
+    match the rain_prediction with the hourly_flow, by timestamp
+    """
+    # Omitting all negative rain predictions
+    rain_prediction[1][rain_prediction[1] < 0] = 0
+
+    rp_indices, hourly_flow = match_indices(rain_prediction[0], hourly_flow, multiple=multiple, steps=steps)
+    grid = grid_features(rain_prediction[1], rp_indices, multiple=multiple, steps=steps)
+
+    return grid, hourly_flow
@@ -0,0 +1,140 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Compress the rain prediction grid around a   #
+# pump to a few features per time step, as neighbouring   #
+# cells are strongly correlated.                          #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import numpy as np
+
+
+class spatial_reduction:
+    """
+    Linear map of every (flattened) grid layer to a few features, applied to each
+    time step of a feature row as built by preprocessing.grid_features().
+    Subclasses define _weights(rain_grid, layers), which returns the weights
+    (cells x outputs) fit() stores, and may set offset (cells) in it.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    reduction = ring_pooling().fit(rain_grid)
+    reduced_grid = reduction.transform(preprocessing.grid_features(rain_grid, rp_indices, True, 12))
+    """
+    def __init__(self):
+        self.weights = None
+        self.offset = None
+
+    def fit(self, rain_grid, layers=None):
+        """
+        Fits the reduction on rain_grid (time x height x width), using only the
+        given layer indices if layers is not None. Returns self.
+        """
+        self.shape = rain_grid.shape[1:]
+        self.weights = self._weights(rain_grid, layers)
+        return self
+
+    def __repr__(self):
+        params = {i: j for i, j in self.__dict__.items()
+                  if i not in ["weights", "offset", "shape", "explained_variance"]}
+        return "{}({})".format(type(self).__name__, ", ".join("{}={}".format(i, params[i]) for i in sorted(params)))
+
+    def n_outputs(self):
+        return self.weights.shape[1]
+
+    def transform(self, grid):
+        """
+        Reduces a grid feature matrix (rows x (steps*cells)) to (rows x (steps*outputs)).
+        """
+        cells = self.weights.shape[0]
+        layers = grid.reshape(len(grid), -1, cells)
+        if self.offset is not None:
+            layers = layers - self.offset
+
+        return (layers @ self.weights.astype(grid.dtype)).reshape(len(grid), -1)
+
+    def _distances(self):
+        """
+        Distance in cells of every cell to the centre cell (the pump), in both
+        euclidean and chebyshev (ring) sense.
+        """
+        dy, dx = np.indices(self.shape)
+        dy = dy - (self.shape[0] - 1) / 2
+        dx = dx - (self.shape[1] - 1) / 2
+
+        return np.sqrt(dy**2 + dx**2).ravel(), np.maximum(np.abs(dy), np.abs(dx)).ravel()
+
+
+class ring_pooling(spatial_reduction):
+    """
+    Average rain per square ring around the pump, padding+1 features per time step.
+    """
+    def _weights(self, rain_grid, layers):
+        rings = np.round(self._distances()[1]).astype(int)
+        weights = (rings[:, None] == np.arange(rings.max() + 1)).astype(np.float64)
+
+        return weights / weights.sum(axis=0)
+
+
+class distance_weighting(spatial_reduction):
+    """
+    Average rain weighted by 1/(1+distance)^power to the pump, one feature per time step.
+    """
+    def __init__(self, power=2):
+        spatial_reduction.__init__(self)
+        self.power = power
+
+    def _weights(self, rain_grid, layers):
+        weights = 1 / (1 + self._distances()[0]) ** self.power
+
+        return (weights / weights.sum())[:, None]
+
+
+class pca_basis(spatial_reduction):
+    """
+    Projection of every grid layer on its n_components first principal components.
+    The covariance is accumulated over batches of layers, so the grid is never
+    flattened as a whole.
+    """
+    def __init__(self, n_components=10, batch_size=4096):
+        spatial_reduction.__init__(self)
+        self.n_components = n_components
+        self.batch_size = batch_size
+
+    def _weights(self, rain_grid, layers):
+        if layers is None:
+            layers = np.arange(len(rain_grid))
+        layers = np.unique(layers)
+
+        cells = self.shape[0] * self.shape[1]
+        total, outer = np.zeros(cells), np.zeros((cells, cells))
+        for i in range(0, len(layers), self.batch_size):
+            batch = rain_grid[layers[i:(i + self.batch_size)]].reshape(-1, cells).astype(np.float64)
+            batch = np.maximum(batch, 0)
+            total += batch.sum(axis=0)
+            outer += batch.T @ batch
+
+        mean = total / len(layers)
+        covariance = (outer - len(layers) * np.outer(mean, mean)) / max(len(layers) - 1, 1)
+
+        # Eigenvectors of largest eigenvalues first
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:self.n_components]
+
+        self.offset = mean.astype(np.float32)
+        self.explained_variance = eigenvalues[order]
+
+        return eigenvectors[:, order]
+
+
+REDUCTIONS = {"rings": ring_pooling,
+              "distance": distance_weighting,
+              "pca": pca_basis}
+
+
+def get_reduction(reduction):
+    """
+    Returns an unfitted spatial_reduction given its name ('rings', 'distance', 'pca'),
+    or reduction itself if it already is one (e.g. pca_basis(n_components=5)).
+    """
+    if reduction is None or isinstance(reduction, spatial_reduction):
+        return reduction
+
+    return REDUCTIONS[reduction]()
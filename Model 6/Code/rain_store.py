@@ -0,0 +1,179 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Keep the rain timeseries as one sorted       #
+# area x time array, with the hourly and daily sums per   #
+# area and per village computed once, so the functions    #
+# that need rain get slices of it instead of sorting and  #
+# summing the table of load_files.get_rain() every time.  #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import numpy as np
+import pandas as pd
+import preprocessing
+import utility
+
+
+def _rollup(times, unit):
+    # Start of every unit (hour or day) that occurs in times, and the position of its first row
+    ns = times.view(np.int64)
+    floored = ns - ns % unit
+    first = np.concatenate([[0], np.where(np.diff(floored) != 0)[0] + 1]) if len(ns) else np.array([], dtype=np.int64)
+
+    return floored[first].view("<M8[ns]"), first
+
+
+def _sum(values, first):
+    # Sums of the columns of values from every position in first to the next, missing values count as 0
+    if values.shape[1] == 0:
+        return np.zeros((values.shape[0], 0))
+
+    return np.add.reduceat(np.where(np.isnan(values), 0, values), first, axis=1, dtype=np.float64)
+
+
+class rain_store:
+    """
+    Rain timeseries of load_files.get_rain(...) as an array. The table itself is not changed.
+
+    Methods return views on the arrays of the store, which should not be written to.
+
+    ~~~~~ ATTRIBUTES ~~~~~
+    areas:          Names of the areas, the order of the rows of values, hourly and daily
+    start, end:     Start and end time of every measurement (datetime64[ns]), sorted by start
+    values:         Rain of every area per measurement (areas x measurements, float32)
+    hours, dates:   Hours and dates that occur in start
+    hourly, daily:  Rain of every area per hour and per date (areas x hours, areas x dates)
+    villages:       Village codes with precomputed rollups, see set_villages()
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    store = get_rain_store(load_files.get_rain("C:/mypath/rain_timeseries"), sdf.area_data)
+    dates, rain = store.village("DRU", freq="day", start="2018-03-01", end="2018-04-01")
+    """
+    def __init__(self, rain_data, area_data=None):
+        start = rain_data["Start"]
+        if start.dtype != "<M8[ns]":
+            start = pd.to_datetime(start)
+        start = start.values.astype("<M8[ns]")
+        end = pd.to_datetime(rain_data["End"]).values.astype("<M8[ns]")
+        order = np.argsort(start, kind="mergesort")
+
+        self.areas = [i for i in rain_data.columns if i not in ("Start", "End")]
+        self.area_index = {j: i for i, j in enumerate(self.areas)}
+        self.start = start[order]
+        self.end = end[order]
+        self.values = np.ascontiguousarray(rain_data[self.areas].values.astype(np.float32)[order].T)
+
+        self.hours, self._hour_first = _rollup(self.start, preprocessing.NS_PER_HOUR)
+        self.dates, self._date_first = _rollup(self.start, preprocessing.NS_PER_DAY)
+        self.hourly = _sum(self.values, self._hour_first)
+        self.daily = _sum(self.values, self._date_first)
+
+        # Average over all areas, as preprocessing.summarize_rain_data() without village_code
+        self._all = self._rollups(np.ones((1, len(self.areas))))
+
+        self.villages = []
+        self.village_index = {}
+        self._area_table = None
+        if area_data is not None:
+            self.set_villages(area_data)
+
+    def _rollups(self, members):
+        # Average rain over the member areas (rows of members) per measurement, summed per hour and per date
+        present = (~np.isnan(self.values)).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = members @ np.where(present > 0, self.values, 0).astype(np.float64) / (members @ present)
+
+        return _sum(mean, self._hour_first), _sum(mean, self._date_first)
+
+    def set_villages(self, area_data):
+        """
+        Computes the hourly and daily average rain over the areas of every village in
+        area_data (load_files.sdf(...).area_data), as preprocessing.summarize_rain_data() does.
+        """
+        # The area table is cached per area_data and rebuilt if it changes, see preprocessing.get_area_table()
+        table = preprocessing.get_area_table(area_data)
+        if table is self._area_table:
+            return
+
+        villages = sorted(table.village_area_names)
+
+        # Areas of every village that occur in the rain data, counted as often as they occur in area_data
+        members = np.zeros((len(villages), len(self.areas)))
+        for i, j in enumerate(villages):
+            columns = [self.area_index[k] for k in table.area_names(j, self.areas)]
+            np.add.at(members[i], columns, 1)
+
+        self.village_hourly, self.village_daily = self._rollups(members)
+        self.village_index = {j: i for i, j in enumerate(villages)}
+        self.villages = villages
+        self._area_table = table
+
+    def _window(self, times, start, end):
+        # Slice of times from start up to end
+        first = 0 if start is None else np.searchsorted(times, np.datetime64(pd.Timestamp(start), "ns"), side="left")
+        last = len(times) if end is None else np.searchsorted(times, np.datetime64(pd.Timestamp(end), "ns"), side="left")
+
+        return slice(first, last)
+
+    def _times(self, freq):
+        if freq not in ("raw", "hour", "day"):
+            raise ValueError("freq has to be 'raw', 'hour' or 'day', got {}".format(freq))
+
+        return {"raw": self.start, "hour": self.hours, "day": self.dates}[freq]
+
+    def area(self, name, freq="raw", start=None, end=None):
+        """
+        Times and rain of area name per measurement (freq='raw'), hour or day, from start up to end.
+        """
+        times = self._times(freq)
+        values = {"raw": self.values, "hour": self.hourly, "day": self.daily}[freq][self.area_index[name]]
+        window = self._window(times, start, end)
+
+        return times[window], values[window]
+
+    def village(self, village_code, freq="day", start=None, end=None):
+        """
+        Times and average rain over the areas of village_code (e.g. 'DRU') per hour or day, from start
+        up to end. village_code None averages over all areas. Villages without areas in the rain data
+        have no rain.
+        """
+        if freq == "raw":
+            raise ValueError("Village rain is stored per hour and per day only")
+        times = self._times(freq)
+        window = self._window(times, start, end)
+
+        if village_code is None:
+            values = self._all[1 if freq == "day" else 0][0]
+        elif village_code in self.village_index:
+            values = (self.village_hourly if freq == "hour" else self.village_daily)[self.village_index[village_code]]
+        elif self._area_table is not None:
+            values = np.zeros(len(times))
+        else:
+            raise KeyError("No villages in the store, see set_villages()")
+
+        return times[window], values[window]
+
+    def summary(self, village_code=None, dry_threshold=0):
+        """
+        Same output as preprocessing.summarize_rain_data(): a data frame with the columns 'Date',
+        'Total' and 'DrySeries'.
+        """
+        dates, total = self.village(village_code, freq="day")
+        summary = pd.DataFrame({"Date": dates, "Total": total})
+        summary["DrySeries"] = utility.reset_cumsum(summary["Total"], dry_threshold)
+
+        return summary
+
+
+_rain_stores = utility.object_cache()
+
+
+def get_rain_store(rain_data, area_data=None):
+    """
+    Returns the rain_store of rain_data, building it only the first time it is requested
+    for this rain_data object, or again if rain_data has been changed since (see
+    utility.frame_signature()). If area_data is given its village rollups are added.
+    """
+    store = _rain_stores.get(rain_data, utility.frame_signature(rain_data), lambda: rain_store(rain_data))
+    if area_data is not None:
+        store.set_villages(area_data)
+
+    return store
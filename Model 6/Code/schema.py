@@ -0,0 +1,87 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: One compact set of column types for the      #
+# measurement data, used from loading through analysis,   #
+# and a check that a data frame follows it.               #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import numpy as np
+import pandas as pd
+
+
+# Columns of flow and level measurements, as returned by load_files. Values are
+# measured with at most 3 decimals, which float32 holds for values below 8192
+MEASUREMENT_SCHEMA = {"RG_ID": np.int16,
+                      "TimeStamp": np.dtype("<M8[ns]"),
+                      "Value": np.float32,
+                      "DataQuality": np.int8}
+
+# Helper columns added during analysis (see preprocessing.time_features() and measurement_analysis)
+FEATURE_SCHEMA = {"Date": np.dtype("<M8[ns]"),
+                  "TimeHour": np.dtype("<M8[ns]"),
+                  "Hour": np.int8,
+                  "Month": np.int8,
+                  "Weekend": np.int8,
+                  "max": np.int8,
+                  "min": np.int8,
+                  "Dry": np.int8}
+
+SCHEMA = dict(MEASUREMENT_SCHEMA, **FEATURE_SCHEMA)
+
+
+def compact(df, schema=SCHEMA):
+    """
+    Converts the columns of df that are in schema to their compact type, in place.
+    Columns that already have that type are not copied. Timestamps that are still
+    text are left alone, preprocessing.clean_mes_data() converts them.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    flow_data = schema.compact(flow_data)
+    """
+    for column, dtype in schema.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+
+        values = df[column]
+        if np.dtype(dtype).kind == "M":
+            if not pd.api.types.is_datetime64_any_dtype(values):
+                continue
+        elif np.dtype(dtype).kind in "iu" and len(values) > 0:
+            info = np.iinfo(dtype)
+            if values.isna().any() or values.min() < info.min or values.max() > info.max:
+                raise ValueError("Column '{}' does not fit in {}".format(column, np.dtype(dtype).name))
+
+        df[column] = values.astype(dtype)
+
+    return df
+
+
+def validate(df, schema=MEASUREMENT_SCHEMA, name="data"):
+    """
+    Checks that df has all columns of schema with their compact type, and that
+    DataQuality only holds 0 and 1. Raises a ValueError listing every problem,
+    returns df otherwise.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    flow_data = schema.validate(preprocessing.clean_mes_data(flow_data), name="flow_data")
+    """
+    problems = []
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            problems += ["column '{}' is missing".format(column)]
+        elif df[column].dtype != dtype:
+            problems += ["column '{}' is {}, expected {}".format(column, df[column].dtype, np.dtype(dtype).name)]
+
+    if "DataQuality" in schema and "DataQuality" in df.columns and not df["DataQuality"].isin([0, 1]).all():
+        problems += ["column 'DataQuality' has values other than 0 and 1"]
+
+    if problems:
+        raise ValueError("{} does not follow the schema: {}".format(name, "; ".join(problems)))
+
+    return df
+
+
+def memory_mb(df):
+    """
+    Memory of df in megabytes, including the contents of text columns.
+    """
+    return df.memory_usage(index=True, deep=True).sum() / 2**20
@@ -0,0 +1,165 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Project the level in the wet well of a pump  #
+# forward under an ensemble of inflow forecasts, and give #
+# the probability per hour that the level reaches the     #
+# level the pump turns on at, or overflows. All scenarios #
+# are stepped forward at once as array operations.        #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import numpy as np
+import pandas as pd
+
+
+class simulation:
+    """
+    Water balance of the wet well of one pump: inflow fills the well, the pump empties it
+    between on_level and off_level, and above overflow_level the well overflows.
+
+    While it runs, the pump delivers max_capacity at on_level and down to min_capacity
+    near off_level (linear in between), like a pump controlled by the level.
+
+    ~~~~~ INPUT  ~~~~~
+    coefficient:     Pumped volume per unit of level change, the coefficient of 'Flow ~ I + AdjDelta'
+                     (see flow_level_conversion.fit_coefficient(), negative: pumping lowers the level)
+    min_capacity,
+    max_capacity:    Capacity of the pump in m3/h, as in load_files.sdf(...).RG_data
+    on_level,
+    off_level:       Level the pump turns on and off at
+    overflow_level:  Level at which the well overflows
+    substeps:        Steps per hour
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    sim = station_simulation(sdf.RG_data, 8150, coefficient, level_data)
+    inflow = inflow_ensemble(forecaster.forecast(latest_prediction)["Flow"], residuals, n_scenarios=5000)
+    sim.run(inflow, level=level_data["Value"].iloc[-1])
+    """
+    def __init__(self, coefficient, min_capacity, max_capacity, on_level, off_level, overflow_level, substeps=12):
+        if coefficient >= 0:
+            raise ValueError("coefficient has to be negative (pumping lowers the level), got {}".format(coefficient))
+        if not off_level < on_level < overflow_level:
+            raise ValueError("Levels have to be off_level < on_level < overflow_level")
+
+        self.volume_per_level = -coefficient
+        self.min_capacity = min_capacity
+        self.max_capacity = max_capacity
+        self.on_level = on_level
+        self.off_level = off_level
+        self.overflow_level = overflow_level
+        self.substeps = substeps
+
+    def capacity(self, level):
+        """
+        Pump capacity in m3/h at level while the pump runs.
+        """
+        share = (level - self.off_level) / (self.on_level - self.off_level)
+        return self.min_capacity + (self.max_capacity - self.min_capacity) * np.clip(share, 0, 1)
+
+    def run(self, inflow, level, pumping=None, start=None):
+        """
+        Steps all inflow scenarios forward from the current level.
+
+        ~~~~~ INPUT  ~~~~~
+        inflow:   Array of scenarios x hours with the inflow in m3/h (see inflow_ensemble())
+        level:    Current level, a number or an array with one per scenario
+        pumping:  Whether the pump runs now, by default if level is at least on_level
+        start:    Time of the first hour, to label the output
+
+        ~~~~~ OUTPUT ~~~~~
+        A data frame with a row per hour and the columns
+        TimeHour:     Hour (start + hours, or the hour number if start is None)
+        P_on:         Share of scenarios in which the level reaches on_level in that hour
+        P_overflow:   Share of scenarios in which the well overflows in that hour
+        Level:        Mean level at the end of the hour
+        Level_p10,
+        Level_p90:    10% and 90% quantile of the level at the end of the hour
+        Pumped:       Mean pumped volume in m3
+        Overflow:     Mean overflowing volume in m3
+        """
+        inflow = np.atleast_2d(np.asarray(inflow, dtype=np.float64))
+        n_scenarios, hours = inflow.shape
+
+        level = np.broadcast_to(np.asarray(level, dtype=np.float64), (n_scenarios,)).copy()
+        pumping = level >= self.on_level if pumping is None else\
+                  np.broadcast_to(np.asarray(pumping, dtype=bool), (n_scenarios,)).copy()
+
+        reached_on = np.zeros((hours, n_scenarios), dtype=bool)
+        overflowed = np.zeros((hours, n_scenarios), dtype=bool)
+        levels = np.empty((hours, n_scenarios))
+        pumped = np.zeros((hours, n_scenarios))
+        spilled = np.zeros((hours, n_scenarios))
+
+        step = 1 / self.substeps
+        for hour in range(hours):
+            inflow_step = inflow[:, hour] * step
+            for i in range(self.substeps):
+                # Pumped volume, at most the water above off_level (levels can be below 0)
+                out = np.where(pumping, self.capacity(level) * step, 0.0)
+                out = np.minimum(out, np.maximum((level - self.off_level) * self.volume_per_level + inflow_step, 0))
+                level = level + (inflow_step - out) / self.volume_per_level
+
+                # Volume above the overflow level leaves the well
+                spill = np.maximum(level - self.overflow_level, 0) * self.volume_per_level
+                level = np.minimum(level, self.overflow_level)
+
+                # Pump turns on at on_level and off at off_level
+                pumping = (level >= self.on_level) | (pumping & (level > self.off_level))
+
+                reached_on[hour] |= level >= self.on_level
+                overflowed[hour] |= spill > 0
+                pumped[hour] += out
+                spilled[hour] += spill
+
+            levels[hour] = level
+
+        hour_labels = np.arange(hours) if start is None else pd.Timestamp(start) + pd.to_timedelta(np.arange(hours), unit="h")
+
+        return pd.DataFrame({"TimeHour": hour_labels,
+                             "P_on": reached_on.mean(axis=1),
+                             "P_overflow": overflowed.mean(axis=1),
+                             "Level": levels.mean(axis=1),
+                             "Level_p10": np.percentile(levels, 10, axis=1),
+                             "Level_p90": np.percentile(levels, 90, axis=1),
+                             "Pumped": pumped.mean(axis=1),
+                             "Overflow": spilled.mean(axis=1)})
+
+
+def inflow_ensemble(forecast, residuals, n_scenarios=1000, seed=None):
+    """
+    Inflow scenarios around a forecast of the hourly flow (which over an hour equals the
+    inflow), by adding residuals of the flow model drawn with replacement for every
+    scenario and hour. Negative inflow is set to 0.
+
+    ~~~~~ INPUT  ~~~~~
+    forecast:   Hourly flow in m3/h, e.g. flow_forecaster.forecast(...)["Flow"]
+    residuals:  Errors of the flow model on measured hours, e.g. model.y - model.model.predict(model.X)
+
+    ~~~~~ OUTPUT ~~~~~
+    Array of n_scenarios x hours
+    """
+    forecast = np.asarray(forecast, dtype=np.float64).reshape(-1)
+    residuals = np.asarray(residuals, dtype=np.float64).reshape(-1)
+    residuals = residuals[np.isfinite(residuals)]
+
+    rng = np.random.RandomState(seed)
+    noise = residuals[rng.randint(0, len(residuals), size=(n_scenarios, len(forecast)))]
+
+    return np.maximum(forecast[None, :] + noise, 0)
+
+
+def station_simulation(RG_data, rg_id, coefficient, level_data, overflow_level=None, on_quantile=0.95,
+                       off_quantile=0.05, substeps=12):
+    """
+    simulation of pump rg_id with the capacities in RG_data (load_files.sdf(...).RG_data) and
+    the on and off level estimated from its level measurements, as the on_quantile and off_quantile
+    of the level (see data_imputation.fill_flow()). overflow_level defaults to the highest level measured.
+    """
+    pump = RG_data.loc[RG_data["RG_ID"].astype(str) == str(rg_id)]
+    if len(pump) == 0:
+        raise KeyError("No pump with RG_ID {} in RG_data".format(rg_id))
+
+    level = level_data["Value"].dropna().values
+    on_level, off_level = np.quantile(level, on_quantile), np.quantile(level, off_quantile)
+    overflow_level = overflow_level if overflow_level is not None else level.max()
+
+    return simulation(coefficient, float(pump["min_capacity"].iloc[0]), float(pump["max_capacity"].iloc[0]),
+                      on_level, off_level, overflow_level, substeps=substeps)
@@ -0,0 +1,452 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Keep near-real-time numbers per pump from    #
+# measurement files dropped in a folder (a stand-in for   #
+# the SCADA historian feed): cleaned series, hourly flow, #
+# the current pump cycle and imputed flow. Every record   #
+# is processed on arrival in constant time and memory.    #
+#                                                         #
+# python streaming.py D:/DC3/drop [--interval 1]          #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import datetime
+from collections import deque, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def parse_time(text):
+    """
+    Seconds since 1970 of a timestamp 'dd-mm-YYYY HH:MM:SS' (old format) or
+    'YYYY-mm-dd HH:MM:SS' (historian format), without the cost of strptime.
+    """
+    if text[2] == "-":
+        year, month, day = int(text[6:10]), int(text[3:5]), int(text[0:2])
+    else:
+        year, month, day = int(text[0:4]), int(text[5:7]), int(text[8:10])
+
+    return (datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL) * 86400 +\
+           int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+
+
+def to_timestamps(seconds):
+    return pd.to_datetime(np.asarray(seconds, dtype=np.int64), unit="s")
+
+
+class pump_state:
+    """
+    State of one pump, updated per measurement in constant time. Memory is bounded
+    by history (records per series), hours (hourly flow) and max_bins.
+
+    ~~~~~ INPUT  ~~~~~
+    first_span:   Seconds assigned to the first flow record, as in preprocessing.flow_by_hour()
+    prominence:   Level change that starts or ends a level drop, as in preprocessing.level_group()
+    horizon:      Number of past level records the monotonicity is taken over, and
+    beta:         number of them that may go the other way, see data_imputation.fill_flow()
+    level_bin:    Width of the level bins flow is averaged over for imputation
+    on_quantile:  Quantile of the level used as the level the pump turns on at
+    """
+    def __init__(self, rg_id, history=10000, hours=24*7, first_span=5, prominence=0.5, horizon=10, beta=4,
+                 level_bin=1.0, max_bins=1000, on_quantile=0.95):
+        self.rg_id = rg_id
+        self.hours = hours
+        self.first_span = first_span
+        self.prominence = prominence
+        self.beta = beta
+        self.level_bin = level_bin
+        self.max_bins = max_bins
+        self.on_quantile = on_quantile
+
+        # Cleaned series of (seconds, value)
+        self.flow = deque(maxlen=history)
+        self.level = deque(maxlen=history)
+        self.dropped = {"quality": 0, "duplicate": 0, "late": 0}
+
+        # Hour -> [flow, good records, records, seconds], as preprocessing.flow_by_hour()
+        self.hourly = OrderedDict()
+
+        # Pump cycle (flow peak), as preprocessing.flow_group()
+        self.flow_group = 0
+        self.cycle_start = None
+        self.cycle_volume = 0.0
+
+        # Level drop, as preprocessing.level_group(): the running extreme since the
+        # last turn, and whether the level is going down
+        self.level_group = 0
+        self.falling = False
+        self.extreme = None
+        self.drop_start = None
+
+        # Imputation: recent levels, mean flow per level bin and the latest estimate
+        self.window = deque(maxlen=horizon + 1)
+        self.recent_levels = deque(maxlen=history)
+        self.level_records = 0
+        self.on_level = None
+        self.bins = OrderedDict()
+        self.imputed = None
+
+    def _accept(self, series, seconds, quality):
+        # Same as preprocessing.clean_mes_data() for records arriving in order
+        if quality != 1:
+            self.dropped["quality"] += 1
+            return False
+        if series:
+            if seconds == series[-1][0]:
+                self.dropped["duplicate"] += 1
+                return False
+            if seconds < series[-1][0]:
+                self.dropped["late"] += 1
+                return False
+        return True
+
+    def add_flow(self, seconds, value, quality=1):
+        hour = seconds - seconds % 3600
+        if not self._accept(self.flow, seconds, quality):
+            # Counted in its hour if that is kept, but a rejected record (e.g. late) starts no hour,
+            # so the hours stay in order and no kept hour is pushed out
+            if hour in self.hourly:
+                self.hourly[hour][2] += 1
+            return
+
+        # Accepted records arrive in order, so a new hour is always the latest
+        if hour not in self.hourly:
+            self.hourly[hour] = [0.0, 0, 0, 0]
+            while len(self.hourly) > self.hours:
+                self.hourly.popitem(last=False)
+        hourly = self.hourly[hour]
+        hourly[2] += 1
+
+        previous = self.flow[-1] if self.flow else None
+        span = seconds - previous[0] if previous is not None else self.first_span
+        volume = value / 3600 * span
+
+        hourly[0] += volume
+        hourly[1] += 1
+        hourly[3] += span
+
+        # A pump cycle starts with the first non-zero flow after a zero
+        if value != 0 and (previous is None or previous[1] == 0):
+            self.flow_group += 1
+            self.cycle_start = seconds
+            self.cycle_volume = 0.0
+        if value != 0:
+            self.cycle_volume += volume
+
+        # Flow at the current level, if the level is not rising
+        if self.level and self.level[-1][0] == seconds and self.monotonicity() != 1:
+            key = round(self.level[-1][1] / self.level_bin)
+            stats = self.bins.pop(key, [0.0, 0.0, 0])
+            stats[0], stats[1], stats[2] = stats[0] + value, stats[1] + value**2, stats[2] + 1
+            self.bins[key] = stats
+            if len(self.bins) > self.max_bins:
+                self.bins.popitem(last=False)
+
+        self.flow.append((seconds, value))
+
+    def add_level(self, seconds, value, quality=1):
+        if not self._accept(self.level, seconds, quality):
+            return
+
+        self.level.append((seconds, value))
+        self.window.append(value)
+
+        # Level drops start at a maximum and end at a minimum, both at least
+        # prominence away from the level after them
+        if self.extreme is None:
+            self.extreme = (seconds, value)
+        elif not self.falling:
+            if value > self.extreme[1]:
+                self.extreme = (seconds, value)
+            elif value < self.extreme[1] - self.prominence:
+                self.level_group += 1
+                self.falling = True
+                self.drop_start = self.extreme[0]
+                self.extreme = (seconds, value)
+        else:
+            if value < self.extreme[1]:
+                self.extreme = (seconds, value)
+            elif value > self.extreme[1] + self.prominence:
+                self.falling = False
+                self.extreme = (seconds, value)
+
+        # Level the pump turns on at, refreshed every 1000 records
+        # (len(self.level) stops growing at history, so the records are counted)
+        self.recent_levels.append(value)
+        self.level_records += 1
+        if self.on_level is None or self.level_records % 1000 == 0:
+            self.on_level = float(np.quantile(self.recent_levels, self.on_quantile))
+
+        # Flow is only measured while the pump runs, so estimate it for this level
+        # if it has not been measured at the same time
+        if not self.flow or self.flow[-1][0] != seconds:
+            self.imputed = (seconds, self.impute(value))
+
+    def monotonicity(self):
+        """
+        1 if the recent level increases, -1 if it decreases, 0 otherwise, as
+        data_imputation.check_monotonicity() over the last horizon records.
+        """
+        if len(self.window) < 2:
+            return 0
+
+        window = list(self.window)
+        increasing = sum(j >= i for i, j in zip(window[:-1], window[1:]))
+        n = len(window) - 1
+
+        if n - increasing >= n - self.beta:
+            return -1
+        if increasing >= n - self.beta:
+            return 1
+        return 0
+
+    def impute(self, level):
+        """
+        Flow estimate at level, as data_imputation.fill_flow_apply(): 0 while the level
+        rises below the on level, otherwise the mean flow measured at similar levels
+        (NaN if unknown or too uncertain).
+        """
+        if self.monotonicity() == 1 and level < self.on_level:
+            return 0.0
+
+        stats = self.bins.get(round(level / self.level_bin))
+        if stats is None:
+            return np.nan
+
+        mean = stats[0] / stats[2]
+        std = np.sqrt(max(stats[1] / stats[2] - mean**2, 0))
+        if std > 0.5 * mean:
+            return np.nan
+
+        return mean
+
+    def series(self, kind="flow"):
+        data = self.flow if kind == "flow" else self.level
+        return pd.DataFrame({"TimeStamp": to_timestamps([i[0] for i in data]),
+                             "Value": np.array([i[1] for i in data], dtype=np.float64)})
+
+    def hourly_flow(self):
+        """
+        Flow per hour of the last hours, including the current one, in the format of
+        preprocessing.flow_by_hour(). DataQuality is the share of good records.
+        """
+        hours = list(self.hourly)
+        values = np.array(list(self.hourly.values()), dtype=np.float64).reshape(-1, 4)
+
+        return pd.DataFrame({"TimeHour": to_timestamps(hours),
+                             "Flow": values[:, 0],
+                             "DataQuality": values[:, 1] / np.maximum(values[:, 2], 1),
+                             "TimeSpan": values[:, 3]})
+
+    def cycle(self):
+        """
+        Current pump cycle and level drop.
+        """
+        pumping = bool(self.flow) and self.flow[-1][1] != 0
+
+        return {"flow_group": self.flow_group,
+                "pumping": pumping,
+                "cycle_start": to_timestamps([self.cycle_start])[0] if self.cycle_start is not None else None,
+                "cycle_volume": self.cycle_volume if pumping else 0.0,
+                "level_group": self.level_group,
+                "level_falling": self.falling,
+                "drop_start": to_timestamps([self.drop_start])[0] if self.drop_start is not None else None}
+
+    def latest(self):
+        """
+        Latest level and flow. If the level was measured later than the flow, the flow
+        at that time is the imputed estimate.
+        """
+        level = self.level[-1] if self.level else None
+        flow = self.flow[-1] if self.flow else None
+        imputed = self.imputed is not None and level is not None and (flow is None or flow[0] < level[0])
+        flow = self.imputed if imputed else flow
+
+        return {"TimeStamp": to_timestamps([max(level[0] if level else 0, flow[0] if flow else 0)])[0],
+                "Level": level[1] if level else None,
+                "Flow": flow[1] if flow else None,
+                "Imputed": imputed}
+
+
+class stream_state:
+    """
+    State of all pumps, fed by add() or by tail(). This is the query API: pumps(),
+    series(), hourly_flow(), cycle(), latest() and stats().
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    state = stream_state()
+    asyncio.run(tail("D:/DC3/drop", state, duration=60))
+    state.hourly_flow(8150)
+    """
+    def __init__(self, **pump_params):
+        self.pump_params = pump_params
+        self.states = {}
+        self.records = 0
+        self.seconds = 0.0
+
+    def add(self, rg_id, kind, seconds, value, quality=1):
+        """
+        Adds one record. kind is 'flow' or 'level', seconds the time since 1970.
+        """
+        start = time.perf_counter()
+
+        state = self.states.get(rg_id)
+        if state is None:
+            state = self.states[rg_id] = pump_state(rg_id, **self.pump_params)
+
+        if kind == "flow":
+            state.add_flow(seconds, value, quality)
+        else:
+            state.add_level(seconds, value, quality)
+
+        self.records += 1
+        self.seconds += time.perf_counter() - start
+
+    def pumps(self):
+        return sorted(self.states)
+
+    def series(self, rg_id, kind="flow"):
+        return self.states[rg_id].series(kind)
+
+    def hourly_flow(self, rg_id):
+        return self.states[rg_id].hourly_flow()
+
+    def cycle(self, rg_id):
+        return self.states[rg_id].cycle()
+
+    def latest(self, rg_id):
+        return self.states[rg_id].latest()
+
+    def stats(self):
+        return {"records": self.records,
+                "microseconds_per_record": 1e6 * self.seconds / max(self.records, 1),
+                "dropped": {i: dict(j.dropped) for i, j in self.states.items()}}
+
+
+class file_reader:
+    """
+    Reads the complete lines added to a measurement csv file since the last read.
+    The format (old or historian) is recognised from the header.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.columns = None
+        self.rest = ""
+
+    def read(self):
+        with open(self.path, "r") as file:
+            file.seek(self.offset)
+            text = file.read()
+            self.offset = file.tell()
+
+        lines = (self.rest + text).split("\n")
+        self.rest = lines.pop()
+
+        if self.columns is None and lines:
+            header = lines.pop(0).strip()
+            self.sep = ";" if ";" in header else ","
+            self.columns = {j.strip('"'): i for i, j in enumerate(header.split(self.sep))}
+            self.historian = "historianTagnummer" in self.columns
+
+        return [i.rstrip("\r") for i in lines if i.strip()]
+
+    def parse(self, line):
+        """
+        Returns (rg_id, kind, seconds, value, quality) of a line, as load_files.get_measurements()
+        and load_files.load_all_pumps() would read it.
+        """
+        fields = [i.strip('"') for i in line.split(self.sep)]
+        columns = self.columns
+
+        if self.historian:
+            tag = fields[columns["historianTagnummer"]]
+            kind = "level" if "L0" in tag.upper() or "_L0" in self.path.upper() else "flow"
+            return (int(tag[9:13]), kind, parse_time(fields[columns["datumBeginMeting"]]),
+                    float(fields[columns["hstWaarde"]]), int(float(fields[columns["historianKwaliteit"]]) == 100))
+
+        tag = fields[columns["Tagname"]]
+        return (int(tag[9:13]), "flow" if "Debietmeting" in tag else "level",
+                parse_time(fields[columns["TimeStamp"]]),
+                float(fields[columns["Value"]].replace(",", ".")), int(fields[columns["DataQuality"]] == "Good"))
+
+
+async def tail(path, state, interval=1.0, duration=None, batch=10000):
+    """
+    Follows the csv files in path (and its subfolders): new files and lines added to
+    existing files are read every interval seconds and added to state. Runs for
+    duration seconds, or until cancelled if duration is None. Gives other tasks
+    a turn after every batch lines.
+    """
+    readers = {}
+    end = None if duration is None else time.monotonic() + duration
+
+    while True:
+        for root, folders, files in os.walk(path):
+            for name in sorted(files):
+                if not name.endswith(".csv"):
+                    continue
+                file_path = os.path.join(root, name)
+                if file_path not in readers:
+                    readers[file_path] = file_reader(file_path)
+
+                reader = readers[file_path]
+                for i, line in enumerate(reader.read()):
+                    try:
+                        record = reader.parse(line)
+                    except (ValueError, KeyError, IndexError):
+                        continue
+                    state.add(*record)
+
+                    if (i + 1) % batch == 0:
+                        await asyncio.sleep(0)
+
+        if end is not None and time.monotonic() >= end:
+            return state
+
+        await asyncio.sleep(interval)
+
+
+async def report(state, interval=1.0):
+    """
+    Prints the latest numbers of every pump every interval seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for rg_id in state.pumps():
+            latest, cycle = state.latest(rg_id), state.cycle(rg_id)
+            hourly = state.hourly_flow(rg_id)
+            print("RG{} {} level {} flow {}{} | this hour {:.1f} | cycle {} {}".format(
+                rg_id, latest["TimeStamp"], latest["Level"], latest["Flow"], " (imputed)" if latest["Imputed"] else "",
+                hourly["Flow"].iloc[-1] if len(hourly) else 0.0, cycle["flow_group"],
+                "pumping" if cycle["pumping"] else "idle"))
+        print(state.stats())
+
+
+async def main(path, interval=1.0, duration=None):
+    state = stream_state()
+    reporter = asyncio.ensure_future(report(state, interval))
+    try:
+        await tail(path, state, interval=interval, duration=duration)
+    finally:
+        reporter.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="folder new measurement files are dropped in")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between checks for new data")
+    parser.add_argument("--duration", type=float, help="seconds to run, by default until interrupted")
+    args = parser.parse_args()
+
+    try:
+        asyncio.get_event_loop().run_until_complete(main(args.path, args.interval, args.duration))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,309 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+# Objective: Generate synthetic data in the formats       #
+# provided by Aa-en-Maas (measurements, rain timeseries,  #
+# rain prediction grids and shape files), so the code can #
+# be run and benchmarked without the data share.          #
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
+
+import os
+import numpy as np
+import pandas as pd
+import preprocessing
+
+
+# Pumps that can be generated, with their RG code and village code
+PUMPS = [("Drunen", 8150, "DRU"),
+         ("Haarsteeg", 8170, "HAA"),
+         ("Bokhoven", 8180, "BOK")]
+
+# Location of the waste water treatment plant the pumps deliver to
+WWTP = "WWTP"
+
+TIME_FORMAT = "%d-%m-%Y %H:%M:%S"
+FILE_TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+
+def rain_series(area_names, days=14, start="2018-03-01", interval=60, seed=0):
+    """
+    Rain per area in mm in the format of load_files.get_rain(...) (columns 'Start',
+    'End' and one column per area name). Rain falls in events that start and stop
+    at random (a two state Markov chain) and differ a little between areas.
+
+    interval:  Minutes per time step
+    """
+    rng = np.random.RandomState(seed)
+
+    starts = pd.date_range(start, periods=days * 24 * 60 // interval, freq="{}min".format(interval))
+    hours = interval / 60
+
+    # Wet or dry per time step, chance of starting or stopping rain per hour
+    wet = np.zeros(len(starts), dtype=bool)
+    draws = rng.rand(len(starts))
+    for i in range(1, len(starts)):
+        wet[i] = draws[i] < (0.7 ** hours if wet[i-1] else 1 - 0.95 ** hours)
+
+    intensity = wet * rng.exponential(1.5 * hours, len(starts))
+    local = rng.lognormal(0, 0.3, (len(starts), len(area_names)))
+
+    rain_data = pd.DataFrame(np.round(intensity[:, None] * local, 2), columns=area_names)
+    rain_data.insert(0, "End", starts + pd.Timedelta(minutes=interval))
+    rain_data.insert(0, "Start", starts)
+
+    return rain_data
+
+
+def pump_measurements(rain, days=14, start="2018-03-01", sampling=60, capacity=600, area=1.5,
+                      well_area=100, on_level=150, off_level=80, seed=0):
+    """
+    Simulates a pump with a wet well. The well fills with dry weather flow (with a
+    daily pattern) plus run-off of rain, and is emptied at capacity (m3/h) between
+    on_level and off_level (cm).
+
+    rain:      Rain in mm per hour of the connected area, a series indexed by time
+    area:      Connected area in square-kilometres
+    sampling:  Seconds between measurements
+
+    Returns the flow and level measurements with the columns 'TimeStamp', 'Value' and
+    'DataQuality'. As in the real data flow is only measured while the pump is running.
+    """
+    rng = np.random.RandomState(seed)
+
+    timestamps = pd.date_range(start, periods=int(days * 86400 / sampling), freq="{}s".format(sampling))
+
+    # Inflow in m3/h: dry weather flow plus 30% of the rain on the area
+    hour = timestamps.hour.values + timestamps.minute.values / 60
+    dry_weather = 150 * (1 + 0.5 * np.sin(2 * np.pi * (hour - 8) / 24))
+    rain = rain.reindex(timestamps.floor("h")).fillna(0).values
+    inflow = dry_weather + 0.3 * rain * area * 1000
+
+    # Level in cm (hysteresis of the pump makes this sequential)
+    level = np.empty(len(timestamps))
+    pumping = np.zeros(len(timestamps), dtype=bool)
+    current, on = off_level, False
+    for i in range(len(timestamps)):
+        current += (inflow[i] - on * capacity) * sampling / 3600 / well_area * 100
+        if current >= on_level:
+            on = True
+        elif current <= off_level:
+            on = False
+        current = max(current, 0)
+        level[i], pumping[i] = current, on
+
+    flow = pumping * capacity * rng.normal(1, 0.02, len(timestamps))
+    level = level + rng.normal(0, 0.3, len(timestamps))
+
+    # Flow is measured while pumping and at the first step after it stopped,
+    # some level measurements are missing
+    measured = pumping | np.roll(pumping, 1)
+    flow_data = pd.DataFrame({"TimeStamp": timestamps[measured],
+                              "Value": flow[measured].round(3),
+                              "DataQuality": (rng.rand(measured.sum()) > 0.005).astype(int)})
+
+    measured = rng.rand(len(timestamps)) > 0.02
+    level_data = pd.DataFrame({"TimeStamp": timestamps[measured],
+                               "Value": level[measured].round(2),
+                               "DataQuality": (rng.rand(measured.sum()) > 0.005).astype(int)})
+
+    return flow_data, level_data
+
+
+def write_measurements(path, rg_id, flow_data, level_data, fmt="old", days_per_file=30):
+    """
+    Writes measurements to csv files in path (one file per days_per_file days).
+
+    fmt:  'old' for the semicolon separated files read by load_files.get_measurements(...),
+          'historian' for the comma separated historian files read by
+          load_files.load_all_pumps(...). Historian flow and level are written to
+          separate folders path + '_Q0' and path + '_L0'.
+    """
+    if fmt == "old":
+        data = pd.concat([flow_data.assign(Tagname="SCADA_RG_{}_Debietmeting.Q".format(rg_id)),
+                          level_data.assign(Tagname="SCADA_RG_{}_Niveaumeting.L".format(rg_id))],
+                         ignore_index=True)
+        data = data.sort_values("TimeStamp", kind="mergesort")
+        folders = {path: data}
+    elif fmt == "historian":
+        folders = {path + "_Q0": flow_data.assign(historianTagnummer="SCADA_RG_{}_Q0".format(rg_id)),
+                   path + "_L0": level_data.assign(historianTagnummer="SCADA_RG_{}_L0".format(rg_id))}
+    else:
+        raise ValueError("Unknown format '{}', use 'old' or 'historian'".format(fmt))
+
+    for folder, data in folders.items():
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        period = (data["TimeStamp"] - data["TimeStamp"].iloc[0]).dt.days // days_per_file
+        for i, part in data.groupby(period):
+            file_name = folder + "/" + os.path.basename(folder) + "_{:03d}.csv".format(i)
+
+            if fmt == "old":
+                part = pd.DataFrame({"Tagname": part["Tagname"],
+                                     "TimeStamp": part["TimeStamp"].dt.strftime(TIME_FORMAT),
+                                     "Value": part["Value"].astype(str).str.replace(".", ",", regex=False),
+                                     "DataQuality": np.where(part["DataQuality"] == 1, "Good", "Bad")})
+                part.to_csv(file_name, sep=";", index=False)
+            else:
+                part = pd.DataFrame({"historianTagnummer": part["historianTagnummer"],
+                                     "datumBeginMeting": part["TimeStamp"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+                                     "hstWaarde": part["Value"],
+                                     "historianKwaliteit": np.where(part["DataQuality"] == 1, 100, 0)})
+                part.to_csv(file_name, sep=",", index=False)
+
+
+def write_rain(path, rain_data):
+    """
+    Writes rain data in the format read by load_files.get_rain(...): two lines of
+    header text, then 'Begin', 'Eind' and one column per area.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    data = rain_data.rename(columns={"Start": "Begin", "End": "Eind"})
+    data["Begin"] = data["Begin"].dt.strftime(TIME_FORMAT)
+    data["Eind"] = data["Eind"].dt.strftime(TIME_FORMAT)
+
+    with open(path + "/rain_timeseries.csv", "w") as file:
+        file.write("Synthetic rain timeseries\nmm per interval\n")
+        data.to_csv(file, index=False)
+
+
+def write_rain_prediction(path, rain_data, grid_size=300, lead=1, seed=0):
+    """
+    Writes one HARMONIE-style ASCII grid per time step of rain_data, with the rain
+    predicted lead hours before the start of the time step. The grid is a smooth
+    random field scaled by the mean rain of the time step. File names hold the
+    prediction, start and end times, as read by load_files.get_rain_prediction(...).
+    """
+    rng = np.random.RandomState(seed)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    mean_rain = rain_data.iloc[:, 2:].mean(axis=1).values
+    block = int(np.ceil(grid_size / 10))
+
+    header = "ncols {0}\nnrows {0}\nxllcorner {1}\nyllcorner {2}\ndx {3}\ndy {4}\nNODATA_value -9999\n"\
+             .format(grid_size, preprocessing.X_SPACE[0], preprocessing.Y_SPACE[0],
+                     preprocessing.CELL_WIDTH, preprocessing.CELL_HEIGHT)
+
+    for start, end, rain in zip(rain_data["Start"], rain_data["End"], mean_rain):
+        pattern = np.kron(rng.gamma(2, 0.5, (10, 10)), np.ones((block, block)))[:grid_size, :grid_size]
+        file_name = "harmonie_prec_{}_{}_{}_.asc".format((start - pd.Timedelta(hours=lead)).strftime(FILE_TIME_FORMAT),
+                                                         start.strftime(FILE_TIME_FORMAT),
+                                                         end.strftime(FILE_TIME_FORMAT))
+
+        np.savetxt(path + "/" + file_name, rain * pattern, fmt="%.2f", header=header.rstrip("\n"), comments="")
+
+
+def write_shape_files(path, pumps, areas=6, seed=0):
+    """
+    Writes the shape files read by load_files.sdf(...) (Rioleringsdeelgebied, Rioolgemaal,
+    Zuiveringsregio, RWZI and Leidingtrace), in EPSG:28992. Every pump gets areas
+    rectangular sub-catchments around it and delivers to one treatment plant.
+
+    Returns the area data as read by load_files.sdf(...).area_data.
+    """
+    import geopandas as gpd
+    from shapely.geometry import box, LineString
+
+    rng = np.random.RandomState(seed)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    # Pump and treatment plant locations in the Dutch grid
+    names = [i[0] for i in pumps] + [WWTP]
+    spots = gpd.GeoSeries(gpd.points_from_xy([preprocessing.rg_spots[i][1] for i in names],
+                                             [preprocessing.rg_spots[i][0] for i in names]),
+                          crs="epsg:4326").to_crs("epsg:28992")
+    wwtp = spots.iloc[-1]
+
+    rows = []
+    for (name, rg_id, village_code), spot in zip(pumps, spots):
+        for i in range(areas):
+            x = spot.x + rng.uniform(-3000, 3000)
+            y = spot.y + rng.uniform(-3000, 3000)
+            rows += [{"RGDIDENT": "RGD-{}-{:03d}".format(village_code, i + 1),
+                      "NAAMRGD": "{} {}".format(name, i + 1),
+                      "RGDID": len(rows) + 1,
+                      "geometry": box(x, y, x + rng.uniform(300, 1500), y + rng.uniform(300, 1500))}]
+    area_data = gpd.GeoDataFrame(rows, crs="epsg:28992")
+    area_data.to_file(path + "/Rioleringsdeelgebied.shp")
+
+    RG_data = gpd.GeoDataFrame({"ZRE_ID": range(1, len(pumps) + 1),
+                                "ZREIDENT": [i[1] for i in pumps],
+                                "ZRW_ZRW_ID": 1,
+                                "ZRGCAPA1": 300.0,
+                                "ZRE_ZRE_ID": 0,
+                                "ZRGRGCAP": 600.0,
+                                "ZRGGANGL": [i[0] for i in pumps]},
+                               geometry=list(spots.iloc[:-1]), crs="epsg:28992")
+    RG_data.to_file(path + "/Rioolgemaal.shp")
+
+    region = gpd.GeoDataFrame({"GAGNAAM": [WWTP]}, geometry=[area_data.unary_union.convex_hull.buffer(1000)],
+                              crs="epsg:28992")
+    region.to_file(path + "/Zuiveringsregio.shp")
+
+    gpd.GeoDataFrame({"ZRW_ID": [1], "ZRWIDENT": ["RWZI-1"], "ZRWNAAM": [WWTP]},
+                     geometry=[wwtp], crs="epsg:28992").to_file(path + "/RWZI.shp")
+
+    gpd.GeoDataFrame({"LDG_ID": range(1, len(pumps) + 1),
+                      "IDENTIFICA": ["LDG-{}".format(i[1]) for i in pumps],
+                      "TRACE_NAAM": ["{} - {}".format(i[0], WWTP) for i in pumps],
+                      "STATUS": "in gebruik"},
+                     geometry=[LineString([i, wwtp]) for i in spots.iloc[:-1]],
+                     crs="epsg:28992").to_file(path + "/Leidingtrace.shp")
+
+    area_data = area_data.rename(columns={"RGDIDENT": "sewer_system", "NAAMRGD": "area_name", "RGDID": "area_ID"})
+    area_data["area"] = area_data.area
+
+    return area_data[["sewer_system", "area_name", "area_ID", "area", "geometry"]]
+
+
+def generate(path, days=14, pumps=1, sampling=60, areas=6, start="2018-03-01", grid_size=300, seed=0):
+    """
+    Writes a complete synthetic data set to path, in the folder layout used by main.py.
+
+    ~~~~~ INPUT  ~~~~~
+    days:       Number of days of data
+    pumps:      Number of pumps (from PUMPS), measurements are written in both formats
+    sampling:   Seconds between measurements
+    areas:      Number of sub-catchments per pump
+    grid_size:  Rows and columns of the rain prediction grids (300 as HARMONIE)
+
+    ~~~~~ OUTPUT ~~~~~
+    Dictionary with the paths of the generated data: 'measurements' and 'historian'
+    (folder per pump name), 'rain_data', 'rain_prediction' and 'shape_files'.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    paths = generate("C:/mypath/synthetic", days=30, pumps=2)
+    flow_data, level_data = load_files.get_measurements(paths["measurements"]["Drunen"])
+    """
+    pumps = PUMPS[:pumps]
+
+    paths = {"measurements": {}, "historian": {},
+             "rain_data": os.path.join(path, "sewer_data", "rain_timeseries"),
+             "rain_prediction": os.path.join(path, "sewer_data", "rain_grid_prediction"),
+             "shape_files": os.path.join(path, "sewer_model", "aa-en-maas_sewer_shp")}
+
+    area_data = write_shape_files(paths["shape_files"], pumps, areas=areas, seed=seed)
+
+    rain_data = rain_series(list(area_data["area_name"]), days=days, start=start, seed=seed)
+    write_rain(paths["rain_data"], rain_data)
+    write_rain_prediction(paths["rain_prediction"], rain_data, grid_size=grid_size, seed=seed)
+
+    for k, (name, rg_id, village_code) in enumerate(pumps):
+        village = area_data["sewer_system"].str.slice(4, 7) == village_code
+        rain = rain_data.set_index("Start")[list(area_data.loc[village, "area_name"])].mean(axis=1)
+
+        flow_data, level_data = pump_measurements(rain, days=days, start=start, sampling=sampling,
+                                                  seed=seed + k)
+
+        folder = os.path.join(path, "sewer_data", "data_pump", "RG{}".format(rg_id))
+        write_measurements(folder, rg_id, flow_data, level_data, fmt="old")
+        write_measurements(folder, rg_id, flow_data, level_data, fmt="historian")
+
+        paths["measurements"][name] = folder
+        paths["historian"][name] = (folder + "_Q0", folder + "_L0")
+
+    return paths
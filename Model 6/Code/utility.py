@@ -1,4 +1,7 @@
 import os
+import sys
+import subprocess
+import weakref
 import pandas as pd
 import numpy as np
 import datetime
@@ -143,4 +146,65 @@ def search_for(x, start_path, last_instance=True):
         if x in last_path_folders:
             path = path + "\\" + x
 
-    return path
\ No newline at end of file
+    return path
+
+
+def import_time(modules, cwd=None):
+    """
+    Measures the time in seconds it takes to import modules (a list of module
+    names) in a fresh python process, i.e. the start up time of a script using them.
+    """
+    code = "import time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)"\
+           .format(", ".join(modules))
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=cwd)
+
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def frame_signature(df, rows=1000):
+    """
+    Cheap summary of the contents of a data frame: its shape, columns, dtypes, CRS (for geo
+    data frames) and a hash of at most rows evenly spread rows, so it takes about the same
+    time for any length of df. Geometries are represented by their bounds. Changes that
+    leave all of these rows as they are (e.g. to a single value) are not seen; pass a copy
+    of df after such changes.
+    """
+    sample = df.iloc[np.unique(np.linspace(0, len(df) - 1, min(len(df), rows)).astype(np.int64))]
+    columns = [i for i in df.columns if i != "geometry"]
+    signature = (df.shape, tuple(df.columns), tuple(str(i) for i in df.dtypes), str(getattr(df, "crs", None)),
+                 int(pd.util.hash_pandas_object(sample[columns], index=True).sum()))
+
+    if "geometry" in df.columns:
+        bounds = np.ascontiguousarray(sample["geometry"].bounds.values, dtype=np.float64)
+        signature += (hash(bounds.tobytes()),)
+
+    return signature
+
+
+class object_cache:
+    """
+    Values computed from objects (e.g. data frames), kept as long as the object exists and
+    its signature (e.g. frame_signature()) has not changed. Entries are removed when the
+    object is garbage collected, so the cache does not keep objects alive; the values
+    should not refer to the object themselves.
+
+    ~~~~~ EXAMPLE CALL ~~~~~
+    _tables = object_cache()
+    table = _tables.get(area_data, frame_signature(area_data), lambda: area_table(area_data))
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def _remove(self, key, ref):
+        if key in self.entries and self.entries[key][0] is ref:
+            del self.entries[key]
+
+    def get(self, obj, signature, compute):
+        key = id(obj)
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0]() is not obj or entry[1] != signature:
+            ref = weakref.ref(obj, lambda ref, key=key: self._remove(key, ref))
+            self.entries[key] = (ref, signature, compute())
+
+        return self.entries[key][2]